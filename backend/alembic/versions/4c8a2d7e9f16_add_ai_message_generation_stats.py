@@ -0,0 +1,40 @@
+"""add_ai_message_generation_stats
+
+Revision ID: 4c8a2d7e9f16
+Revises: 9b3e6f1d2c57
+Create Date: 2026-10-19 16:02:41.552810
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4c8a2d7e9f16'
+down_revision: Union[str, None] = '9b3e6f1d2c57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('ai_messages', sa.Column('backend', sa.String(length=50), nullable=True, comment='生成回答的后端'))
+    op.add_column('ai_messages', sa.Column('queue_time', sa.Float(), nullable=True, comment='排队等待时间（秒）'))
+    op.add_column('ai_messages', sa.Column('time_to_first_token', sa.Float(), nullable=True, comment='首个token延迟（秒）'))
+    op.add_column('ai_messages', sa.Column('prefill_time', sa.Float(), nullable=True, comment='预填充耗时（秒）'))
+    op.add_column('ai_messages', sa.Column('prompt_tokens', sa.Integer(), nullable=True, comment='提示token数'))
+    op.add_column('ai_messages', sa.Column('completion_tokens', sa.Integer(), nullable=True, comment='生成token数'))
+    op.add_column('ai_messages', sa.Column('tokens_per_second', sa.Float(), nullable=True, comment='每秒生成token数'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('ai_messages', 'tokens_per_second')
+    op.drop_column('ai_messages', 'completion_tokens')
+    op.drop_column('ai_messages', 'prompt_tokens')
+    op.drop_column('ai_messages', 'prefill_time')
+    op.drop_column('ai_messages', 'time_to_first_token')
+    op.drop_column('ai_messages', 'queue_time')
+    op.drop_column('ai_messages', 'backend')
@@ -0,0 +1,47 @@
+"""add_upload_blobs
+
+Revision ID: 5d1f8a3c6b92
+Revises: 7e2b5c9a4d31
+Create Date: 2026-10-19 21:07:42.581903
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d1f8a3c6b92'
+down_revision: Union[str, None] = '7e2b5c9a4d31'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'upload_blobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('sha256', sa.String(length=64), nullable=False, comment='文件内容的SHA-256'),
+        sa.Column('size', sa.Integer(), nullable=False, comment='文件大小（字节）'),
+        sa.Column('storage_path', sa.String(length=512), nullable=False, comment='相对上传目录的存储路径'),
+        sa.Column('ref_count', sa.Integer(), nullable=False, comment='引用该文件的上传记录数'),
+        sa.Column('created_at', sa.DateTime(), nullable=False, comment='创建时间'),
+        sa.Column('updated_at', sa.DateTime(), nullable=False, comment='更新时间'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('sha256')
+    )
+    op.create_index(op.f('ix_upload_blobs_id'), 'upload_blobs', ['id'], unique=False)
+    op.add_column('uploads', sa.Column('blob_id', sa.Integer(), nullable=True, comment='存储文件ID，为空表示去重存储之前上传的文件'))
+    op.create_foreign_key('fk_uploads_blob_id', 'uploads', 'upload_blobs', ['blob_id'], ['id'])
+    op.create_index('ix_uploads_blob_id', 'uploads', ['blob_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_uploads_blob_id', table_name='uploads')
+    op.drop_constraint('fk_uploads_blob_id', 'uploads', type_='foreignkey')
+    op.drop_column('uploads', 'blob_id')
+    op.drop_index(op.f('ix_upload_blobs_id'), table_name='upload_blobs')
+    op.drop_table('upload_blobs')
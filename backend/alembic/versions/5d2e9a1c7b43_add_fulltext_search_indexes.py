@@ -0,0 +1,37 @@
+"""add_fulltext_search_indexes
+
+Revision ID: 5d2e9a1c7b43
+Revises: 8c1d4e2f7a90
+Create Date: 2026-10-19 10:03:17.552031
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d2e9a1c7b43'
+down_revision: Union[str, None] = '8c1d4e2f7a90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # ngram全文索引仅MySQL支持，其他数据库的搜索回退到LIKE
+    if op.get_bind().dialect.name not in ('mysql', 'mariadb'):
+        return
+    op.create_index('ft_notifications_title_content', 'notifications', ['title', 'content'], unique=False, mysql_prefix='FULLTEXT', mysql_with_parser='ngram')
+    op.create_index('ft_students_full_name', 'students', ['full_name'], unique=False, mysql_prefix='FULLTEXT', mysql_with_parser='ngram')
+    op.create_index('ft_students_student_id_no', 'students', ['student_id_no'], unique=False, mysql_prefix='FULLTEXT', mysql_with_parser='ngram')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name not in ('mysql', 'mariadb'):
+        return
+    op.drop_index('ft_students_student_id_no', table_name='students')
+    op.drop_index('ft_students_full_name', table_name='students')
+    op.drop_index('ft_notifications_title_content', table_name='notifications')
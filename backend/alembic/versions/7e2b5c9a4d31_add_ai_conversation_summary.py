@@ -0,0 +1,34 @@
+"""add_ai_conversation_summary
+
+Revision ID: 7e2b5c9a4d31
+Revises: 4c8a2d7e9f16
+Create Date: 2026-10-19 18:24:09.317254
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7e2b5c9a4d31'
+down_revision: Union[str, None] = '4c8a2d7e9f16'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('ai_conversations', sa.Column('summary', sa.Text(), nullable=True, comment='对话摘要'))
+    op.add_column('ai_conversations', sa.Column('summary_message_id', sa.Integer(), nullable=True, comment='摘要包含的最后一条消息ID'))
+    op.add_column('ai_conversations', sa.Column('summarized_at', sa.DateTime(), nullable=True, comment='最近一次后台处理时会话的更新时间，早于updated_at表示之后有新消息'))
+    op.create_index('ix_ai_conversations_updated_at', 'ai_conversations', ['updated_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_ai_conversations_updated_at', table_name='ai_conversations')
+    op.drop_column('ai_conversations', 'summarized_at')
+    op.drop_column('ai_conversations', 'summary_message_id')
+    op.drop_column('ai_conversations', 'summary')
@@ -0,0 +1,73 @@
+"""add_notification_recipients
+
+Revision ID: 8c1d4e2f7a90
+Revises: 3a7b0f6be782
+Create Date: 2026-10-19 09:12:41.204518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c1d4e2f7a90'
+down_revision: Union[str, None] = '3a7b0f6be782'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('notification_recipients',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('notification_id', sa.Integer(), nullable=False, comment='通知ID'),
+    sa.Column('user_id', sa.Integer(), nullable=False, comment='接收者用户ID'),
+    sa.Column('is_read', sa.Boolean(), nullable=False, comment='是否已读'),
+    sa.Column('created_at', sa.DateTime(), nullable=False, comment='通知创建时间（冗余存储，用于排序）'),
+    sa.Column('read_at', sa.DateTime(), nullable=True, comment='阅读时间'),
+    sa.ForeignKeyConstraint(['notification_id'], ['notifications.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('notification_id', 'user_id', name='uq_notification_recipients_notification_user')
+    )
+    op.create_index(op.f('ix_notification_recipients_id'), 'notification_recipients', ['id'], unique=False)
+    op.create_index('ix_notification_recipients_user_id_is_read_created_at', 'notification_recipients', ['user_id', 'is_read', 'created_at'], unique=False)
+    op.create_index('ix_notification_recipients_user_id_created_at', 'notification_recipients', ['user_id', 'created_at'], unique=False)
+
+    # 为已有通知回填收件箱：个人通知、角色通知、广播通知
+    op.execute(
+        """
+        INSERT INTO notification_recipients (notification_id, user_id, is_read, created_at, read_at)
+        SELECT n.id, n.recipient_user_id, COALESCE(n.is_read, 0), n.created_at, n.read_at
+        FROM notifications n
+        WHERE n.recipient_user_id IS NOT NULL
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO notification_recipients (notification_id, user_id, is_read, created_at, read_at)
+        SELECT n.id, u.id, COALESCE(n.is_read, 0), n.created_at, n.read_at
+        FROM notifications n
+        JOIN users u ON u.role_id = n.recipient_role_id
+        WHERE n.recipient_user_id IS NULL AND n.recipient_role_id IS NOT NULL
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO notification_recipients (notification_id, user_id, is_read, created_at, read_at)
+        SELECT n.id, u.id, COALESCE(n.is_read, 0), n.created_at, n.read_at
+        FROM notifications n
+        CROSS JOIN users u
+        WHERE n.recipient_user_id IS NULL AND n.recipient_role_id IS NULL
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_notification_recipients_user_id_created_at', table_name='notification_recipients')
+    op.drop_index('ix_notification_recipients_user_id_is_read_created_at', table_name='notification_recipients')
+    op.drop_index(op.f('ix_notification_recipients_id'), table_name='notification_recipients')
+    op.drop_table('notification_recipients')
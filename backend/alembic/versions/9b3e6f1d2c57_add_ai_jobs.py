@@ -0,0 +1,59 @@
+"""add_ai_jobs
+
+Revision ID: 9b3e6f1d2c57
+Revises: 5d2e9a1c7b43
+Create Date: 2026-10-19 14:26:08.317942
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b3e6f1d2c57'
+down_revision: Union[str, None] = '5d2e9a1c7b43'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('ai_jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False, comment='用户ID'),
+    sa.Column('conversation_id', sa.Integer(), nullable=False, comment='对话ID'),
+    sa.Column('message_id', sa.Integer(), nullable=True, comment='触发任务的用户消息ID'),
+    sa.Column('query_text', sa.Text(), nullable=False, comment='查询内容'),
+    sa.Column('use_local_model', sa.Boolean(), nullable=False, comment='是否使用本地模型'),
+    sa.Column('model_name', sa.String(length=100), nullable=True, comment='使用的模型名称'),
+    sa.Column('use_think_mode', sa.Boolean(), nullable=False, comment='是否使用思考模式'),
+    sa.Column('status', sa.String(length=20), nullable=False, comment='状态：pending/running/succeeded/failed'),
+    sa.Column('attempts', sa.Integer(), nullable=False, comment='已执行次数'),
+    sa.Column('max_attempts', sa.Integer(), nullable=False, comment='最多执行次数'),
+    sa.Column('run_after', sa.DateTime(), nullable=False, comment='最早执行时间，用于重试退避'),
+    sa.Column('locked_by', sa.String(length=64), nullable=True, comment='执行中的worker'),
+    sa.Column('locked_at', sa.DateTime(), nullable=True, comment='领取时间，超过租约时间视为worker已退出'),
+    sa.Column('result_message_id', sa.Integer(), nullable=True, comment='生成的助手消息ID'),
+    sa.Column('error', sa.Text(), nullable=True, comment='最近一次失败原因'),
+    sa.Column('created_at', sa.DateTime(), nullable=False, comment='创建时间'),
+    sa.Column('updated_at', sa.DateTime(), nullable=False, comment='更新时间'),
+    sa.Column('finished_at', sa.DateTime(), nullable=True, comment='完成时间'),
+    sa.ForeignKeyConstraint(['conversation_id'], ['ai_conversations.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['message_id'], ['ai_messages.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['result_message_id'], ['ai_messages.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_ai_jobs_id'), 'ai_jobs', ['id'], unique=False)
+    op.create_index('ix_ai_jobs_status_run_after', 'ai_jobs', ['status', 'run_after'], unique=False)
+    op.create_index('ix_ai_jobs_user_id_created_at', 'ai_jobs', ['user_id', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_ai_jobs_user_id_created_at', table_name='ai_jobs')
+    op.drop_index('ix_ai_jobs_status_run_after', table_name='ai_jobs')
+    op.drop_index(op.f('ix_ai_jobs_id'), table_name='ai_jobs')
+    op.drop_table('ai_jobs')
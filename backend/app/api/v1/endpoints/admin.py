@@ -1,12 +1,18 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 import os
 import subprocess
 import sys
 import signal
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.api.deps import get_db
 from app.core.permissions import require_permissions
+from app.crud.ai_conversation import message as message_crud
+from app.crud import uploads as crud_uploads
 from app.models.user import User
+from app.schemas.ai_conversation import ConversationGenerationDetail, ConversationGenerationSummary
+from app.schemas.uploads import UploadStorageStats
 from app.core.config import settings
 from pathlib import Path
 from dotenv import load_dotenv, find_dotenv, set_key
@@ -185,4 +191,54 @@ async def restart_server(
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"无法重启服务器: {str(e)}"
-        ) 
\ No newline at end of file
+        )
+
+
+@router.get("/ai-metrics/conversations", response_model=List[ConversationGenerationSummary])
+async def list_conversation_ai_metrics(
+    db: AsyncSession = Depends(get_db),
+    user_id: Optional[int] = Query(None, description="只统计指定用户的对话"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = require_permissions(path="/api/v1/admin/ai-metrics/conversations", method="GET")
+) -> Any:
+    """
+    按对话汇总AI助手的生成统计
+    
+    包括token数、平均排队时间、首个token延迟、预填充耗时和每秒生成token数，需要管理员权限访问
+    """
+    return await message_crud.get_generation_summary(db, user_id=user_id, skip=skip, limit=limit)
+
+
+@router.get("/ai-metrics/conversations/{conversation_id}", response_model=ConversationGenerationDetail)
+async def get_conversation_ai_metrics(
+    conversation_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = require_permissions(path="/api/v1/admin/ai-metrics/conversations/{conversation_id}", method="GET")
+) -> Any:
+    """
+    获取对话中每条助手消息的生成统计
+    
+    需要管理员权限访问
+    """
+    summary = await message_crud.get_generation_summary(db, conversation_id=conversation_id, limit=1)
+    if not summary:
+        raise HTTPException(status_code=404, detail="Conversation not found or has no answers")
+    
+    return {
+        "summary": summary[0],
+        "messages": await message_crud.get_generation_messages(db, conversation_id=conversation_id)
+    }
+
+
+@router.get("/upload-storage", response_model=UploadStorageStats)
+async def get_upload_storage_stats(
+    db: AsyncSession = Depends(get_db),
+    current_user: User = require_permissions(path="/api/v1/admin/upload-storage", method="GET")
+) -> Any:
+    """
+    获取上传文件去重存储的统计
+
+    包括上传记录数、实际保存的文件数、节省的空间和去重比例，需要管理员权限访问
+    """
+    return await crud_uploads.get_storage_stats(db)
@@ -2,10 +2,11 @@ from typing import Any, List, Optional, Dict
 from datetime import datetime, timezone
 import asyncio
 import hashlib
-import time
 import uuid
 
-from fastapi import APIRouter, Depends, HTTPException, Path, Query, Body, status, UploadFile, File, Form, Request
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Body, status, UploadFile, File, Form, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from pydantic import BaseModel
@@ -19,21 +20,23 @@ from app.models.user import User
 from app.models.ai_conversation import AIMessage  # 添加数据库模型导入
 from app.crud.ai_conversation import conversation as conversation_crud, message as message_crud
 from app.schemas.ai_conversation import (
-    Conversation, ConversationList, ConversationCreate, 
-    ConversationUpdate, Message, MessageCreate
+    Conversation, ConversationList, ConversationCreate, ConversationSummary,
+    ConversationUpdate, Message, MessageCreate, AIJobStatus
 )
+from app.services.ai_jobs import ai_job_queue
 from app.services.ai_service import ai_assistant
+from app.services.conversation_history import conversation_history
+from app.services.generation_registry import CANCEL_REQUESTED, CANCEL_SUPERSEDED, generation_registry
+from app.services.keyed_lock import conversation_locks
+from app.services.query_suggestions import query_suggestions
+from app.services.request_dedupe import message_requests, message_submissions
 from app.core.config import settings
+from app.core.errors import GenerationCancelledError, ServiceOverloadedError
 from app.services.upload_service import upload_service
+from app.services.attachment_extractor import attachment_extractor
 from app.crud.base import CRUDBase
 from app.db.session import safe_db_transaction, get_session_context, async_session
-
-# 消息提交缓存，用于防止重复提交
-message_submission_cache: Dict[str, float] = {}
-# 添加请求ID缓存，避免重复处理相同请求
-request_id_cache: Dict[str, Dict] = {}
-# 添加消息创建锁，确保消息按顺序创建
-message_creation_locks: Dict[int, str] = {}
+from app.utils.pagination import NEXT_CURSOR_HEADER, decode_cursor
 
 # 简单的响应模型
 class ResponseBase(BaseModel):
@@ -42,26 +45,98 @@ class ResponseBase(BaseModel):
 
 router = APIRouter()
 
+
+def _parse_cursor(cursor: Optional[str]):
+    """解析分页游标，格式不正确时返回400"""
+    if not cursor:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.post("/query")
 async def create_ai_query(
     *,
     db: AsyncSession = Depends(get_db),
+    request: Request,
     query_text: str = Body(...),
     context_data: Optional[Dict[str, Any]] = Body(None),
     current_user: User = require_permissions(path="/api/v1/ai-assistant/query", method="POST")
 ) -> Any:
     """
     创建新的AI查询（HTTP方式，用于不支持WebSocket的场景）
+    
+    客户端断开或同一会话发送了新的问题时停止生成
     """
-    result = await ai_assistant.process_query(
-        db,
+    result = await generation_registry.run(
+        ai_assistant.process_query(
+            db,
+            user_id=current_user.id,
+            query_text=query_text,
+            context_data=context_data
+        ),
         user_id=current_user.id,
-        query_text=query_text,
-        context_data=context_data
+        conversation_id=(context_data or {}).get("conversation_id"),
+        source="http",
+        request=request
     )
     
     return result
 
+@router.post("/query/stream")
+async def create_ai_query_stream(
+    *,
+    query_text: str = Body(...),
+    context_data: Optional[Dict[str, Any]] = Body(None),
+    current_user: User = require_permissions(path="/api/v1/ai-assistant/query/stream", method="POST")
+) -> Any:
+    """
+    创建流式AI查询（SSE方式），逐段推送生成的token
+
+    事件格式：
+    - event: token，data为{"content": 增量文本}
+    - event: response，data与/query的返回值相同，生成完成后推送一次
+    - event: cancelled，data为{"reason": 取消原因}，同一会话发送了新的问题或生成被取消时推送
+    """
+    user_id = current_user.id
+
+    async def event_stream():
+        # 流式响应的生命周期可能长于请求依赖，使用独立会话保存消息
+        session = async_session()
+        # 客户端断开时响应被取消，生成随之停止
+        events = generation_registry.iterate(
+            ai_assistant.process_query_stream(
+                session,
+                user_id=user_id,
+                query_text=query_text,
+                context_data=context_data
+            ),
+            user_id=user_id,
+            conversation_id=(context_data or {}).get("conversation_id"),
+            source="http"
+        )
+        try:
+            async for event in events:
+                data = json.dumps(jsonable_encoder(event["data"]), ensure_ascii=False)
+                yield f"event: {event['type']}\ndata: {data}\n\n"
+        except GenerationCancelledError as e:
+            data = json.dumps({"reason": e.reason, "message": e.error_message}, ensure_ascii=False)
+            yield f"event: cancelled\ndata: {data}\n\n"
+        finally:
+            await events.aclose()
+            await session.close()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # 禁止反向代理缓冲，保证token及时送达
+            "X-Accel-Buffering": "no"
+        }
+    )
+
 @router.get("/suggestions")
 async def get_query_suggestions(
     db: AsyncSession = Depends(get_db),
@@ -82,22 +157,29 @@ async def get_query_suggestions(
     }
 
 # 对话相关端点
-@router.get("/conversations", response_model=List[Conversation])
+@router.get("/conversations", response_model=List[ConversationSummary])
 async def read_conversations(
+    response: Response,
     db: AsyncSession = Depends(get_db),
-    skip: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 返回的游标"),
+    skip: int = Query(0, ge=0, deprecated=True, description="偏移分页，仅在没有游标时生效"),
     limit: int = Query(100, ge=1, le=1000),
     current_user: User = require_permissions(path="/api/v1/ai-assistant/conversations", method="GET")
 ) -> Any:
     """
-    获取用户的所有对话
+    获取用户的对话列表，按更新时间降序排序
+
+    每项包含最后一条消息的预览和消息数；还有下一页时通过响应头 X-Next-Cursor 返回游标。
     """
-    conversations = await conversation_crud.get_user_conversations(
+    conversations, next_cursor = await conversation_crud.list_user_conversations(
         db,
         user_id=current_user.id,
-        skip=skip,
-        limit=limit
+        limit=limit,
+        cursor=_parse_cursor(cursor),
+        skip=skip
     )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     
     return conversations
 
@@ -147,9 +229,7 @@ async def update_conversation(
     """
     更新对话标题
     """
-    conversation = await conversation_crud.get(db, id=conversation_id)
-    
-    if not conversation or conversation.user_id != current_user.id:
+    if not await conversation_crud.exists_for_user(db, conversation_id=conversation_id, user_id=current_user.id):
         raise HTTPException(status_code=404, detail="Conversation not found")
     
     conversation = await conversation_crud.update_conversation_title(
@@ -171,9 +251,7 @@ async def delete_conversation(
     """
     删除对话
     """
-    conversation = await conversation_crud.get(db, id=conversation_id)
-    
-    if not conversation or conversation.user_id != current_user.id:
+    if not await conversation_crud.exists_for_user(db, conversation_id=conversation_id, user_id=current_user.id):
         raise HTTPException(status_code=404, detail="Conversation not found")
     
     deleted = await conversation_crud.delete_conversation(
@@ -185,32 +263,41 @@ async def delete_conversation(
     if not deleted:
         raise HTTPException(status_code=400, detail="Failed to delete conversation")
     
+    ai_assistant.forget_conversation(conversation_id)
+    
     return {"status": "success"}
 
 # 消息相关端点
 @router.get("/conversations/{conversation_id}/messages", response_model=List[Message])
 async def read_messages(
     *,
+    response: Response,
     db: AsyncSession = Depends(get_db),
     conversation_id: int = Path(..., gt=0),
-    skip: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 返回的游标"),
+    order: str = Query("asc", pattern="^(asc|desc)$", description="asc从最早的消息开始，desc从最新的消息向前翻页"),
+    skip: int = Query(0, ge=0, deprecated=True, description="偏移分页，仅在没有游标时生效"),
     limit: int = Query(100, ge=1, le=1000),
     current_user: User = require_permissions(path="/api/v1/ai-assistant/conversations/{conversation_id}/messages", method="GET")
 ) -> Any:
     """
-    获取对话中的所有消息
+    获取对话中的消息，按创建时间排序
+
+    还有下一页时通过响应头 X-Next-Cursor 返回游标。
     """
-    conversation = await conversation_crud.get(db, id=conversation_id)
-    
-    if not conversation or conversation.user_id != current_user.id:
+    if not await conversation_crud.exists_for_user(db, conversation_id=conversation_id, user_id=current_user.id):
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    messages = await message_crud.get_conversation_messages(
+    messages, next_cursor = await message_crud.list_messages(
         db,
         conversation_id=conversation_id,
-        skip=skip,
-        limit=limit
+        limit=limit,
+        cursor=_parse_cursor(cursor),
+        descending=order == "desc",
+        skip=skip
     )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     
     # 转换为前端期望的格式
     result = []
@@ -228,6 +315,12 @@ async def read_messages(
     
     return result
 
+async def _remember_response(request_hash: str, request_key: Optional[str], response: Dict[str, Any]) -> None:
+    """保存发送消息的响应，重复提交和相同请求ID的请求直接返回"""
+    await message_submissions.put(request_hash, response)
+    if request_key:
+        await message_requests.put(request_key, response)
+
 @router.post("/conversations/{conversation_id}/messages", response_model=Message)
 async def create_message(
     *,
@@ -248,16 +341,11 @@ async def create_message(
     创建新消息并添加到对话中，可选择等待AI响应完成
     """
     # 打印请求参数以便调试
+    client_request_id = request_id
     request_id = request_id or str(uuid.uuid4())
     print(f"[{request_id}] 接收消息参数: conversation_id={conversation_id}, content={content}, role={role}")
     print(f"[{request_id}] 模型参数: useLocalModel={useLocalModel}, modelName={modelName}, useThinkMode={useThinkMode}, waitForResponse={waitForResponse}")
     
-    # 如果提供了外部请求ID，检查是否已处理过相同请求
-    if request_id in request_id_cache:
-        cached_data = request_id_cache[request_id]
-        print(f"[{request_id}] 检测到重复请求ID，返回缓存结果")
-        return cached_data['response']
-    
     # 安全获取用户ID，确保不会触发SQLAlchemy懒加载
     try:
         user_id = current_user.id
@@ -271,28 +359,19 @@ async def create_message(
                 detail="无法获取用户信息"
             )
     
-    # 检查会话锁
-    conversation_lock_key = f"conversation_lock_{conversation_id}"
-    current_lock = message_creation_locks.get(conversation_id)
-    if current_lock:
-        # 检查锁是否在5秒内创建，如果是则拒绝请求
-        lock_parts = current_lock.split('_')
-        if len(lock_parts) >= 2:
-            try:
-                lock_time = float(lock_parts[0])
-                if time.time() - lock_time < 5:
-                    print(f"[{request_id}] 会话 {conversation_id} 已被锁定，拒绝请求")
-                    raise HTTPException(
-                        status_code=429,
-                        detail="请稍后再试，已有处理中的请求"
-                    )
-            except ValueError:
-                pass  # 锁格式无效，继续处理
-    
-    # 设置新锁
-    new_lock = f"{time.time()}_{request_id}"
-    message_creation_locks[conversation_id] = new_lock
-    print(f"[{request_id}] 为会话 {conversation_id} 设置锁: {new_lock}")
+    # 如果提供了外部请求ID，检查是否已处理过相同请求，请求ID按用户区分
+    request_key = f"{user_id}:{client_request_id}" if client_request_id else None
+    if request_key:
+        claimed, cached_response = await message_requests.claim(request_key)
+        if not claimed:
+            if cached_response is None:
+                print(f"[{request_id}] 相同请求ID的请求正在处理，拒绝请求")
+                raise HTTPException(
+                    status_code=429,
+                    detail="请稍后再试，已有处理中的请求"
+                )
+            print(f"[{request_id}] 检测到重复请求ID，返回缓存结果")
+            return cached_response
     
     # 处理JSON请求体的情况
     if content is None or content.strip() == "":
@@ -351,83 +430,38 @@ async def create_message(
     
     # 创建请求唯一标识，使用已安全获取的user_id
     request_hash = hashlib.md5(f"{conversation_id}-{content}-{role}-{user_id}-{modelName}".encode()).hexdigest()
-    current_time = datetime.now(timezone.utc).timestamp()
-    
-    # 检查是否有相同的请求正在处理或已处理
-    if request_hash in request_id_cache:
-        cached_data = request_id_cache[request_hash]
-        # 如果5秒内收到相同请求，直接返回缓存结果
-        if current_time - cached_data['timestamp'] < 5:
-            print(f"[{request_id}] 检测到完全相同的请求: {request_hash}, 返回缓存结果")
-            # 释放锁
-            if message_creation_locks.get(conversation_id) == new_lock:
-                del message_creation_locks[conversation_id]
-                print(f"[{request_id}] 释放会话锁: {conversation_id}")
-            return cached_data['response']
-    
-    # 防止重复提交检查 - 增强检查逻辑
-    cache_key = f"{conversation_id}-{content}-{role}"
-    
-    if cache_key in message_submission_cache:
-        # 如果5秒内有相同内容的请求，视为重复提交
-        last_time = message_submission_cache[cache_key]
-        if current_time - last_time < 5:
-            print(f"[{request_id}] 检测到重复提交: {cache_key}, 距上次: {current_time - last_time}秒")
-            
-            # 创建一个新的干净会话来检查最近消息
-            async with safe_db_transaction() as clean_db:
-                # 获取最近的一条消息返回
-                recent_messages = await message_crud.get_conversation_messages(
-                    clean_db, conversation_id=conversation_id, limit=10
-                )
-                
-                # 遍历查找内容匹配的消息
-                for recent_message in recent_messages:
-                    if (recent_message.role == role and 
-                        recent_message.content.startswith(content) and
-                        # Fix timezone handling in timestamp comparison
-                        (current_time - recent_message.created_at.replace(tzinfo=timezone.utc).timestamp()) < 10):
-                        print(f"[{request_id}] 找到匹配的消息ID: {recent_message.id}")
-                        # 直接返回消息模型，避免模型转换问题
-                        response = {
-                            "id": recent_message.id,
-                            "role": recent_message.role,
-                            "content": recent_message.content,
-                            "conversation_id": recent_message.conversation_id,
-                            "timestamp": recent_message.created_at,
-                            "processing_time": recent_message.processing_time,
-                            "use_local_model": recent_message.use_local_model,
-                            "model_name": recent_message.model_name
-                        }
-                        # 缓存结果
-                        request_id_cache[request_hash] = {
-                            'timestamp': current_time,
-                            'response': response
-                        }
-                        # 缓存请求ID结果
-                        if request_id:
-                            request_id_cache[request_id] = {
-                                'timestamp': current_time,
-                                'response': response
-                            }
-                        # 释放锁
-                        if message_creation_locks.get(conversation_id) == new_lock:
-                            del message_creation_locks[conversation_id]
-                            print(f"[{request_id}] 释放会话锁: {conversation_id}")
-                        return response
     
-    # 更新缓存
-    message_submission_cache[cache_key] = current_time
+    # 如果 AI_MESSAGE_DUPLICATE_WINDOW 秒内收到相同请求，直接返回缓存结果
+    cached_response = await message_submissions.get(request_hash)
+    if cached_response is not None:
+        print(f"[{request_id}] 检测到完全相同的请求: {request_hash}, 返回缓存结果")
+        if request_key:
+            await message_requests.put(request_key, cached_response)
+        return cached_response
+    
+    # 同一会话的消息依次创建，等待超时时拒绝请求
+    try:
+        lease = await conversation_locks.acquire(conversation_id, timeout=settings.AI_MESSAGE_LOCK_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"[{request_id}] 会话 {conversation_id} 已被锁定，拒绝请求")
+        if request_key:
+            await message_requests.discard(request_key)
+        raise HTTPException(
+            status_code=429,
+            detail="请稍后再试，已有处理中的请求"
+        )
     
     # 初始化文件内容为空字符串
     file_content = ""
+    # 响应已保存，之后出错时保留请求ID的记录
+    response_saved = False
     
     try:
         # 使用安全的事务上下文，确保每个操作都在干净的会话中执行
         async with safe_db_transaction() as transaction_db:
             # 检查是否已存在相同内容和时间的消息（额外防止重复）
-            existing_messages = await message_crud.get_conversation_messages(
-                transaction_db, conversation_id=conversation_id, limit=5
+            existing_messages = await conversation_history.get_recent(
+                transaction_db, conversation_id, limit=5
             )
             
             current_time_utc = datetime.now(timezone.utc)
@@ -450,36 +484,20 @@ async def create_message(
                         "model_name": existing_msg.model_name
                     }
                     # 缓存结果
-                    request_id_cache[request_hash] = {
-                        'timestamp': current_time,
-                        'response': response
-                    }
-                    # 缓存请求ID结果
-                    if request_id:
-                        request_id_cache[request_id] = {
-                            'timestamp': current_time,
-                            'response': response
-                        }
-                    # 释放锁
-                    if message_creation_locks.get(conversation_id) == new_lock:
-                        del message_creation_locks[conversation_id]
-                        print(f"[{request_id}] 释放会话锁: {conversation_id}")
+                    await _remember_response(request_hash, request_key, response)
+                    response_saved = True
                     return response
             
-            # 使用显式异步查询确保会话存在
+            # 使用显式异步查询确保会话存在，并锁定会话行，多进程部署时同一会话的消息也依次创建
             conversation_query = await transaction_db.execute(
                 select(conversation_crud.model).where(
                     conversation_crud.model.id == conversation_id,
                     conversation_crud.model.user_id == user_id
-                )
+                ).with_for_update()
             )
             conversation = conversation_query.scalar_one_or_none()
             
             if not conversation:
-                # 释放锁
-                if message_creation_locks.get(conversation_id) == new_lock:
-                    del message_creation_locks[conversation_id]
-                    print(f"[{request_id}] 释放会话锁(会话不存在): {conversation_id}")
                 raise HTTPException(
                     status_code=404,
                     detail="会话不存在或无权访问"
@@ -562,6 +580,15 @@ async def create_message(
             
             # transaction_db事务自动提交(async with会处理)
         
+        # 事务提交后写入会话消息缓存和输入联想索引
+        conversation_history.on_created(db_message)
+        if role == "user":
+            query_suggestions.record(user_id, content)
+        # 在后台提前提取附件内容，生成回答时直接使用
+        attachment_extractor.prefetch(
+            (attachment["file_path"], attachment["file_type"]) for attachment in file_attachments
+        )
+        
         # 事务完成，准备响应
         response = {
             "id": db_message.id,
@@ -579,63 +606,53 @@ async def create_message(
             response["attachments"] = file_attachments
         
         # 缓存响应结果以便重复请求时返回
-        request_id_cache[request_hash] = {
-            'timestamp': current_time,
-            'response': response
-        }
-        
-        # 如果提供了请求ID，也缓存结果
-        if request_id:
-            request_id_cache[request_id] = {
-                'timestamp': current_time,
-                'response': response
-            }
-        
-        # 清理缓存，只保留最近1小时的缓存
-        cleanup_time = current_time - 3600  # 一小时前
-        expired_keys = [k for k, v in request_id_cache.items() if v['timestamp'] < cleanup_time]
-        for k in expired_keys:
-            del request_id_cache[k]
+        await _remember_response(request_hash, request_key, response)
+        response_saved = True
         
         # 如果是用户消息，创建并启动AI响应任务
         if role == "user":
+            # 新的问题取代该会话进行中的生成和尚未执行的后台任务
+            generation_registry.cancel(user_id, conversation_id, reason=CANCEL_SUPERSEDED)
+            await ai_job_queue.cancel_pending(db, user_id=user_id, conversation_id=conversation_id)
+            
             if waitForResponse:
+                # 等待AI响应期间不占用会话锁，同一会话新的问题可以取代本次生成
+                lease.release()
+                
                 # 直接等待AI响应完成并返回
                 try:
                     print(f"[{request_id}] 等待AI响应完成...")
-                    # 在同一个事务中处理AI响应
-                    ai_response = await ai_assistant.process_query(
-                        db,
+                    # 在同一个事务中处理AI响应，客户端断开或被新的问题取代时停止生成
+                    ai_response = await generation_registry.run(
+                        ai_assistant.process_query(
+                            db,
+                            user_id=user_id,
+                            query_text=db_message.content,
+                            context_data={
+                                "conversation_id": conversation_id,
+                                "useLocalModel": useLocalModel,
+                                "modelName": modelName,
+                                "useThinkMode": useThinkMode,
+                                # 获取历史消息作为上下文
+                                "messages": await conversation_history.get_context(db, conversation_id)
+                            },
+                            timeout=55  # 设置稍短的超时，确保API响应不会超过60秒
+                        ),
                         user_id=user_id,
-                        query_text=db_message.content,
-                        context_data={
-                            "conversation_id": conversation_id,
-                            "useLocalModel": useLocalModel,
-                            "modelName": modelName,
-                            "useThinkMode": useThinkMode,
-                            # 获取历史消息作为上下文
-                            "messages": [
-                                {"role": msg.role, "content": msg.content} 
-                                for msg in await message_crud.get_conversation_messages(
-                                    db, conversation_id=conversation_id, limit=10
-                                )
-                            ]
-                        },
-                        timeout=55  # 设置稍短的超时，确保API响应不会超过60秒
+                        conversation_id=conversation_id,
+                        source="http",
+                        request=request
                     )
                     
-                    # 获取AI响应消息
-                    ai_messages = await message_crud.get_newest_message(
-                        db, conversation_id=conversation_id, role="assistant"
-                    )
+                    # 获取AI响应消息，保存时已写入会话消息缓存
+                    ai_messages = conversation_history.get_newest(conversation_id, role="assistant")
+                    if ai_messages is None:
+                        ai_messages = await message_crud.get_newest_message(
+                            db, conversation_id=conversation_id, role="assistant"
+                        )
                     
                     if ai_messages:
                         print(f"[{request_id}] AI响应已完成，返回用户消息和AI响应")
-                        # 释放锁
-                        if message_creation_locks.get(conversation_id) == new_lock:
-                            del message_creation_locks[conversation_id]
-                            print(f"[{request_id}] 释放会话锁: {conversation_id}")
-                        
                         # 返回带有AI响应的结果
                         return {
                             **response,  # 原始用户消息响应
@@ -648,28 +665,51 @@ async def create_message(
                                 "processing_time": ai_messages.processing_time
                             }
                         }
+                except ServiceOverloadedError as e:
+                    print(f"[{request_id}] AI服务繁忙，拒绝请求")
+                    # 服务繁忙时不转入后台处理，避免进一步加重排队
+                    return {
+                        **response,
+                        "has_error": True,
+                        "error": e.error_message,
+                        "ai_message": {
+                            "id": -1,
+                            "role": "assistant",
+                            "content": f"{e.error_message}，请稍后重新发送。",
+                            "conversation_id": conversation_id,
+                            "timestamp": datetime.now(timezone.utc),
+                            "processing_time": 0.0,
+                            "is_error_message": True
+                        }
+                    }
+                except GenerationCancelledError as e:
+                    print(f"[{request_id}] AI响应已取消: {e.reason}")
+                    # 生成已停止，不转入后台处理
+                    return {
+                        **response,
+                        "is_cancelled": True,
+                        "cancel_reason": e.reason
+                    }
                 except asyncio.TimeoutError:
                     print(f"[{request_id}] AI响应超时")
-                    # 继续异步处理AI响应
-                    asyncio.create_task(process_ai_response(
+                    # 转入后台任务继续生成，完成后通过WebSocket推送
+                    job = await ai_job_queue.enqueue(
+                        db,
                         user_id=user_id,
                         conversation_id=conversation_id,
-                        message_content=db_message.content,
-                        model_name=modelName,
+                        message_id=db_message.id,
+                        query_text=db_message.content,
                         use_local_model=useLocalModel,
-                        use_think_mode=useThinkMode,
-                        request_id=f"{request_id}-async"
-                    ))
-                    
-                    # 释放锁
-                    if message_creation_locks.get(conversation_id) == new_lock:
-                        del message_creation_locks[conversation_id]
-                        print(f"[{request_id}] 释放会话锁(超时): {conversation_id}")
+                        model_name=modelName,
+                        use_think_mode=useThinkMode
+                    )
+                    print(f"[{request_id}] 已转入后台任务: {job.id}")
                     
                     # 返回带有明确超时标志的结果
                     return {
                         **response,
                         "is_timeout": True,
+                        "job_id": job.id,
                         "ai_message": {
                             "id": -1,  # 临时ID
                             "role": "assistant",
@@ -682,27 +722,26 @@ async def create_message(
                     }
                 except Exception as e:
                     print(f"[{request_id}] 等待AI响应时出错: {str(e)}")
-                    # 异步处理AI响应
-                    asyncio.create_task(process_ai_response(
+                    # 转入后台任务重试
+                    await db.rollback()
+                    job = await ai_job_queue.enqueue(
+                        db,
                         user_id=user_id,
                         conversation_id=conversation_id,
-                        message_content=db_message.content,
-                        model_name=modelName,
+                        message_id=db_message.id,
+                        query_text=db_message.content,
                         use_local_model=useLocalModel,
-                        use_think_mode=useThinkMode,
-                        request_id=f"{request_id}-async-error"
-                    ))
-                    
-                    # 释放锁
-                    if message_creation_locks.get(conversation_id) == new_lock:
-                        del message_creation_locks[conversation_id]
-                        print(f"[{request_id}] 释放会话锁(错误): {conversation_id}")
+                        model_name=modelName,
+                        use_think_mode=useThinkMode
+                    )
+                    print(f"[{request_id}] 已转入后台任务: {job.id}")
                     
                     # 返回带有错误标志的结果
                     return {
                         **response,
                         "has_error": True,
                         "error": str(e),
+                        "job_id": job.id,
                         "ai_message": {
                             "id": -1,
                             "role": "assistant",
@@ -714,93 +753,70 @@ async def create_message(
                         }
                     }
             else:
-                # 在新的隔离会话中启动AI响应任务 
-                asyncio.create_task(process_ai_response(
+                # 由后台任务生成AI响应，客户端可查询任务状态或等待WebSocket推送
+                job = await ai_job_queue.enqueue(
+                    db,
                     user_id=user_id,
                     conversation_id=conversation_id,
-                    message_content=db_message.content,
-                    model_name=modelName,
+                    message_id=db_message.id,
+                    query_text=db_message.content,
                     use_local_model=useLocalModel,
-                    use_think_mode=useThinkMode,
-                    request_id=request_id
-                ))
-        
-        # 释放锁
-        if message_creation_locks.get(conversation_id) == new_lock:
-            del message_creation_locks[conversation_id]
-            print(f"[{request_id}] 释放会话锁: {conversation_id}")
+                    model_name=modelName,
+                    use_think_mode=useThinkMode
+                )
+                response = {**response, "job_id": job.id}
+                await _remember_response(request_hash, request_key, response)
         
         return response
         
     except Exception as e:
         print(f"[{request_id}] 处理消息时出现错误: {str(e)}")
-        # 释放锁
-        if message_creation_locks.get(conversation_id) == new_lock:
-            del message_creation_locks[conversation_id]
-            print(f"[{request_id}] 释放会话锁(错误情况): {conversation_id}")
         raise HTTPException(
             status_code=500,
             detail=f"处理消息失败: {str(e)}"
         )
+    finally:
+        lease.release()
+        # 消息未创建（出错或客户端断开）时删除请求ID的登记，客户端可以重试
+        if request_key and not response_saved:
+            await message_requests.discard(request_key)
 
-# 新增AI响应处理函数，使用单独的会话
-async def process_ai_response(
-    user_id: int,
-    conversation_id: int,
-    message_content: str,
-    model_name: str,
-    use_local_model: bool,
-    use_think_mode: bool,
-    request_id: str
-):
-    """在独立的会话中处理AI回复"""
-    try:
-        # 创建一个独立会话，不使用事务上下文管理器
-        # 避免与ai_assistant.process_query内部的事务管理冲突
-        session = async_session()
-        
-        try:
-            # 确保会话以干净状态开始
-            await session.rollback()
-            
-            # 获取对话历史作为上下文
-            messages = await message_crud.get_conversation_messages(
-                session,
-                conversation_id=conversation_id,
-                limit=100  # 最近100条消息作为上下文
-            )
-            
-            context_data = {
-                "conversation_id": conversation_id,
-                "messages": [{"role": msg.role, "content": msg.content} for msg in messages]
-            }
-            
-            # 增加额外上下文数据
-            context_data["useLocalModel"] = use_local_model
-            context_data["modelName"] = model_name
-            context_data["useThinkMode"] = use_think_mode
-            
-            # 调用AI服务处理查询
-            print(f"[{request_id}] 开始处理AI响应 (用户: {user_id}, 会话: {conversation_id})")
-            await ai_assistant.process_query(
-                session,
-                user_id=user_id,
-                query_text=message_content,
-                context_data=context_data
-            )
-            print(f"[{request_id}] AI响应处理完成")
-        except Exception as inner_error:
-            # 记录详细错误信息
-            print(f"[{request_id}] AI处理内部错误: {str(inner_error)}")
-            # 确保回滚会话
-            await session.rollback()
-            raise
-        finally:
-            # 确保关闭会话
-            await session.close()
-            print(f"[{request_id}] AI响应处理会话已关闭")
-    except Exception as e:
-        print(f"[{request_id}] AI响应处理失败: {str(e)}")
+@router.post("/conversations/{conversation_id}/cancel")
+async def cancel_conversation_generation(
+    *,
+    db: AsyncSession = Depends(get_db),
+    conversation_id: int = Path(..., gt=0),
+    current_user: User = require_permissions(path="/api/v1/ai-assistant/conversations/{conversation_id}/cancel", method="POST")
+) -> Any:
+    """
+    停止对话中进行中的AI生成，并取消尚未执行的后台任务
+    """
+    conversation = await conversation_crud.get(db, id=conversation_id)
+    
+    if not conversation or conversation.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    
+    cancelled = generation_registry.cancel(current_user.id, conversation_id, reason=CANCEL_REQUESTED)
+    cancelled += await ai_job_queue.cancel_pending(db, user_id=current_user.id, conversation_id=conversation_id)
+    
+    return {"status": "success", "cancelled": cancelled}
+
+@router.get("/jobs/{job_id}", response_model=AIJobStatus)
+async def read_ai_job(
+    *,
+    db: AsyncSession = Depends(get_db),
+    job_id: int = Path(..., gt=0),
+    current_user: User = require_permissions(path="/api/v1/ai-assistant/jobs/{job_id}", method="GET")
+) -> Any:
+    """
+    获取AI回复后台任务的状态
+    """
+    job = await ai_job_queue.get_job(db, job_id)
+    
+    if not job or job.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return job
 
 @router.delete(
     "/conversations/{conversation_id}/messages/{message_id}",
@@ -817,10 +833,7 @@ async def delete_message(
     删除指定对话中的特定消息
     """
     # 检查对话是否存在并属于当前用户
-    conversation = await conversation_crud.get_conversation_with_messages(
-        db, conversation_id=conversation_id, user_id=current_user.id
-    )
-    if not conversation:
+    if not await conversation_crud.exists_for_user(db, conversation_id=conversation_id, user_id=current_user.id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="会话不存在或无权访问",
@@ -844,4 +857,6 @@ async def delete_message(
             detail="消息不存在或已被删除",
         )
     
+    conversation_history.on_deleted(conversation_id, message_id)
+    
     return {"status": "success", "message": "消息已成功删除"}
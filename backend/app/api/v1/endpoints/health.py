@@ -11,6 +11,8 @@ from app.api.deps import get_db
 from app.core.monitoring import REGISTRY
 from app.db.session import check_db_connection
 from app.core.config import settings
+from app.services.llm_backends import llm_backend_pool
+from app.services.llm_scheduler import llm_scheduler
 from app.utils.performance import (
     minute_metrics, 
     hour_metrics, 
@@ -99,6 +101,19 @@ async def metrics() -> Any:
         media_type="text/plain"
     )
 
+@router.get("/llm-backends")
+async def llm_backends_health() -> Dict[str, Any]:
+    """
+    LLM后端节点状态
+    
+    返回各节点的熔断状态、延迟、进行中的请求数和模型列表，以及调度器的槽位和排队情况
+    """
+    return {
+        "backends": llm_backend_pool.get_status(),
+        "scheduler": llm_scheduler.get_stats(),
+        "timestamp": datetime.now(timezone.utc),
+    }
+
 @router.get("/system-info", response_model=SystemInfoResponse)
 async def system_info():
     """
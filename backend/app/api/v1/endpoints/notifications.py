@@ -1,5 +1,5 @@
 from typing import Any, List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 from fastapi import APIRouter, Depends, HTTPException, Path, Query
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -10,12 +10,31 @@ from app.models.user import User
 from app.crud.notification import notification as notification_crud
 from app.schemas.notification import (
     Notification, NotificationCreate, NotificationUpdate,
-    NotificationList
+    NotificationList, NotificationBatchDelete
 )
+from app.core.config import settings
 from app.websockets.connection import notification_manager
+from app.services.unread_counter import unread_counter
 
 router = APIRouter()
 
+def _notification_to_dict(notification, recipient=None) -> dict:
+    """将通知转换为响应字典，提供收件箱记录时使用该用户自己的已读状态"""
+    return {
+        "id": notification.id,
+        "title": notification.title,
+        "content": notification.content,
+        "notification_type": notification.notification_type,
+        "recipient_user_id": notification.recipient_user_id,
+        "recipient_role_id": notification.recipient_role_id,
+        "sender_id": notification.sender_id,
+        "is_read": recipient.is_read if recipient else notification.is_read,
+        "created_at": notification.created_at,
+        "read_at": recipient.read_at if recipient else notification.read_at,
+        "sender_name": notification.sender.full_name if hasattr(notification, "sender") and notification.sender else None,
+        "recipient_name": notification.recipient_user.full_name if hasattr(notification, "recipient_user") and notification.recipient_user else None
+    }
+
 @router.get("/", response_model=NotificationList)
 async def read_notifications(
     db: AsyncSession = Depends(get_db),
@@ -34,7 +53,7 @@ async def read_notifications(
     - unread_only: 是否只返回未读通知
     - search: 搜索标题和内容
     """
-    notifications = await notification_crud.get_user_notifications(
+    entries = await notification_crud.get_user_notifications(
         db,
         user_id=current_user.id,
         skip=skip,
@@ -43,33 +62,36 @@ async def read_notifications(
         search=search
     )
     
-    # 处理数据，确保字段一致性
-    notification_list = []
-    for notification in notifications:
-        notification_dict = {
-            "id": notification.id,
-            "title": notification.title,
-            "content": notification.content,
-            "notification_type": notification.notification_type,
-            "recipient_user_id": notification.recipient_user_id,
-            "recipient_role_id": notification.recipient_role_id,
-            "sender_id": notification.sender_id,
-            "is_read": notification.is_read,
-            "created_at": notification.created_at,
-            "read_at": notification.read_at,
-            "sender_name": notification.sender.full_name if hasattr(notification, "sender") and notification.sender else None,
-            "recipient_name": notification.recipient_user.full_name if hasattr(notification, "recipient_user") and notification.recipient_user else None
-        }
-        notification_list.append(notification_dict)
+    # 处理数据，确保字段一致性，已读状态以当前用户的收件箱记录为准
+    notification_list = [
+        _notification_to_dict(entry.notification, entry)
+        for entry in entries
+    ]
+    
+    unread_count = await unread_counter.get(db, current_user.id)
     
     return {
         "data": notification_list,
         "meta": {
             "count": len(notification_list),
-            "unread_count": sum(1 for n in notification_list if not n["is_read"])
+            "unread_count": unread_count
         }
     }
 
+@router.get("/unread-count", response_model=dict)
+async def read_unread_count(
+    db: AsyncSession = Depends(get_db),
+    current_user: User = require_permissions(path="/api/v1/notifications/unread-count", method="GET")
+) -> Any:
+    """
+    获取当前用户的未读通知数量
+    
+    读取内存计数缓存，未命中时从收件箱索引加载，供前端角标使用
+    """
+    return {
+        "unread_count": await unread_counter.get(db, current_user.id)
+    }
+
 @router.post("/", response_model=Notification)
 async def create_notification(
     *,
@@ -151,21 +173,11 @@ async def read_notification(
             detail="无权访问该通知"
         )
     
-    # 处理数据，确保字段一致性
-    notification_dict = {
-        "id": notification.id,
-        "title": notification.title,
-        "content": notification.content,
-        "notification_type": notification.notification_type,
-        "recipient_user_id": notification.recipient_user_id,
-        "recipient_role_id": notification.recipient_role_id,
-        "sender_id": notification.sender_id,
-        "is_read": notification.is_read,
-        "created_at": notification.created_at,
-        "read_at": notification.read_at,
-        "sender_name": notification.sender.full_name if hasattr(notification, "sender") and notification.sender else None,
-        "recipient_name": notification.recipient_user.full_name if hasattr(notification, "recipient_user") and notification.recipient_user else None
-    }
+    # 处理数据，确保字段一致性，已读状态以当前用户的收件箱记录为准
+    recipient = await notification_crud.get_recipient(
+        db, notification_id=notification_id, user_id=current_user.id
+    )
+    notification_dict = _notification_to_dict(notification, recipient)
     
     return notification_dict
 
@@ -179,33 +191,22 @@ async def mark_notification_as_read(
     """
     将通知标记为已读
     """
-    notification = await notification_crud.mark_as_read(
+    entry = await notification_crud.mark_as_read(
         db,
         notification_id=notification_id,
         user_id=current_user.id
     )
     
-    if not notification:
+    if not entry:
         raise HTTPException(
             status_code=404,
             detail="通知不存在或无权访问"
         )
     
+    await unread_counter.on_read(db, current_user.id)
+    
     # 处理数据，确保字段一致性
-    notification_dict = {
-        "id": notification.id,
-        "title": notification.title,
-        "content": notification.content,
-        "notification_type": notification.notification_type,
-        "recipient_user_id": notification.recipient_user_id,
-        "recipient_role_id": notification.recipient_role_id,
-        "sender_id": notification.sender_id,
-        "is_read": notification.is_read,
-        "created_at": notification.created_at,
-        "read_at": notification.read_at,
-        "sender_name": notification.sender.full_name if hasattr(notification, "sender") and notification.sender else None,
-        "recipient_name": notification.recipient_user.full_name if hasattr(notification, "recipient_user") and notification.recipient_user else None
-    }
+    notification_dict = _notification_to_dict(entry.notification, entry)
     
     return notification_dict
 
@@ -222,12 +223,76 @@ async def mark_all_notifications_as_read(
         db,
         user_id=current_user.id
     )
+    await unread_counter.on_read_all(current_user.id, updated_count)
     
     return {
         "message": f"已将{updated_count}条通知标记为已读",
         "updated_count": updated_count
     }
 
+@router.post("/batch-delete", response_model=dict)
+async def delete_notifications_batch(
+    *,
+    db: AsyncSession = Depends(get_db),
+    batch_in: NotificationBatchDelete,
+    current_user: User = require_permissions(path="/api/v1/notifications/batch-delete", method="POST")
+) -> Any:
+    """
+    批量删除通知
+    
+    权限规则与单条删除一致，无权删除的通知会被跳过。
+    删除通过单条DELETE语句完成，不加载通知对象。
+    """
+    is_admin = bool(current_user.role and current_user.role.name.lower() == "admin")
+    # 收件箱记录会被级联删除，先记下未读数可能变化的用户
+    affected_user_ids = await notification_crud.get_unread_recipient_ids(db, notification_ids=batch_in.ids)
+    deleted_count = await notification_crud.remove_multi(
+        db,
+        ids=batch_in.ids,
+        user_id=current_user.id,
+        is_admin=is_admin
+    )
+    
+    if deleted_count:
+        await unread_counter.on_deleted(db, affected_user_ids)
+    
+    return {
+        "message": f"已删除{deleted_count}条通知",
+        "deleted_count": deleted_count
+    }
+
+@router.delete("/retention", response_model=dict)
+async def purge_expired_notifications(
+    *,
+    db: AsyncSession = Depends(get_db),
+    days: Optional[int] = Query(None, ge=1, description="保留天数，默认使用NOTIFICATION_RETENTION_DAYS"),
+    current_user: User = require_permissions(path="/api/v1/notifications/retention", method="DELETE")
+) -> Any:
+    """
+    清理超过保留期限的通知
+    
+    删除所有用户的通知，仅管理员可以执行。
+    通过单条DELETE语句删除，收件箱记录由外键级联删除
+    """
+    is_admin = bool(current_user.role and current_user.role.name.lower() == "admin")
+    if not is_admin:
+        raise HTTPException(status_code=403, detail="只有管理员可以清理通知")
+    
+    retention_days = days or settings.NOTIFICATION_RETENTION_DAYS
+    before = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=retention_days)
+    # 收件箱记录会被级联删除，先记下未读数可能变化的用户
+    affected_user_ids = await notification_crud.get_unread_recipient_ids(db, created_before=before)
+    deleted_count = await notification_crud.remove_older_than(db, before=before)
+    
+    if deleted_count:
+        await unread_counter.on_deleted(db, affected_user_ids)
+    
+    return {
+        "message": f"已清理{deleted_count}条超过{retention_days}天的通知",
+        "deleted_count": deleted_count,
+        "retention_days": retention_days
+    }
+
 @router.delete("/{id}", response_model=Notification)
 async def delete_notification(
     *,
@@ -253,7 +318,8 @@ async def delete_notification(
         is_admin = current_user.role and current_user.role.name.lower() == "admin"
         is_recipient = notification.recipient_user_id == current_user.id
         is_sender = notification.sender_id == current_user.id
-        is_unread = not notification.is_read
+        # 角色和广播通知的已读状态保存在各接收者的收件箱中
+        is_unread = not await notification_crud.has_been_read(db, notification_id=id)
         
         # 权限检查逻辑实现
         has_permission = False
@@ -277,8 +343,11 @@ async def delete_notification(
         
         # 使用事务保证删除操作的完整性
         try:
+            # 收件箱记录会被级联删除，先记下未读数可能变化的用户
+            affected_user_ids = await notification_crud.get_unread_recipient_ids(db, notification_ids=[id])
             # 删除通知
             deleted_notification = await notification_crud.remove(db=db, id=id)
+            await unread_counter.on_deleted(db, affected_user_ids)
             
             # 处理数据，确保字段一致性
             result = {
@@ -230,6 +230,7 @@ async def get_all_api_paths(
         
         # 学生管理
         "/api/v1/students",
+        "/api/v1/students/lookup",
         "/api/v1/students/{student_id}",
         "/api/v1/students/{student_id}/records",
         "/api/v1/students/import",
@@ -253,17 +254,26 @@ async def get_all_api_paths(
         "/api/v1/notifications/{notification_id}",
         "/api/v1/notifications/unread",
         "/api/v1/notifications/read-all",
+        "/api/v1/notifications/unread-count",
+        "/api/v1/notifications/batch-delete",
+        "/api/v1/notifications/retention",
         
         # AI助手
         "/api/v1/ai-assistant/chat",
         "/api/v1/ai-assistant/files",
         "/api/v1/ai-assistant/models",
+        "/api/v1/ai-assistant/query/stream",
+        "/api/v1/ai-assistant/jobs/{job_id}",
+        "/api/v1/ai-assistant/conversations/{conversation_id}/cancel",
         
         # 系统管理
         "/api/v1/admin/config",
         "/api/v1/admin/restart",
         "/api/v1/admin/backup",
         "/api/v1/admin/restore",
+        "/api/v1/admin/ai-metrics/conversations",
+        "/api/v1/admin/ai-metrics/conversations/{conversation_id}",
+        "/api/v1/admin/upload-storage",
         
         # 认证
         "/api/v1/auth/login",
@@ -14,6 +14,7 @@ from app.schemas.quant_record import (
     QuantRecordListResponse, QuantRecordBatchCreate
 )
 from app.services.export import export_stats
+from app.services.quant_insights import quant_insights
 
 router = APIRouter()
 
@@ -96,6 +97,7 @@ async def create_quant_record(
     record_in.recorder_id = current_user.id
     
     record = await quant_record_crud.create(db, obj_in=record_in)
+    quant_insights.mark_stale(record.student_id)
     
     # 获取记录的详细信息
     result = await quant_record_crud.get_record_with_details(db, record_id=record.id)
@@ -127,6 +129,8 @@ async def create_quant_records_batch(
         record_in.recorder_id = current_user.id
     
     created_count = await quant_record_crud.create_batch(db, obj_in_list=batch_in.records)
+    for record_in in batch_in.records:
+        quant_insights.mark_stale(record_in.student_id)
     
     return {
         "message": f"成功创建{created_count}条记录",
@@ -224,7 +228,10 @@ async def update_quant_record(
             detail="量化记录不存在"
         )
     
+    previous_student_id = record.student_id
     record = await quant_record_crud.update(db, db_obj=record, obj_in=record_in)
+    quant_insights.mark_stale(previous_student_id)
+    quant_insights.mark_stale(record.student_id)
     
     # 获取更新后的详细信息
     result = await quant_record_crud.get_record_with_details(db, record_id=record.id)
@@ -267,4 +274,5 @@ async def delete_quant_record(
         )
     
     await quant_record_crud.remove(db, id=record_id)
+    quant_insights.mark_stale(record.student_id)
     return None
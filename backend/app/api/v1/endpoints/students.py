@@ -8,8 +8,9 @@ from app.api.deps import get_current_active_user, get_db
 from app.core.permissions import require_permissions
 from app.crud.student import student as student_crud
 from app.models.user import User
-from app.schemas.student import Student, StudentCreate, StudentUpdate, StudentListResponse
+from app.schemas.student import Student, StudentCreate, StudentUpdate, StudentListResponse, StudentLookupResponse
 from app.models.quant_record import QuantRecord
+from app.services.student_directory import student_directory
 
 router = APIRouter()
 
@@ -95,8 +96,28 @@ async def create_student(
         )
     
     student_obj = await student_crud.create(db, obj_in=student_in)
+    student_directory.on_saved(student_obj)
     return student_obj
 
+@router.get("/lookup", response_model=StudentLookupResponse)
+async def lookup_students(
+    db: AsyncSession = Depends(get_db),
+    class_id: int = Query(..., gt=0, description="班级ID"),
+    q: str = Query(..., min_length=1, max_length=100, description="学号、姓名或拼音首字母前缀"),
+    limit: int = Query(10, ge=1, le=50, description="返回的记录数量"),
+    active_only: bool = Query(True, description="是否只返回启用的学生"),
+    current_user: User = require_permissions(path="/api/v1/students/lookup", method="GET")
+) -> Any:
+    """
+    学生输入联想，在班级内按学号、姓名或拼音首字母前缀查找学生
+
+    查询命中内存中的学生目录，不访问数据库（班级首次查询时加载）
+    """
+    entries = await student_directory.lookup(
+        db, class_id=class_id, query=q, limit=limit, active_only=active_only
+    )
+    return {"data": [entry.to_dict() for entry in entries]}
+
 @router.get("/{student_id}", response_model=Student)
 async def read_student(
     *,
@@ -144,7 +165,9 @@ async def update_student(
                 detail=f"学号为{student_in.student_id_no}的学生已存在"
             )
     
+    previous_class_id = student_obj.class_id
     student_obj = await student_crud.update(db, db_obj=student_obj, obj_in=student_in)
+    student_directory.on_saved(student_obj, previous_class_id=previous_class_id)
     return student_obj
 
 @router.delete("/{student_id}", response_model=None, status_code=204)
@@ -176,7 +199,9 @@ async def delete_student(
             headers={"X-Record-Count": str(record_count)}
         )
     
+    class_id = student_obj.class_id
     await student_crud.remove(db, id=student_id)
+    student_directory.on_deleted(student_id, class_id)
     return None
 
 @router.delete("/{student_id}/force", response_model=dict)
@@ -202,7 +227,9 @@ async def force_delete_student(
     deleted_records_count = result.rowcount
     
     # 删除学生
+    class_id = student_obj.class_id
     await student_crud.remove(db, id=student_id)
+    student_directory.on_deleted(student_id, class_id)
     
     return {
         "success": True,
@@ -229,6 +256,7 @@ async def toggle_student_active(
         )
     
     student_obj = await student_crud.update(db, db_obj=student_obj, obj_in={"is_active": active})
+    student_directory.on_saved(student_obj)
     return student_obj
 
 @router.post("/update-scores", response_model=dict)
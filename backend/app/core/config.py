@@ -40,6 +40,7 @@ class Settings(BaseSettings):
     # 新增系统配置字段
     DATA_BACKUP_DAYS: int = 7
     LOG_RETENTION_DAYS: int = 30
+    NOTIFICATION_RETENTION_DAYS: int = 365  # 通知保留天数
     ENABLE_NOTIFICATIONS: bool = True
     ENABLE_AUDIT_LOG: bool = True
     CACHE_TIMEOUT: int = 60
@@ -113,12 +114,16 @@ class Settings(BaseSettings):
     ENABLE_METRICS: bool = True
     SLOW_API_THRESHOLD: float = 1.0  # 慢API阈值（秒）
     
-    # Redis配置
-    # REDIS_URL: str = "redis://localhost:6379/0"
+    # 全文检索配置，需与MySQL服务器的ngram_token_size保持一致
+    SEARCH_NGRAM_TOKEN_SIZE: int = 2
+    
+    # Redis配置，为空时不使用Redis；多进程部署时用于在进程间共享重复请求记录，如 "redis://localhost:6379/0"
+    REDIS_URL: str = ""
     
     # 文件上传配置
     UPLOADS_DIR: str = "uploads"
     MAX_UPLOAD_SIZE: int = 10 * 1024 * 1024  # 10MB
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024  # 上传文件分块读取和写入的大小
     # UPLOADS_DIR: str = "uploads/ai-assistant"  # AI助手上传文件目录
     ALLOWED_FILE_TYPES: List[str] = [
         "image/jpeg", "image/png", "image/gif", "image/webp",
@@ -139,6 +144,12 @@ class Settings(BaseSettings):
     OLLAMA_API_KEY: str = "your-ollama-api-key-here"
     OLLAMA_USE_SYSTEM_PARAM: bool = True
     OLLAMA_USE_THINK_MODE: bool = True  # 开启思考模式
+    OLLAMA_KEEP_ALIVE: str = "30m"  # 模型在空闲后保持加载的时间，如 "30m"、"-1"（一直保持）
+    OLLAMA_WARMUP_ON_STARTUP: bool = True  # 启动时预加载 OLLAMA_MODEL_NAME
+    OLLAMA_CONTEXT_REUSE: bool = True  # 复用会话上一轮返回的context，避免重新预填充历史
+    OLLAMA_CONTEXT_MAX_TOKENS: int = 6144  # context超过该token数时重新发送完整提示
+    OLLAMA_CONTEXT_TTL: int = 1800  # context的保留时间（秒）
+    OLLAMA_CONTEXT_CACHE_SIZE: int = 500  # 最多保留context的会话数
 
     # Open-Webui配置
     OPEN_WEBUI_BASE_URL: str = "http://192.168.5.117:3000"
@@ -146,6 +157,115 @@ class Settings(BaseSettings):
     OPEN_WEBUI_API_KEY: str = "your-open-webui-api-key-here"
     OPEN_WEBUI_USE_THINK_MODE: bool = True  # 开启思考模式
 
+    # LLM后端HTTP连接池配置
+    LLM_HTTP_MAX_CONNECTIONS: int = 8  # 每个后端的最大连接数
+    LLM_HTTP_KEEPALIVE_TIMEOUT: int = 60  # 空闲连接保持时间（秒）
+    LLM_HTTP_CONNECT_TIMEOUT: float = 5.0  # 建立连接超时（秒）
+    LLM_HTTP_READ_TIMEOUT: float = 120.0  # 读取超时（秒）
+
+    # LLM请求调度配置
+    OLLAMA_MAX_CONCURRENCY: int = 2  # Ollama同时生成的请求数
+    OPEN_WEBUI_MAX_CONCURRENCY: int = 4  # Open-WebUI同时生成的请求数
+    LLM_DEFAULT_MAX_CONCURRENCY: int = 2  # 其他后端同时生成的请求数
+    LLM_QUEUE_MAX_WAIT: float = 30.0  # 最长排队时间（秒），超过则拒绝请求
+    LLM_QUEUE_MAX_SIZE: int = 200  # 每个后端的最大排队请求数
+    LLM_BACKGROUND_RESERVED_SLOTS: int = 1  # 后端有请求在生成时，后台任务至少为交互请求保留的空闲槽位数
+
+    # LLM多节点配置，逗号分隔的节点地址，为空时只使用 OLLAMA_BASE_URL / OPEN_WEBUI_BASE_URL
+    OLLAMA_BASE_URLS: str = ""
+    OPEN_WEBUI_BASE_URLS: str = ""
+    # 请求模型的所有节点都不可用时使用的备用模型，为空表示不切换模型
+    OLLAMA_FALLBACK_MODEL_NAME: str = ""
+    OPEN_WEBUI_FALLBACK_MODEL_NAME: str = ""
+    LLM_CIRCUIT_FAILURE_THRESHOLD: int = 3  # 连续失败多少次后熔断节点
+    LLM_CIRCUIT_RESET_TIMEOUT: float = 30.0  # 熔断后多久放行试探请求（秒）
+    LLM_HEALTH_CHECK_INTERVAL: float = 15.0  # 节点健康检查间隔（秒），0表示不检查
+    LLM_HEALTH_CHECK_TIMEOUT: float = 3.0  # 健康检查超时（秒）
+
+    @property
+    def get_ollama_base_urls(self) -> List[str]:
+        urls = [url.strip() for url in self.OLLAMA_BASE_URLS.split(",") if url.strip()]
+        return urls or [self.OLLAMA_BASE_URL]
+
+    @property
+    def get_open_webui_base_urls(self) -> List[str]:
+        urls = [url.strip() for url in self.OPEN_WEBUI_BASE_URLS.split(",") if url.strip()]
+        return urls or [self.OPEN_WEBUI_BASE_URL]
+
+    # AI助手响应缓存配置
+    AI_RESPONSE_CACHE_ENABLED: bool = True
+    AI_RESPONSE_CACHE_TTL: int = 600  # 缓存有效期（秒）
+    AI_RESPONSE_CACHE_MAX_ENTRIES: int = 1000  # 最多缓存的响应数，超出时淘汰最久未使用的
+    AI_RESPONSE_CACHE_NEAR_DUPLICATE: bool = False  # 是否对相似问题复用响应
+    AI_RESPONSE_CACHE_SIMILARITY: float = 0.9  # 相似问题的最低Jaccard相似度
+
+    # AI助手提示组装配置
+    AI_CONTEXT_MAX_TOKENS: int = 4096  # 提示的token预算（估算值）
+    AI_CONTEXT_MAX_MESSAGES: int = 50  # 最多放入提示的历史消息数
+    AI_CONTEXT_SUMMARY_MAX_TOKENS: int = 512  # 较早对话摘要的token上限
+    AI_CONTEXT_SUMMARY_LINE_CHARS: int = 80  # 摘要中每条消息保留的字符数
+    AI_CONTEXT_SUMMARY_CACHE_SIZE: int = 1000  # 最多缓存摘要的会话数
+    AI_HISTORY_CACHE_SIZE: int = 1000  # 最多缓存最近消息的会话数
+    AI_CONVERSATION_PREVIEW_CHARS: int = 80  # 会话列表中最后一条消息预览的字符数
+    AI_DISCONNECT_CHECK_INTERVAL: float = 1.0  # 等待AI响应的HTTP请求检查客户端是否断开的间隔（秒）
+    
+    # AI回复生成任务队列
+    AI_JOB_WORKERS: int = 2  # 每个进程执行任务的worker数
+    AI_JOB_MAX_ATTEMPTS: int = 3  # 每个任务最多执行次数
+    AI_JOB_RETRY_BASE_DELAY: int = 5  # 首次重试的等待时间（秒），之后每次翻倍
+    AI_JOB_RETRY_MAX_DELAY: int = 300  # 重试等待时间上限（秒）
+    AI_JOB_TIMEOUT: int = 300  # 单次执行的超时时间（秒），包含排队时间
+    AI_JOB_LEASE_SECONDS: int = 600  # 执行中的任务超过该时间未完成视为worker已退出，重新领取
+    AI_JOB_POLL_INTERVAL: int = 5  # 没有任务时查询数据库的间隔（秒）
+
+    # 发送消息的并发控制和重复请求检查
+    AI_MESSAGE_LOCK_TIMEOUT: float = 5.0  # 等待同一会话上一条消息创建完成的最长时间（秒），超时返回429
+    AI_MESSAGE_REQUEST_TTL: int = 3600  # 按请求ID保存响应的时间（秒），期间重复的请求直接返回保存的响应
+    AI_MESSAGE_DUPLICATE_WINDOW: int = 5  # 相同内容的消息在该时间（秒）内视为重复提交
+    AI_MESSAGE_DEDUPE_MAX_ENTRIES: int = 10000  # 每个进程最多保存的响应数，超出时淘汰最早的
+
+    # AI助手引用学生本人量化数据回答
+    AI_GROUNDING_ENABLED: bool = True  # 学生询问自己的量化情况时是否在提示中加入相关的量化数据
+    AI_GROUNDING_REFRESH_INTERVAL: int = 30  # 学生量化数据索引增量刷新的最小间隔（秒）
+    AI_GROUNDING_MAX_STUDENTS: int = 2000  # 每个进程最多缓存索引的学生数，超出时淘汰最久未使用的
+    AI_GROUNDING_RECENT_RECORDS: int = 5  # 提示中最多列出的最近记录数
+    AI_GROUNDING_MAX_ITEMS: int = 3  # 未指明项目时提示中列出的累计分数变化最大的项目数
+    AI_GROUNDING_MAX_TOKENS: int = 400  # 加入提示的量化数据的token上限
+
+    # AI助手输入联想
+    AI_SUGGESTION_LIMIT: int = 5  # 每次返回的建议数
+    AI_SUGGESTION_MAX_QUERY_CHARS: int = 60  # 超过该长度或包含换行的问题不作为建议
+    AI_SUGGESTION_USER_MAX_QUERIES: int = 200  # 每个用户最多索引的问题数，超出时淘汰最久未提问的
+    AI_SUGGESTION_MAX_USERS: int = 5000  # 每个进程最多索引的用户数，超出时淘汰最久未提问的用户
+    AI_SUGGESTION_GLOBAL_MAX_QUERIES: int = 5000  # 全局热门问题最多索引的问题数
+    AI_SUGGESTION_MIN_USERS: int = 3  # 至少有该数量的不同用户问过的问题才会推荐给其他用户
+    AI_SUGGESTION_WARMUP_MESSAGES: int = 5000  # 启动时从最近的用户消息加载索引的条数，0表示不加载
+
+    # 后台生成会话标题和摘要，只在LLM后端空闲时执行，有交互请求排队时让出槽位
+    AI_SUMMARY_ENABLED: bool = True
+    AI_SUMMARY_POLL_INTERVAL: int = 60  # 查找待处理会话的间隔（秒）
+    AI_SUMMARY_BATCH_SIZE: int = 10  # 每次最多处理的会话数
+    AI_SUMMARY_MIN_AGE: int = 120  # 会话最后一次更新后至少经过该时间（秒）才处理，避免打断进行中的对话
+    AI_SUMMARY_LOOKBACK_DAYS: int = 7  # 只处理最近该天数内更新过的会话
+    AI_SUMMARY_MIN_MESSAGES: int = 20  # 消息数达到该值的会话生成摘要，用作长对话的压缩上下文
+    AI_SUMMARY_REFRESH_MESSAGES: int = 10  # 摘要之后新增的消息数达到该值时更新摘要
+    AI_SUMMARY_MAX_INPUT_TOKENS: int = 3000  # 每次生成时放入的对话token上限，超出的消息留到下一次
+    AI_SUMMARY_MAX_CHARS: int = 300  # 摘要的字数上限
+    AI_SUMMARY_TITLE_MAX_CHARS: int = 20  # 标题的字数上限
+    AI_SUMMARY_MODEL_NAME: str = ""  # 使用的Ollama模型，为空时使用 OLLAMA_MODEL_NAME
+
+    # AI助手附件的文本提取，在进程池中执行，结果按文件内容哈希缓存在磁盘上
+    AI_ATTACHMENT_ENABLED: bool = True
+    AI_ATTACHMENT_WORKERS: int = 2  # 提取进程数
+    AI_ATTACHMENT_CACHE_DIR: str = "cache/attachments"  # 提取结果缓存目录，不要放在公开访问的上传目录下
+    AI_ATTACHMENT_TIMEOUT: int = 30  # 单个文件的提取超时时间（秒）
+    AI_ATTACHMENT_MAX_CHARS: int = 20000  # 每个文件最多提取的字符数
+    AI_ATTACHMENT_MAX_PAGES: int = 50  # PDF最多提取的页数
+    AI_ATTACHMENT_MAX_ROWS: int = 500  # 表格每个工作表最多提取的行数
+    AI_ATTACHMENT_MAX_FILES: int = 3  # 放入提示的最近附件数
+    AI_ATTACHMENT_MAX_TOKENS: int = 1500  # 放入提示的附件内容token上限
+    AI_ATTACHMENT_MEMORY_CACHE_SIZE: int = 256  # 进程内缓存的提取结果数
+
     # OpenAI配置
     OPENAI_BASE_URL: str = "https://api.openai.com/v1"
     OPENAI_API_KEY: str = "your-openai-api-key-here"
@@ -73,3 +73,22 @@ class NotFoundError(AppErrorException):
             details=details,
             status_code=status.HTTP_404_NOT_FOUND
         )
+
+class ServiceOverloadedError(AppErrorException):
+    def __init__(self, message: str, details: Optional[Dict[str, Any]] = None):
+        super().__init__(
+            code="SERVICE_OVERLOADED",
+            message=message,
+            details=details,
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+
+class GenerationCancelledError(AppErrorException):
+    def __init__(self, message: str, reason: str, details: Optional[Dict[str, Any]] = None):
+        self.reason = reason
+        super().__init__(
+            code="GENERATION_CANCELLED",
+            message=message,
+            details={"reason": reason, **(details or {})},
+            status_code=status.HTTP_409_CONFLICT
+        )
@@ -51,6 +51,333 @@ DB_CONNECTION_POOL_SIZE = Gauge(
     registry=REGISTRY
 )
 
+# AI助手指标
+AI_TIME_TO_FIRST_TOKEN = Histogram(
+    'ai_time_to_first_token_seconds',
+    'Time from sending a generation request to receiving the first token',
+    ['backend', 'model', 'mode'],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 21, 34, 55, 90),
+    registry=REGISTRY
+)
+
+AI_GENERATION_REQUESTS = Counter(
+    'ai_generation_requests_total',
+    'Number of LLM generations, by outcome (success, error, timeout, overloaded, cancelled)',
+    ['backend', 'model', 'outcome'],
+    registry=REGISTRY
+)
+
+AI_GENERATION_SECONDS = Histogram(
+    'ai_generation_seconds',
+    'Wall-clock time of successful LLM generations, excluding queue wait',
+    ['backend', 'model'],
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+    registry=REGISTRY
+)
+
+AI_GENERATION_QUEUE_SECONDS = Histogram(
+    'ai_generation_queue_seconds',
+    'Time LLM generations waited for a scheduler slot',
+    ['backend', 'model'],
+    buckets=(0, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+    registry=REGISTRY
+)
+
+AI_GENERATION_TOKENS = Counter(
+    'ai_generation_tokens_total',
+    'Number of tokens processed by LLM generations, by kind (prompt, completion)',
+    ['backend', 'model', 'kind'],
+    registry=REGISTRY
+)
+
+AI_GENERATION_TOKENS_PER_SECOND = Histogram(
+    'ai_generation_tokens_per_second',
+    'Completion tokens generated per second of decoding',
+    ['backend', 'model'],
+    buckets=(1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 200),
+    registry=REGISTRY
+)
+
+LLM_HTTP_CONNECTIONS_CREATED = Counter(
+    'llm_http_connections_created_total',
+    'Number of new TCP connections opened to LLM backends',
+    ['backend'],
+    registry=REGISTRY
+)
+
+LLM_HTTP_CONNECTIONS_REUSED = Counter(
+    'llm_http_connections_reused_total',
+    'Number of requests to LLM backends served on a reused keep-alive connection',
+    ['backend'],
+    registry=REGISTRY
+)
+
+LLM_HTTP_REQUESTS = Counter(
+    'llm_http_requests_total',
+    'Number of HTTP requests sent to LLM backends',
+    ['backend', 'status'],
+    registry=REGISTRY
+)
+
+LLM_QUEUE_DEPTH = Gauge(
+    'llm_queue_depth',
+    'Number of LLM requests waiting for a generation slot',
+    ['backend'],
+    registry=REGISTRY
+)
+
+LLM_ACTIVE_GENERATIONS = Gauge(
+    'llm_active_generations',
+    'Number of LLM generations currently holding a slot',
+    ['backend'],
+    registry=REGISTRY
+)
+
+LLM_QUEUE_WAIT = Histogram(
+    'llm_queue_wait_seconds',
+    'Time LLM requests spent waiting for a generation slot',
+    ['backend'],
+    buckets=(0, 0.1, 0.5, 1, 2, 5, 10, 20, 30, 60, 120),
+    registry=REGISTRY
+)
+
+LLM_REQUESTS_SHED = Counter(
+    'llm_requests_shed_total',
+    'Number of LLM requests rejected by admission control',
+    ['backend', 'reason'],
+    registry=REGISTRY
+)
+
+LLM_BACKGROUND_PREEMPTIONS = Counter(
+    'llm_background_preemptions_total',
+    'Number of background generations cancelled to free a slot for queued interactive requests',
+    ['backend'],
+    registry=REGISTRY
+)
+
+AI_CONVERSATION_SUMMARIES = Counter(
+    'ai_conversation_summaries_total',
+    'Number of background conversation titling and summarization attempts',
+    ['result'],  # success, skipped, failed, busy, preempted
+    registry=REGISTRY
+)
+
+AI_ATTACHMENT_EXTRACTIONS = Counter(
+    'ai_attachment_extractions_total',
+    'Number of attachment text extraction lookups',
+    ['result'],  # memory_hit, disk_hit, extracted, unsupported, error, timeout
+    registry=REGISTRY
+)
+
+AI_ATTACHMENT_EXTRACTION_SECONDS = Histogram(
+    'ai_attachment_extraction_seconds',
+    'Time spent waiting for attachment extraction in the process pool',
+    buckets=[0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0],
+    registry=REGISTRY
+)
+
+UPLOAD_STORAGE_BYTES = Counter(
+    'upload_storage_bytes_total',
+    'Bytes of uploaded files by whether they were written or deduplicated against an existing blob',
+    ['result'],  # stored, deduplicated
+    registry=REGISTRY
+)
+
+LLM_BACKEND_CIRCUIT_STATE = Gauge(
+    'llm_backend_circuit_state',
+    'Circuit breaker state of an LLM endpoint (0 closed, 1 half-open, 2 open)',
+    ['backend'],
+    registry=REGISTRY
+)
+
+LLM_BACKEND_FAILOVERS = Counter(
+    'llm_backend_failovers_total',
+    'Number of LLM requests retried on another endpoint or the fallback model',
+    ['kind', 'reason'],
+    registry=REGISTRY
+)
+
+AI_PROMPT_TOKENS = Histogram(
+    'ai_prompt_tokens',
+    'Estimated number of tokens in prompts sent to LLM backends',
+    ['mode'],
+    buckets=(256, 512, 1024, 1536, 2048, 3072, 4096, 6144, 8192, 16384),
+    registry=REGISTRY
+)
+
+OLLAMA_PREFILL_SECONDS = Histogram(
+    'ollama_prefill_seconds',
+    'Prompt evaluation (prefill) time reported by Ollama, by whether a conversation context was reused',
+    ['model', 'context'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32),
+    registry=REGISTRY
+)
+
+OLLAMA_PREFILL_TOKENS_SAVED = Counter(
+    'ollama_prefill_tokens_saved_total',
+    'Estimated prompt tokens Ollama did not have to prefill because a conversation context was reused',
+    ['model'],
+    registry=REGISTRY
+)
+
+OLLAMA_PREFILL_SECONDS_SAVED = Counter(
+    'ollama_prefill_seconds_saved_total',
+    'Estimated prefill time saved by reusing conversation contexts',
+    ['model'],
+    registry=REGISTRY
+)
+
+AI_GENERATIONS_CANCELLED = Counter(
+    'ai_generations_cancelled_total',
+    'Number of AI generations cancelled before completion, by source and reason (disconnect, requested, superseded)',
+    ['source', 'reason'],
+    registry=REGISTRY
+)
+
+AI_CANCELLED_GENERATION_SECONDS = Counter(
+    'ai_cancelled_generation_seconds_total',
+    'Time AI generations had been running before they were cancelled',
+    ['source', 'reason'],
+    registry=REGISTRY
+)
+
+AI_JOBS_PROCESSED = Counter(
+    'ai_jobs_processed_total',
+    'Number of AI response job executions, by outcome (succeeded, retried, failed, cancelled)',
+    ['status'],
+    registry=REGISTRY
+)
+
+AI_JOB_DURATION = Histogram(
+    'ai_job_duration_seconds',
+    'Time spent executing a single attempt of an AI response job',
+    ['status'],
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600),
+    registry=REGISTRY
+)
+
+AI_RESPONSE_CACHE_REQUESTS = Counter(
+    'ai_response_cache_requests_total',
+    'Number of AI queries looked up in the response cache, by result (hit, near_hit, coalesced, miss)',
+    ['backend', 'result'],
+    registry=REGISTRY
+)
+
+AI_RESPONSE_CACHE_SAVED_SECONDS = Counter(
+    'ai_response_cache_saved_seconds_total',
+    'Generation time saved by serving AI queries from the response cache or an in-flight generation',
+    ['backend'],
+    registry=REGISTRY
+)
+
+AI_RESPONSE_CACHE_ENTRIES = Gauge(
+    'ai_response_cache_entries',
+    'Number of responses currently held in the AI response cache',
+    registry=REGISTRY
+)
+
+# 按键加锁和重复请求检查指标
+KEYED_LOCK_WAIT_SECONDS = Histogram(
+    'keyed_lock_wait_seconds',
+    'Time spent waiting to acquire a per-key lock',
+    ['name'],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10),
+    registry=REGISTRY
+)
+
+KEYED_LOCK_TIMEOUTS = Counter(
+    'keyed_lock_timeouts_total',
+    'Number of per-key lock acquisitions that timed out',
+    ['name'],
+    registry=REGISTRY
+)
+
+KEYED_LOCK_KEYS = Gauge(
+    'keyed_lock_keys',
+    'Number of keys currently held or waited on',
+    ['name'],
+    registry=REGISTRY
+)
+
+REQUEST_DEDUPE_LOOKUPS = Counter(
+    'request_dedupe_lookups_total',
+    'Number of duplicate request lookups, by result (hit, pending, miss)',
+    ['store', 'result'],
+    registry=REGISTRY
+)
+
+REQUEST_DEDUPE_ENTRIES = Gauge(
+    'request_dedupe_entries',
+    'Number of entries held in the in-process duplicate request store',
+    ['store'],
+    registry=REGISTRY
+)
+
+REQUEST_DEDUPE_EVICTIONS = Counter(
+    'request_dedupe_evictions_total',
+    'Number of entries removed from the in-process duplicate request store, by reason (expired, capacity)',
+    ['store', 'reason'],
+    registry=REGISTRY
+)
+
+REQUEST_DEDUPE_BACKEND_ERRORS = Counter(
+    'request_dedupe_backend_errors_total',
+    'Number of Redis errors in the duplicate request store that fell back to the in-process store',
+    ['store'],
+    registry=REGISTRY
+)
+
+# AI助手量化数据检索指标
+AI_GROUNDING_LOOKUPS = Counter(
+    'ai_grounding_lookups_total',
+    'Number of quantification data lookups for assistant prompts',
+    ['result'],  # grounded, irrelevant, no_student, error
+    registry=REGISTRY
+)
+
+AI_GROUNDING_RETRIEVAL_SECONDS = Histogram(
+    'ai_grounding_retrieval_seconds',
+    'Time spent retrieving quantification data for assistant prompts',
+    ['source'],  # cache, refresh, rebuild
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+    registry=REGISTRY
+)
+
+AI_GROUNDING_TOKENS = Histogram(
+    'ai_grounding_tokens',
+    'Estimated tokens of quantification data injected into prompts versus listing every record',
+    ['kind'],  # injected, full
+    buckets=(32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384),
+    registry=REGISTRY
+)
+
+AI_GROUNDING_TOKENS_SAVED = Counter(
+    'ai_grounding_tokens_saved_total',
+    'Estimated prompt tokens saved by injecting aggregates instead of every quantification record',
+    registry=REGISTRY
+)
+
+AI_GROUNDING_INDEXED_STUDENTS = Gauge(
+    'ai_grounding_indexed_students',
+    'Number of students with a cached quantification data index',
+    registry=REGISTRY
+)
+
+# AI助手输入联想指标
+AI_SUGGESTION_SECONDS = Histogram(
+    'ai_suggestion_seconds',
+    'Time spent looking up query suggestions in the in-memory prefix index',
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01),
+    registry=REGISTRY
+)
+
+AI_SUGGESTION_INDEXED_QUERIES = Gauge(
+    'ai_suggestion_indexed_queries',
+    'Number of distinct questions in the suggestion prefix index',
+    ['scope'],  # user, global
+    registry=REGISTRY
+)
+
 class MonitoringMiddleware:
     def __init__(self, app):
         self.app = app
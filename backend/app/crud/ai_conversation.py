@@ -1,13 +1,19 @@
-from typing import List, Optional, Dict, Any, Union
+from typing import List, Optional, Dict, Any, Union, Tuple
 from datetime import datetime
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, update, delete
+from sqlalchemy import select, func, update, delete, exists, case, or_
 from sqlalchemy.orm import selectinload
 
+from app.core.config import settings
 from app.crud.base import CRUDBase
 from app.models.ai_conversation import AIConversation, AIMessage
 from app.schemas.ai_conversation import ConversationCreate, ConversationUpdate, MessageCreate
+from app.utils.pagination import encode_cursor, keyset_condition
+
+# 未命名会话的默认标题，后台任务为这些会话生成标题
+DEFAULT_CONVERSATION_TITLES = ("新会话", "新对话", "未命名对话")
+
 
 class CRUDConversation(CRUDBase[AIConversation, ConversationCreate, ConversationUpdate]):
     async def get_user_conversations(
@@ -24,6 +30,74 @@ class CRUDConversation(CRUDBase[AIConversation, ConversationCreate, Conversation
         result = await db.execute(query)
         return result.scalars().all()
     
+    async def list_user_conversations(
+        self,
+        db: AsyncSession,
+        *,
+        user_id: int,
+        limit: int = 100,
+        cursor: Optional[Tuple[datetime, int]] = None,
+        skip: int = 0
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        按 (updated_at, id) 降序分页获取用户的对话列表，返回 (对话, 下一页游标)
+
+        只查询标题、最后一条消息的预览和消息数，不加载消息内容；
+        分页使用 (user_id, updated_at) 索引，预览和计数使用 (conversation_id, created_at) 索引。
+        没有游标时按 skip 偏移，兼容旧的分页参数。
+        """
+        message_count = (
+            select(func.count(AIMessage.id))
+            .where(AIMessage.conversation_id == AIConversation.id)
+            .correlate(AIConversation)
+            .scalar_subquery()
+        )
+        last_message_preview = (
+            select(func.substr(AIMessage.content, 1, settings.AI_CONVERSATION_PREVIEW_CHARS))
+            .where(AIMessage.conversation_id == AIConversation.id)
+            .order_by(AIMessage.created_at.desc(), AIMessage.id.desc())
+            .limit(1)
+            .correlate(AIConversation)
+            .scalar_subquery()
+        )
+        query = (
+            select(
+                AIConversation.id,
+                AIConversation.user_id,
+                AIConversation.title,
+                AIConversation.created_at,
+                AIConversation.updated_at,
+                last_message_preview.label("last_message_preview"),
+                message_count.label("message_count")
+            )
+            .where(AIConversation.user_id == user_id)
+            .order_by(AIConversation.updated_at.desc(), AIConversation.id.desc())
+            .limit(limit + 1)
+        )
+        condition = keyset_condition(AIConversation.updated_at, AIConversation.id, cursor, descending=True)
+        if condition is not None:
+            query = query.where(condition)
+        elif skip:
+            query = query.offset(skip)
+        
+        rows = [dict(row) for row in (await db.execute(query)).mappings().all()]
+        # 多查一行判断是否还有下一页
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["updated_at"], rows[-1]["id"])
+        return rows, next_cursor
+    
+    async def exists_for_user(
+        self, db: AsyncSession, *, conversation_id: int, user_id: int
+    ) -> bool:
+        """检查对话是否存在且属于该用户，只按主键查询，不加载对话和消息"""
+        query = select(
+            exists().where(AIConversation.id == conversation_id, AIConversation.user_id == user_id)
+        )
+        result = await db.execute(query)
+        return bool(result.scalar())
+    
     async def create_conversation(
         self, db: AsyncSession, *, obj_in: ConversationCreate, user_id: int
     ) -> AIConversation:
@@ -82,6 +156,59 @@ class CRUDConversation(CRUDBase[AIConversation, ConversationCreate, Conversation
         await db.execute(query)
         await db.commit()
     
+    async def get_summary_candidates(
+        self, db: AsyncSession, *, updated_after: datetime, updated_before: datetime, limit: int
+    ) -> List[AIConversation]:
+        """获取上次后台处理后有更新的会话，按更新时间降序排序，使用 updated_at 索引"""
+        query = (
+            select(AIConversation)
+            .where(
+                AIConversation.updated_at >= updated_after,
+                AIConversation.updated_at <= updated_before,
+                or_(
+                    AIConversation.summarized_at.is_(None),
+                    AIConversation.summarized_at < AIConversation.updated_at
+                )
+            )
+            .order_by(AIConversation.updated_at.desc())
+            .limit(limit)
+        )
+        result = await db.execute(query)
+        return list(result.scalars().all())
+    
+    async def save_summary(
+        self,
+        db: AsyncSession,
+        *,
+        conversation_id: int,
+        processed_at: datetime,
+        title: Optional[str] = None,
+        summary: Optional[str] = None,
+        summary_message_id: Optional[int] = None
+    ) -> None:
+        """
+        保存后台生成的标题和摘要
+
+        processed_at 为处理时读取的会话更新时间，之后有新消息的会话会再次成为候选；
+        标题只替换默认标题，不覆盖处理期间用户修改的标题；不改变会话的更新时间。
+        """
+        values: Dict[str, Any] = {
+            "summarized_at": processed_at,
+            "updated_at": AIConversation.updated_at
+        }
+        if title:
+            values["title"] = case(
+                (AIConversation.title.in_(DEFAULT_CONVERSATION_TITLES), title),
+                else_=AIConversation.title
+            )
+        if summary:
+            values["summary"] = summary
+            values["summary_message_id"] = summary_message_id
+        await db.execute(
+            update(AIConversation).where(AIConversation.id == conversation_id).values(**values)
+        )
+        await db.commit()
+    
     async def delete_conversation(
         self, db: AsyncSession, *, conversation_id: int, user_id: Optional[int] = None
     ) -> bool:
@@ -109,7 +236,14 @@ class CRUDMessage(CRUDBase[AIMessage, MessageCreate, MessageCreate]):
             created_at=datetime.utcnow(),
             use_local_model=obj_in.useLocalModel if hasattr(obj_in, "useLocalModel") else True,
             model_name=obj_in.modelName if hasattr(obj_in, "modelName") else "gemma3:27b",
-            processing_time=obj_in.processingTime if hasattr(obj_in, "processingTime") else None
+            processing_time=obj_in.processingTime if hasattr(obj_in, "processingTime") else None,
+            backend=obj_in.backend,
+            queue_time=obj_in.queue_time,
+            time_to_first_token=obj_in.time_to_first_token,
+            prefill_time=obj_in.prefill_time,
+            prompt_tokens=obj_in.prompt_tokens,
+            completion_tokens=obj_in.completion_tokens,
+            tokens_per_second=obj_in.tokens_per_second
         )
         db.add(db_obj)
         await db.commit()
@@ -130,6 +264,58 @@ class CRUDMessage(CRUDBase[AIMessage, MessageCreate, MessageCreate]):
         result = await db.execute(query)
         return result.scalars().all()
     
+    async def list_messages(
+        self,
+        db: AsyncSession,
+        *,
+        conversation_id: int,
+        limit: int = 100,
+        cursor: Optional[Tuple[datetime, int]] = None,
+        descending: bool = False,
+        skip: int = 0
+    ) -> Tuple[List[AIMessage], Optional[str]]:
+        """
+        按 (created_at, id) 分页获取对话的消息，返回 (消息, 下一页游标)
+
+        使用 (conversation_id, created_at) 索引，descending 为True时从最新的消息向前翻页。
+        没有游标时按 skip 偏移，兼容旧的分页参数。
+        """
+        if descending:
+            order = (AIMessage.created_at.desc(), AIMessage.id.desc())
+        else:
+            order = (AIMessage.created_at.asc(), AIMessage.id.asc())
+        query = (
+            select(AIMessage)
+            .where(AIMessage.conversation_id == conversation_id)
+            .order_by(*order)
+            .limit(limit + 1)
+        )
+        condition = keyset_condition(AIMessage.created_at, AIMessage.id, cursor, descending=descending)
+        if condition is not None:
+            query = query.where(condition)
+        elif skip:
+            query = query.offset(skip)
+        
+        messages = list((await db.execute(query)).scalars().all())
+        next_cursor = None
+        if len(messages) > limit:
+            messages = messages[:limit]
+            next_cursor = encode_cursor(messages[-1].created_at, messages[-1].id)
+        return messages, next_cursor
+    
+    async def get_recent_messages(
+        self, db: AsyncSession, *, conversation_id: int, limit: int = 50
+    ) -> List[AIMessage]:
+        """获取对话最近的消息，按创建时间升序排序，用作AI助手的上下文"""
+        query = (
+            select(AIMessage)
+            .where(AIMessage.conversation_id == conversation_id)
+            .order_by(AIMessage.created_at.desc(), AIMessage.id.desc())
+            .limit(limit)
+        )
+        result = await db.execute(query)
+        return list(reversed(result.scalars().all()))
+    
     async def get_newest_message(
         self, db: AsyncSession, *, conversation_id: int, role: Optional[str] = None
     ) -> Optional[AIMessage]:
@@ -173,6 +359,61 @@ class CRUDMessage(CRUDBase[AIMessage, MessageCreate, MessageCreate]):
         await db.commit()
         
         return result.rowcount > 0
+    
+    async def get_generation_messages(
+        self, db: AsyncSession, *, conversation_id: int
+    ) -> List[AIMessage]:
+        """获取对话中的助手消息及其生成统计，按创建时间升序排序"""
+        query = (
+            select(AIMessage)
+            .where(AIMessage.conversation_id == conversation_id, AIMessage.role == "assistant")
+            .order_by(AIMessage.created_at.asc(), AIMessage.id.asc())
+        )
+        result = await db.execute(query)
+        return list(result.scalars().all())
+    
+    async def get_generation_summary(
+        self,
+        db: AsyncSession,
+        *,
+        user_id: Optional[int] = None,
+        conversation_id: Optional[int] = None,
+        skip: int = 0,
+        limit: int = 100
+    ) -> List[Dict[str, Any]]:
+        """按对话汇总助手消息的生成统计，按最近回答时间降序排序"""
+        last_answer_at = func.max(AIMessage.created_at)
+        query = (
+            select(
+                AIConversation.id.label("conversation_id"),
+                AIConversation.user_id,
+                AIConversation.title,
+                func.count(AIMessage.id).label("answers"),
+                func.count(AIMessage.backend).label("generated"),
+                func.sum(AIMessage.prompt_tokens).label("prompt_tokens"),
+                func.sum(AIMessage.completion_tokens).label("completion_tokens"),
+                func.avg(AIMessage.processing_time).label("avg_processing_time"),
+                func.avg(AIMessage.queue_time).label("avg_queue_time"),
+                func.avg(AIMessage.time_to_first_token).label("avg_time_to_first_token"),
+                func.avg(AIMessage.prefill_time).label("avg_prefill_time"),
+                func.avg(AIMessage.tokens_per_second).label("avg_tokens_per_second"),
+                last_answer_at.label("last_answer_at")
+            )
+            .join(AIMessage, AIMessage.conversation_id == AIConversation.id)
+            .where(AIMessage.role == "assistant")
+            .group_by(AIConversation.id, AIConversation.user_id, AIConversation.title)
+            .order_by(last_answer_at.desc())
+            .offset(skip)
+            .limit(limit)
+        )
+        
+        if user_id is not None:
+            query = query.where(AIConversation.user_id == user_id)
+        if conversation_id is not None:
+            query = query.where(AIConversation.id == conversation_id)
+        
+        result = await db.execute(query)
+        return [dict(row) for row in result.mappings().all()]
 
 
 conversation = CRUDConversation(AIConversation)
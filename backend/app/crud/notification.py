@@ -1,15 +1,75 @@
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from datetime import timezone, datetime
 
-from sqlalchemy import select, and_, or_
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select, and_, or_, func, insert, exists, update, delete
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager, joinedload
 
 from app.crud.base import CRUDBase
-from app.models.notification import Notification
+from app.models.notification import Notification, NotificationRecipient
 from app.models.user import User
 from app.schemas.notification import NotificationCreate, NotificationUpdate
+from app.utils.search import text_search_condition
 
 class CRUDNotification(CRUDBase[Notification, NotificationCreate, NotificationUpdate]):
+    async def resolve_recipient_ids(
+        self,
+        db: AsyncSession,
+        *,
+        obj_in: NotificationCreate
+    ) -> List[int]:
+        """根据通知的接收范围解析出接收者用户ID列表"""
+        if obj_in.recipient_user_id:
+            return [obj_in.recipient_user_id]
+
+        query = select(User.id)
+        if obj_in.recipient_role_id:
+            query = query.where(User.role_id == obj_in.recipient_role_id)
+
+        result = await db.execute(query)
+        return list(result.scalars().all())
+
+    async def create_with_recipients(
+        self,
+        db: AsyncSession,
+        *,
+        obj_in: NotificationCreate
+    ) -> Tuple[Notification, List[int]]:
+        """
+        创建通知并写入接收者收件箱
+
+        个人通知写入一行；角色通知和广播通知在发送时解析接收者，
+        通过一次批量插入写入收件箱，之后的列表和未读计数只需扫描收件箱索引。
+
+        返回:
+        - 通知对象和接收者用户ID列表
+        """
+        db_obj = self.model(**jsonable_encoder(obj_in))
+        db.add(db_obj)
+        await db.flush()
+        # 获取数据库生成的创建时间，冗余写入收件箱用于排序
+        await db.refresh(db_obj)
+
+        recipient_ids = await self.resolve_recipient_ids(db, obj_in=obj_in)
+        if recipient_ids:
+            await db.execute(
+                insert(NotificationRecipient),
+                [
+                    {
+                        "notification_id": db_obj.id,
+                        "user_id": recipient_id,
+                        "is_read": False,
+                        "created_at": db_obj.created_at
+                    }
+                    for recipient_id in recipient_ids
+                ]
+            )
+
+        await db.commit()
+        await db.refresh(db_obj)
+        return db_obj, recipient_ids
+
     async def get_user_notifications(
         self,
         db: AsyncSession,
@@ -19,76 +79,150 @@ class CRUDNotification(CRUDBase[Notification, NotificationCreate, NotificationUp
         limit: int = 100,
         unread_only: bool = False,
         search: Optional[str] = None
-    ) -> List[Notification]:
+    ) -> List[NotificationRecipient]:
         """
         获取用户的通知
-        
+
         参数:
         - user_id: 用户ID
         - skip: 分页偏移
         - limit: 限制返回数量
         - unread_only: 是否只返回未读通知
         - search: 搜索关键词（搜索标题和内容）
+
+        返回收件箱记录，已预加载对应的通知，已读状态以收件箱记录为准
         """
-        conditions = [
-            or_(
-                Notification.recipient_user_id == user_id,
-                and_(
-                    Notification.recipient_role_id.in_(
-                        select(User.role_id).where(User.id == user_id)
-                    ),
-                    Notification.recipient_user_id.is_(None)
-                ),
-                and_(
-                    Notification.recipient_user_id.is_(None),
-                    Notification.recipient_role_id.is_(None)
-                )
-            )
-        ]
-        
+        conditions = [NotificationRecipient.user_id == user_id]
+
         if unread_only:
-            conditions.append(Notification.is_read.is_(False))
-        
-        # 添加搜索条件
+            conditions.append(NotificationRecipient.is_read.is_(False))
+
+        # 添加搜索条件，MySQL下使用标题和内容的ngram全文索引
         if search and search.strip():
-            search_term = f"%{search.strip()}%"
             conditions.append(
-                or_(
-                    Notification.title.ilike(search_term),
-                    Notification.content.ilike(search_term)
+                text_search_condition(
+                    db, [Notification.title, Notification.content], search
                 )
             )
-        
+
         query = (
-            select(Notification)
+            select(NotificationRecipient)
+            .join(NotificationRecipient.notification)
+            .options(contains_eager(NotificationRecipient.notification))
             .where(and_(*conditions))
-            .order_by(Notification.created_at.desc())
+            .order_by(NotificationRecipient.created_at.desc())
             .offset(skip)
             .limit(limit)
         )
-        
+
         result = await db.execute(query)
         return result.scalars().all()
 
-    async def mark_as_read(
+    async def count_unread(
+        self,
+        db: AsyncSession,
+        *,
+        user_id: int
+    ) -> int:
+        """统计用户的未读通知数量"""
+        query = (
+            select(func.count(NotificationRecipient.id))
+            .where(
+                NotificationRecipient.user_id == user_id,
+                NotificationRecipient.is_read.is_(False)
+            )
+        )
+        result = await db.execute(query)
+        return result.scalar_one() or 0
+
+    async def get_unread_recipient_ids(
+        self,
+        db: AsyncSession,
+        *,
+        notification_ids: Optional[List[int]] = None,
+        created_before: Optional[datetime] = None
+    ) -> List[int]:
+        """
+        获取尚未阅读指定通知的接收者ID（去重）
+
+        在删除通知之前调用，删除后这些用户的未读数会变化
+        """
+        query = (
+            select(NotificationRecipient.user_id)
+            .where(NotificationRecipient.is_read.is_(False))
+            .distinct()
+        )
+        if notification_ids is not None:
+            query = query.where(NotificationRecipient.notification_id.in_(notification_ids))
+        if created_before is not None:
+            query = query.where(
+                NotificationRecipient.notification_id.in_(
+                    select(Notification.id).where(Notification.created_at < created_before)
+                )
+            )
+        result = await db.execute(query)
+        return list(result.scalars().all())
+
+    async def get_recipient(
         self,
         db: AsyncSession,
         *,
         notification_id: int,
         user_id: int
-    ) -> Optional[Notification]:
-        """将通知标记为已读"""
-        notification = await self.get(db, id=notification_id)
-        if notification and (
-            notification.recipient_user_id == user_id or
-            notification.recipient_user_id is None
-        ):
-            notification_in = NotificationUpdate(
-                is_read=True,
-                read_at=datetime.now(timezone.utc)
+    ) -> Optional[NotificationRecipient]:
+        """获取用户对某条通知的收件箱记录"""
+        query = (
+            select(NotificationRecipient)
+            .options(joinedload(NotificationRecipient.notification))
+            .where(
+                NotificationRecipient.notification_id == notification_id,
+                NotificationRecipient.user_id == user_id
             )
-            return await self.update(db, db_obj=notification, obj_in=notification_in)
-        return None
+        )
+        result = await db.execute(query)
+        return result.scalar_one_or_none()
+
+    async def has_been_read(
+        self,
+        db: AsyncSession,
+        *,
+        notification_id: int
+    ) -> bool:
+        """检查通知是否已被任一接收者阅读"""
+        query = select(
+            exists().where(
+                NotificationRecipient.notification_id == notification_id,
+                NotificationRecipient.is_read.is_(True)
+            )
+        )
+        result = await db.execute(query)
+        return bool(result.scalar())
+
+    async def mark_as_read(
+        self,
+        db: AsyncSession,
+        *,
+        notification_id: int,
+        user_id: int
+    ) -> Optional[NotificationRecipient]:
+        """将用户收件箱中的通知标记为已读"""
+        entry = await self.get_recipient(
+            db, notification_id=notification_id, user_id=user_id
+        )
+        if not entry:
+            return None
+
+        if not entry.is_read:
+            now = datetime.now(timezone.utc)
+            entry.is_read = True
+            entry.read_at = now
+            # 个人通知同步共享行的已读状态
+            if entry.notification.recipient_user_id == user_id:
+                entry.notification.is_read = True
+                entry.notification.read_at = now
+            await db.commit()
+
+        return entry
 
     async def mark_all_as_read(
         self,
@@ -96,39 +230,85 @@ class CRUDNotification(CRUDBase[Notification, NotificationCreate, NotificationUp
         *,
         user_id: int
     ) -> int:
-        """将用户的所有通知标记为已读"""
-        conditions = [
-            or_(
+        """将用户的所有通知标记为已读，使用单条UPDATE语句，返回更新的数量"""
+        now = datetime.now(timezone.utc)
+        result = await db.execute(
+            update(NotificationRecipient)
+            .where(
+                NotificationRecipient.user_id == user_id,
+                NotificationRecipient.is_read.is_(False)
+            )
+            .values(is_read=True, read_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        # 个人通知同步共享行的已读状态
+        await db.execute(
+            update(Notification)
+            .where(
                 Notification.recipient_user_id == user_id,
-                and_(
-                    Notification.recipient_role_id.in_(
-                        select(User.role_id).where(User.id == user_id)
-                    ),
-                    Notification.recipient_user_id.is_(None)
-                ),
-                and_(
-                    Notification.recipient_user_id.is_(None),
-                    Notification.recipient_role_id.is_(None)
+                Notification.is_read.is_(False)
+            )
+            .values(is_read=True, read_at=now)
+            .execution_options(synchronize_session=False)
+        )
+
+        await db.commit()
+        return result.rowcount
+
+    async def remove_multi(
+        self,
+        db: AsyncSession,
+        *,
+        ids: List[int],
+        user_id: int,
+        is_admin: bool = False
+    ) -> int:
+        """
+        批量删除通知，使用单条DELETE语句，返回删除的数量
+
+        权限规则与单条删除一致并直接写入WHERE条件：
+        1. 管理员可以删除所有通知
+        2. 接收者可以删除发给他个人的通知
+        3. 发送者可以删除自己发布且尚无人阅读的通知
+
+        收件箱记录由外键级联删除
+        """
+        if not ids:
+            return 0
+
+        query = delete(Notification).where(Notification.id.in_(ids))
+        if not is_admin:
+            query = query.where(
+                or_(
+                    Notification.recipient_user_id == user_id,
+                    and_(
+                        Notification.sender_id == user_id,
+                        ~exists().where(
+                            NotificationRecipient.notification_id == Notification.id,
+                            NotificationRecipient.is_read.is_(True)
+                        )
+                    )
                 )
-            ),
-            Notification.is_read.is_(False)
-        ]
-        
-        query = (
-            select(Notification)
-            .where(and_(*conditions))
+            )
+
+        result = await db.execute(query.execution_options(synchronize_session=False))
+        await db.commit()
+        return result.rowcount
+
+    async def remove_older_than(
+        self,
+        db: AsyncSession,
+        *,
+        before: datetime
+    ) -> int:
+        """删除指定时间之前创建的通知，使用单条DELETE语句，返回删除的数量"""
+        result = await db.execute(
+            delete(Notification)
+            .where(Notification.created_at < before)
+            .execution_options(synchronize_session=False)
         )
-        
-        result = await db.execute(query)
-        notifications = result.scalars().all()
-        
-        now = datetime.now(timezone.utc)
-        for notification in notifications:
-            notification.is_read = True
-            notification.read_at = now
-        
         await db.commit()
-        return len(notifications)
+        return result.rowcount
 
 # 创建全局通知CRUD实例
 notification = CRUDNotification(Notification)
@@ -6,6 +6,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.crud.base import CRUDBase
 from app.models.student import Student
 from app.schemas.student import StudentCreate, StudentUpdate
+from app.utils.search import text_search_condition
 
 class CRUDStudent(CRUDBase[Student, StudentCreate, StudentUpdate]):
     async def get_by_student_id_no(
@@ -173,17 +174,17 @@ class CRUDStudent(CRUDBase[Student, StudentCreate, StudentUpdate]):
                 query = query.where(Student.class_id == filters["class_id"])
                 count_query = count_query.where(Student.class_id == filters["class_id"])
             
-            # 姓名模糊搜索
+            # 姓名模糊搜索，MySQL下使用ngram全文索引
             if "name" in filters and filters["name"]:
-                name_filter = f"%{filters['name']}%"
-                query = query.where(Student.full_name.like(name_filter))
-                count_query = count_query.where(Student.full_name.like(name_filter))
+                name_condition = text_search_condition(db, [Student.full_name], filters["name"])
+                query = query.where(name_condition)
+                count_query = count_query.where(name_condition)
             
-            # 学号模糊搜索
+            # 学号模糊搜索，MySQL下使用ngram全文索引
             if "student_id_no" in filters and filters["student_id_no"]:
-                id_no_filter = f"%{filters['student_id_no']}%"
-                query = query.where(Student.student_id_no.like(id_no_filter))
-                count_query = count_query.where(Student.student_id_no.like(id_no_filter))
+                id_no_condition = text_search_condition(db, [Student.student_id_no], filters["student_id_no"])
+                query = query.where(id_no_condition)
+                count_query = count_query.where(id_no_condition)
             
             # 性别过滤
             if "gender" in filters and filters["gender"]:
@@ -1,8 +1,10 @@
-from typing import Any, Dict, List, Optional, Union
-from sqlalchemy import select, func
+from typing import Any, Dict, List, Optional, Tuple, Union
+from sqlalchemy import case, select, func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.models.uploads import Upload
+from app.models.ai_conversation import AIMessage
+from app.models.uploads import Upload, UploadBlob
 from app.schemas.uploads import UploadCreate, UploadUpdate
 
 
@@ -18,7 +20,8 @@ async def create(db: AsyncSession, *, obj_in: UploadCreate) -> Upload:
         entity_type=obj_in.entity_type,
         entity_id=obj_in.entity_id,
         uploader_id=obj_in.uploader_id,
-        is_public=obj_in.is_public
+        is_public=obj_in.is_public,
+        blob_id=obj_in.blob_id
     )
     db.add(db_obj)
     await db.commit()
@@ -26,6 +29,85 @@ async def create(db: AsyncSession, *, obj_in: UploadCreate) -> Upload:
     return db_obj
 
 
+async def _lock_blob(db: AsyncSession, **filters: Any) -> Optional[UploadBlob]:
+    result = await db.execute(select(UploadBlob).filter_by(**filters).with_for_update())
+    return result.scalars().first()
+
+
+async def acquire_blob(
+    db: AsyncSession, *, sha256: str, size: int, storage_path: str
+) -> Tuple[UploadBlob, bool]:
+    """
+    增加内容哈希对应的存储文件的引用数，不存在时创建，返回 (存储文件, 是否新建)
+    
+    锁定已有的行后增加引用数；并发创建同一内容时唯一索引冲突，回滚到保存点后改为增加引用数。
+    storage_path 只在新建时使用，已有内容沿用原来的路径。
+    只刷新不提交，由调用方和上传记录一起提交。
+    """
+    blob = await _lock_blob(db, sha256=sha256)
+    if blob is None:
+        try:
+            async with db.begin_nested():
+                blob = UploadBlob(sha256=sha256, size=size, storage_path=storage_path, ref_count=1)
+                db.add(blob)
+            return blob, True
+        except IntegrityError:
+            blob = await _lock_blob(db, sha256=sha256)
+            if blob is None:
+                raise
+    blob.ref_count = UploadBlob.ref_count + 1
+    await db.flush()
+    await db.refresh(blob)
+    return blob, False
+
+
+async def release_blob(db: AsyncSession, *, upload: Upload) -> Optional[UploadBlob]:
+    """
+    解除上传记录对存储文件的引用并减少引用数，最后一个引用释放时删除记录并返回该存储文件，由调用方删除文件
+    
+    只刷新不提交，由调用方和上传记录的删除一起提交。
+    """
+    blob_id = upload.blob_id
+    if blob_id is None:
+        return None
+    upload.blob_id = None
+    await db.flush()
+    blob = await _lock_blob(db, id=blob_id)
+    if blob is None:
+        return None
+    if blob.ref_count <= 1:
+        await db.delete(blob)
+        await db.flush()
+        return blob
+    blob.ref_count = UploadBlob.ref_count - 1
+    await db.flush()
+    return None
+
+
+async def get_storage_stats(db: AsyncSession) -> Dict[str, Any]:
+    """统计去重存储节省的空间"""
+    uploads, deduplicated, logical_bytes = (await db.execute(
+        select(
+            func.count(Upload.id),
+            func.count(Upload.blob_id),
+            func.coalesce(func.sum(case((Upload.blob_id.isnot(None), Upload.file_size), else_=0)), 0)
+        )
+    )).one()
+    blobs, stored_bytes = (await db.execute(
+        select(func.count(UploadBlob.id), func.coalesce(func.sum(UploadBlob.size), 0))
+    )).one()
+    return {
+        "uploads": uploads,
+        "deduplicated_uploads": deduplicated,
+        "legacy_uploads": uploads - deduplicated,
+        "blobs": blobs,
+        "logical_bytes": int(logical_bytes),
+        "stored_bytes": int(stored_bytes),
+        "saved_bytes": int(logical_bytes) - int(stored_bytes),
+        "dedupe_ratio": round(int(logical_bytes) / int(stored_bytes), 3) if stored_bytes else 1.0
+    }
+
+
 async def get(db: AsyncSession, id: int) -> Optional[Upload]:
     """获取单个文件上传记录"""
     result = await db.execute(select(Upload).filter(Upload.id == id))
@@ -51,6 +133,24 @@ async def get_by_entity(
     return result.scalars().all()
 
 
+async def get_conversation_attachments(
+    db: AsyncSession, *, conversation_id: int, uploader_id: int, limit: int
+) -> List[Upload]:
+    """获取用户在对话消息中上传的附件，最新的在前"""
+    result = await db.execute(
+        select(Upload)
+        .join(AIMessage, AIMessage.id == Upload.entity_id)
+        .filter(
+            Upload.entity_type == "ai_message",
+            Upload.uploader_id == uploader_id,
+            AIMessage.conversation_id == conversation_id
+        )
+        .order_by(Upload.id.desc())
+        .limit(limit)
+    )
+    return result.scalars().all()
+
+
 async def get_by_module(
     db: AsyncSession, *, module: str, skip: int = 0, limit: int = 100
 ) -> List[Upload]:
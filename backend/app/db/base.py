@@ -11,8 +11,8 @@ from app.models.student import Student  # noqa
 from app.models.quant_item import QuantItem  # noqa
 from app.models.quant_item_category import QuantItemCategory  # noqa
 from app.models.quant_record import QuantRecord  # noqa
-from app.models.notification import Notification  # noqa
-from app.models.ai_conversation import AIConversation, AIMessage  # noqa
-from app.models.uploads import Upload  # noqa
+from app.models.notification import Notification, NotificationRecipient  # noqa
+from app.models.ai_conversation import AIConversation, AIMessage, AIJob  # noqa
+from app.models.uploads import Upload, UploadBlob  # noqa
 from app.models.classes import Classes  # noqa
 
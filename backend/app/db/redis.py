@@ -0,0 +1,38 @@
+from typing import Optional
+
+import redis.asyncio as aioredis
+
+from app.core.config import settings
+from app.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+# Redis只用于共享短期状态，超时较短，出错时调用方回退到进程内实现
+_SOCKET_TIMEOUT = 1.0
+
+_client: Optional[aioredis.Redis] = None
+
+
+def get_redis() -> Optional[aioredis.Redis]:
+    """获取共享的Redis客户端，未配置 REDIS_URL 时返回None"""
+    global _client
+    if not settings.REDIS_URL:
+        return None
+    if _client is None:
+        _client = aioredis.from_url(
+            settings.REDIS_URL,
+            decode_responses=True,
+            socket_timeout=_SOCKET_TIMEOUT,
+            socket_connect_timeout=_SOCKET_TIMEOUT
+        )
+        logger.info("已创建Redis客户端")
+    return _client
+
+
+async def close_redis() -> None:
+    """关闭Redis连接，应用关闭时调用"""
+    global _client
+    client, _client = _client, None
+    if client is not None:
+        # redis 5.0.1 起 close 改名为 aclose
+        await (client.aclose() if hasattr(client, "aclose") else client.close())
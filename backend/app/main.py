@@ -6,10 +6,11 @@ from decimal import Decimal
 from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse
 
-from fastapi import FastAPI, Request, status
+from fastapi import FastAPI, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.datastructures import Headers
 from starlette.middleware.base import BaseHTTPMiddleware
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
@@ -53,11 +54,28 @@ async def lifespan(app: FastAPI):
     logger.info("Starting application")
     metrics_task = asyncio.create_task(metrics_updater())
     
-    # 初始化AI助手服务
+    # 加载LLM后端节点并启动健康检查，所有AI调用共享keep-alive连接
+    from app.services.llm_backends import llm_backend_pool
+    from app.services.llm_client import llm_client_pool
+    await llm_backend_pool.start()
+    
+    # 初始化AI助手服务，在后台预加载Ollama模型
     from app.services.ai_service import ai_assistant
     await ai_assistant.initialize()
     logger.info("AI Assistant service initialized")
     
+    # 启动AI回复任务worker，继续执行上次退出时未完成的任务
+    from app.services.ai_jobs import ai_job_queue
+    ai_job_queue.start()
+    
+    # 在后台从最近的用户消息加载输入联想索引
+    from app.services.query_suggestions import query_suggestions
+    query_suggestions.start()
+    
+    # 启动会话标题和摘要的后台任务，只在模型空闲时生成
+    from app.services.conversation_summarizer import conversation_summarizer
+    conversation_summarizer.start()
+    
     # 确保上传目录存在
     uploads_dir = Path(settings.UPLOADS_DIR)
     uploads_dir.mkdir(parents=True, exist_ok=True)
@@ -72,6 +90,18 @@ async def lifespan(app: FastAPI):
         await metrics_task
     except asyncio.CancelledError:
         pass
+    
+    await ai_job_queue.stop()
+    await query_suggestions.stop()
+    await conversation_summarizer.stop()
+    from app.services.attachment_extractor import attachment_extractor
+    await attachment_extractor.shutdown()
+    await ai_assistant.shutdown()
+    await llm_backend_pool.stop()
+    await llm_client_pool.close()
+    
+    from app.db.redis import close_redis
+    await close_redis()
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -97,7 +127,8 @@ class APIPerformanceMiddleware(BaseHTTPMiddleware):
             "/api/v1/health/slow-endpoints",
             "/api/v1/health/high-traffic",
             "/api/v1/health/system-info",
-            "/api/v1/health/db-health"
+            "/api/v1/health/db-health",
+            "/api/v1/health/llm-backends"
         ]
         
         # 检查路径是否在排除列表中，或者以某个前缀开始
@@ -127,6 +158,59 @@ class APIPerformanceMiddleware(BaseHTTPMiddleware):
         
         return response
 
+# 上传请求的表单字段和分段头部预留的大小
+_MULTIPART_OVERHEAD = 1024 * 1024
+
+
+class UploadSizeLimitMiddleware:
+    """
+    限制multipart请求体的大小
+    
+    表单在进入接口之前就会被完整接收并写入临时文件，接口中的大小检查无法阻止过大的上传。
+    请求声明的 Content-Length 超过 MAX_UPLOAD_SIZE × MAX_FILES_PER_REQUEST 时直接返回413，不读取请求体；
+    没有 Content-Length（分块传输）时在接收过程中累计大小，超过上限立即停止接收。
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        if not headers.get("content-type", "").startswith("multipart/form-data"):
+            await self.app(scope, receive, send)
+            return
+        
+        limit = settings.MAX_UPLOAD_SIZE * settings.MAX_FILES_PER_REQUEST + _MULTIPART_OVERHEAD
+        detail = f"请求体超过限制 ({limit / 1024 / 1024:.1f}MB)"
+        content_length = headers.get("content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse(
+                status_code=413,
+                content={"error": {"code": "413", "message": detail}}
+            )
+            await response(scope, receive, send)
+            return
+        
+        received = 0
+        
+        async def receive_limited():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # 表单解析时抛出的HTTPException由统一异常处理返回
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+        
+        await self.app(scope, receive_limited, send)
+
+# 限制上传请求体大小，放在CORS之内，413响应也带有CORS头
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # 配置CORS
 app.add_middleware(
     CORSMiddleware,
@@ -134,6 +218,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 分页接口通过响应头返回下一页游标
+    expose_headers=["X-Next-Cursor"],
 )
 
 # 添加API性能监控中间件
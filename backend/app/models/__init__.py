@@ -1,9 +1,9 @@
 from app.db.base import Base
 from app.models.user import User
 from app.models.role import Role
-from app.models.ai_conversation import AIConversation, AIMessage
+from app.models.ai_conversation import AIConversation, AIMessage, AIJob
 from app.models.classes import Classes
-from app.models.notification import Notification
+from app.models.notification import Notification, NotificationRecipient
 from app.models.student import Student
 from app.models.quant_item import QuantItem
 from app.models.quant_item_category import QuantItemCategory
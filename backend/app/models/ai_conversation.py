@@ -13,6 +13,10 @@ class AIConversation(Base):
     title = Column(String(255), nullable=False, default="未命名对话", comment="对话标题")
     created_at = Column(DateTime, default=func.now(), nullable=False, comment="创建时间")
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False, comment="更新时间")
+    # 后台生成的摘要，用作长对话的压缩上下文
+    summary = Column(Text, nullable=True, comment="对话摘要")
+    summary_message_id = Column(Integer, nullable=True, comment="摘要包含的最后一条消息ID")
+    summarized_at = Column(DateTime, nullable=True, comment="最近一次后台处理时会话的更新时间，早于updated_at表示之后有新消息")
     
     # 关系
     user = relationship("User", back_populates="ai_conversations")
@@ -21,6 +25,7 @@ class AIConversation(Base):
     # 索引
     __table_args__ = (
         Index("ix_ai_conversations_user_id_updated_at", "user_id", "updated_at"),
+        Index("ix_ai_conversations_updated_at", "updated_at"),
     )
 
 
@@ -35,6 +40,14 @@ class AIMessage(Base):
     processing_time = Column(Float, nullable=True, comment="处理时间（秒）（仅适用于assistant消息）")
     use_local_model = Column(Boolean, default=True, nullable=True, comment="是否使用本地模型")
     model_name = Column(String(100), default="gemma3:27", nullable=True, comment="使用的模型名称")
+    # 生成统计（仅适用于assistant消息，命中缓存的回答为空）
+    backend = Column(String(50), nullable=True, comment="生成回答的后端")
+    queue_time = Column(Float, nullable=True, comment="排队等待时间（秒）")
+    time_to_first_token = Column(Float, nullable=True, comment="首个token延迟（秒）")
+    prefill_time = Column(Float, nullable=True, comment="预填充耗时（秒）")
+    prompt_tokens = Column(Integer, nullable=True, comment="提示token数")
+    completion_tokens = Column(Integer, nullable=True, comment="生成token数")
+    tokens_per_second = Column(Float, nullable=True, comment="每秒生成token数")
     
     # 关系
     conversation = relationship("AIConversation", back_populates="messages")
@@ -47,4 +60,40 @@ class AIMessage(Base):
     @property
     def get_attachments(self):
         """获取关联到此消息的附件，需要在ORM会话中使用"""
-        pass 
\ No newline at end of file
+        pass 
+
+class AIJob(Base):
+    """AI回复生成任务，由后台worker领取执行，失败后按退避时间重试"""
+    __tablename__ = "ai_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, comment="用户ID")
+    conversation_id = Column(
+        Integer, ForeignKey("ai_conversations.id", ondelete="CASCADE"), nullable=False, comment="对话ID"
+    )
+    message_id = Column(
+        Integer, ForeignKey("ai_messages.id", ondelete="SET NULL"), nullable=True, comment="触发任务的用户消息ID"
+    )
+    query_text = Column(Text, nullable=False, comment="查询内容")
+    use_local_model = Column(Boolean, default=True, nullable=False, comment="是否使用本地模型")
+    model_name = Column(String(100), nullable=True, comment="使用的模型名称")
+    use_think_mode = Column(Boolean, default=True, nullable=False, comment="是否使用思考模式")
+    status = Column(String(20), default="pending", nullable=False, comment="状态：pending/running/succeeded/failed/cancelled")
+    attempts = Column(Integer, default=0, nullable=False, comment="已执行次数")
+    max_attempts = Column(Integer, default=3, nullable=False, comment="最多执行次数")
+    run_after = Column(DateTime, default=func.now(), nullable=False, comment="最早执行时间，用于重试退避")
+    locked_by = Column(String(64), nullable=True, comment="执行中的worker")
+    locked_at = Column(DateTime, nullable=True, comment="领取时间，超过租约时间视为worker已退出")
+    result_message_id = Column(
+        Integer, ForeignKey("ai_messages.id", ondelete="SET NULL"), nullable=True, comment="生成的助手消息ID"
+    )
+    error = Column(Text, nullable=True, comment="最近一次失败原因")
+    created_at = Column(DateTime, default=func.now(), nullable=False, comment="创建时间")
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False, comment="更新时间")
+    finished_at = Column(DateTime, nullable=True, comment="完成时间")
+
+    # 索引
+    __table_args__ = (
+        Index("ix_ai_jobs_status_run_after", "status", "run_after"),
+        Index("ix_ai_jobs_user_id_created_at", "user_id", "created_at"),
+    )
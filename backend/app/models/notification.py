@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, func
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Index, UniqueConstraint, func
 from sqlalchemy.orm import relationship
 
 from app.db.base import Base
@@ -24,3 +24,45 @@ class Notification(Base):
     sender = relationship("User", foreign_keys=[sender_id], back_populates="notifications_sent")
     recipient_user = relationship("User", foreign_keys=[recipient_user_id], back_populates="notifications_received")
     recipient_role = relationship("Role", back_populates="notifications")
+    # 收件箱记录由数据库外键级联删除，避免删除广播通知时加载全部接收者
+    recipients = relationship(
+        "NotificationRecipient",
+        back_populates="notification",
+        cascade="all, delete-orphan",
+        passive_deletes=True
+    )
+
+    # 索引
+    __table_args__ = (
+        # 标题和内容的ngram全文索引，用于中文搜索
+        Index(
+            "ft_notifications_title_content", "title", "content",
+            mysql_prefix="FULLTEXT", mysql_with_parser="ngram"
+        ),
+    )
+
+
+class NotificationRecipient(Base):
+    """通知收件箱，每个接收者一行，独立保存已读状态"""
+    __tablename__ = "notification_recipients"
+
+    id = Column(Integer, primary_key=True, index=True)
+    notification_id = Column(
+        Integer, ForeignKey("notifications.id", ondelete="CASCADE"), nullable=False, comment="通知ID"
+    )
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, comment="接收者用户ID")
+    is_read = Column(Boolean, default=False, nullable=False, comment="是否已读")
+    created_at = Column(DateTime, nullable=False, comment="通知创建时间（冗余存储，用于排序）")
+    read_at = Column(DateTime, nullable=True, comment="阅读时间")
+
+    # 关系
+    notification = relationship("Notification", back_populates="recipients")
+
+    # 索引
+    __table_args__ = (
+        # 未读列表与未读计数：user_id + is_read 前缀上的范围扫描
+        Index("ix_notification_recipients_user_id_is_read_created_at", "user_id", "is_read", "created_at"),
+        # 全部通知列表：按 user_id 范围扫描并按时间有序返回
+        Index("ix_notification_recipients_user_id_created_at", "user_id", "created_at"),
+        UniqueConstraint("notification_id", "user_id", name="uq_notification_recipients_notification_user"),
+    )
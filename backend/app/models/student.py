@@ -1,4 +1,4 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, Date, DateTime, func, Boolean, Float
+from sqlalchemy import Column, ForeignKey, Integer, String, Date, DateTime, func, Boolean, Float, Index
 from sqlalchemy.orm import relationship
 
 from app.db.base import Base
@@ -27,3 +27,10 @@ class Student(Base):
     user = relationship("User", foreign_keys=[user_id])
     class_ = relationship("Classes", back_populates="students")
     quant_records = relationship("QuantRecord", back_populates="student")
+
+    # 索引
+    __table_args__ = (
+        # 姓名和学号的ngram全文索引，支持中文姓名和学号片段搜索
+        Index("ft_students_full_name", "full_name", mysql_prefix="FULLTEXT", mysql_with_parser="ngram"),
+        Index("ft_students_student_id_no", "student_id_no", mysql_prefix="FULLTEXT", mysql_with_parser="ngram"),
+    )
@@ -5,6 +5,19 @@ from sqlalchemy.orm import relationship
 from app.db.base import Base
 
 
+class UploadBlob(Base):
+    """按内容SHA-256去重保存的上传文件，内容相同的上传记录指向同一个文件，引用数为0时删除"""
+    __tablename__ = "upload_blobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    sha256 = Column(String(64), nullable=False, unique=True, comment="文件内容的SHA-256")
+    size = Column(Integer, nullable=False, comment="文件大小（字节）")
+    storage_path = Column(String(512), nullable=False, comment="相对上传目录的存储路径")
+    ref_count = Column(Integer, default=1, nullable=False, comment="引用该文件的上传记录数")
+    created_at = Column(DateTime, default=func.now(), nullable=False, comment="创建时间")
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False, comment="更新时间")
+
+
 class Upload(Base):
     """通用文件上传模型，用于存储上传文件的元数据"""
     __tablename__ = "uploads"
@@ -19,16 +32,19 @@ class Upload(Base):
     entity_type = Column(String(50), nullable=True, comment="实体类型，如message, user, etc.")
     entity_id = Column(Integer, nullable=True, comment="关联实体ID")
     uploader_id = Column(Integer, ForeignKey("users.id"), nullable=False, comment="上传者ID")
+    blob_id = Column(Integer, ForeignKey("upload_blobs.id"), nullable=True, comment="存储文件ID，为空表示去重存储之前上传的文件")
     is_public = Column(Integer, default=0, nullable=False, comment="是否公开，0-私有，1-公开")
     created_at = Column(DateTime, default=func.now(), nullable=False, comment="创建时间")
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False, comment="更新时间")
     
     # 关系
     uploader = relationship("User", foreign_keys=[uploader_id])
+    blob = relationship("UploadBlob")
     
     # 索引
     __table_args__ = (
         Index("ix_uploads_entity_type_entity_id", "entity_type", "entity_id"),
         Index("ix_uploads_uploader_id", "uploader_id"),
         Index("ix_uploads_module", "module"),
+        Index("ix_uploads_blob_id", "blob_id"),
     ) 
\ No newline at end of file
@@ -24,6 +24,13 @@ class MessageCreate(MessageBase):
     use_local_model: Optional[bool] = True
     model_name: Optional[str] = "gemma3:27"
     processingTime: Optional[float] = Field(None, description="处理时间（秒）")
+    backend: Optional[str] = Field(None, description="生成回答的后端")
+    queue_time: Optional[float] = Field(None, description="排队等待时间（秒）")
+    time_to_first_token: Optional[float] = Field(None, description="首个token延迟（秒）")
+    prefill_time: Optional[float] = Field(None, description="预填充耗时（秒）")
+    prompt_tokens: Optional[int] = Field(None, description="提示token数")
+    completion_tokens: Optional[int] = Field(None, description="生成token数")
+    tokens_per_second: Optional[float] = Field(None, description="每秒生成token数")
 
 class Message(MessageBase):
     id: int
@@ -32,6 +39,7 @@ class Message(MessageBase):
     processing_time: Optional[float] = None
     use_local_model: Optional[bool] = True
     model_name: Optional[str] = "gemma3:27"
+    job_id: Optional[int] = Field(None, description="生成AI回复的后台任务ID，发送用户消息且转入后台生成时返回")
     
     class Config:
         from_attributes = True
@@ -55,6 +63,11 @@ class Conversation(ConversationBase):
     class Config:
         from_attributes = True
 
+class ConversationSummary(Conversation):
+    """会话列表项，只包含最后一条消息的预览和消息数，不加载消息内容"""
+    last_message_preview: Optional[str] = Field(None, description="最后一条消息的开头部分")
+    message_count: int = Field(0, description="消息数")
+
 class ConversationWithMessages(Conversation):
     messages: List[Message] = []
     
@@ -67,6 +80,61 @@ class ConversationList(BaseModel):
     class Config:
         from_attributes = True
 
+class AIJobStatus(BaseModel):
+    """AI回复生成任务的状态"""
+    id: int
+    conversation_id: int
+    message_id: Optional[int] = None
+    status: str = Field(..., description="pending/running/succeeded/failed/cancelled")
+    attempts: int
+    max_attempts: int
+    run_after: datetime
+    result_message_id: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+class AIGenerationStats(BaseModel):
+    """单条助手消息的生成统计"""
+    id: int
+    created_at: datetime
+    model_name: Optional[str] = None
+    backend: Optional[str] = None
+    processing_time: Optional[float] = None
+    queue_time: Optional[float] = None
+    time_to_first_token: Optional[float] = None
+    prefill_time: Optional[float] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    tokens_per_second: Optional[float] = None
+    
+    class Config:
+        from_attributes = True
+
+class ConversationGenerationSummary(BaseModel):
+    """对话的生成统计汇总"""
+    conversation_id: int
+    user_id: int
+    title: str
+    answers: int = Field(..., description="助手消息数")
+    generated: int = Field(..., description="有生成统计的助手消息数，命中缓存的回答不计入")
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    avg_processing_time: Optional[float] = None
+    avg_queue_time: Optional[float] = None
+    avg_time_to_first_token: Optional[float] = None
+    avg_prefill_time: Optional[float] = None
+    avg_tokens_per_second: Optional[float] = None
+    last_answer_at: Optional[datetime] = None
+
+class ConversationGenerationDetail(BaseModel):
+    """对话的生成统计明细"""
+    summary: ConversationGenerationSummary
+    messages: List[AIGenerationStats]
+
 class ConversationDetail(Conversation):
     messages: list[Message] = []
     
@@ -23,6 +23,9 @@ class NotificationUpdate(BaseModel):
     is_read: Optional[bool] = None
     read_at: Optional[datetime] = None
 
+class NotificationBatchDelete(BaseModel):
+    ids: List[int] = Field(..., min_length=1, max_length=1000, description="要删除的通知ID列表")
+
 class NotificationInDB(NotificationBase):
     id: int
     sender_id: int
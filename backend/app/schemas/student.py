@@ -78,3 +78,13 @@ class StudentListResponse(BaseModel):
     
     class Config:
         from_attributes = True
+
+class StudentLookup(BaseModel):
+    id: int
+    student_id_no: str
+    full_name: str
+    class_id: int
+    is_active: bool
+
+class StudentLookupResponse(BaseModel):
+    data: List[StudentLookup]
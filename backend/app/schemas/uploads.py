@@ -19,6 +19,7 @@ class UploadBase(BaseModel):
 class UploadCreate(UploadBase):
     """创建文件上传模型"""
     uploader_id: int = Field(..., description="上传者ID")
+    blob_id: Optional[int] = Field(None, description="存储文件ID")
 
 
 class UploadUpdate(BaseModel):
@@ -57,4 +58,16 @@ class UploadList(BaseModel):
     size: int
 
     class Config:
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True 
+
+
+class UploadStorageStats(BaseModel):
+    """上传文件去重存储的统计"""
+    uploads: int = Field(..., description="上传记录数")
+    deduplicated_uploads: int = Field(..., description="使用去重存储的上传记录数")
+    legacy_uploads: int = Field(..., description="去重存储之前上传、单独保存的记录数")
+    blobs: int = Field(..., description="去重存储的文件数")
+    logical_bytes: int = Field(..., description="去重存储的上传记录的文件大小合计（字节）")
+    stored_bytes: int = Field(..., description="去重存储实际占用的大小（字节）")
+    saved_bytes: int = Field(..., description="去重节省的大小（字节）")
+    dedupe_ratio: float = Field(..., description="去重比例，逻辑大小/实际占用大小")
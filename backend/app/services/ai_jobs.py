@@ -0,0 +1,402 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+import asyncio
+import os
+import socket
+import time
+import uuid
+
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.errors import GenerationCancelledError, ServiceOverloadedError
+from app.core.logging import get_logger
+from app.core.monitoring import AI_JOB_DURATION, AI_JOBS_PROCESSED
+from app.db.session import async_session
+from app.models.ai_conversation import AIJob
+
+logger = get_logger(__name__)
+
+# 任务状态
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+
+@dataclass
+class _ClaimedJob:
+    """已领取任务的快照，执行期间不持有数据库会话"""
+    id: int
+    user_id: int
+    conversation_id: int
+    message_id: Optional[int]
+    query_text: str
+    use_local_model: bool
+    model_name: Optional[str]
+    use_think_mode: bool
+    attempts: int
+    max_attempts: int
+
+    @classmethod
+    def from_model(cls, job: AIJob) -> "_ClaimedJob":
+        return cls(
+            id=job.id,
+            user_id=job.user_id,
+            conversation_id=job.conversation_id,
+            message_id=job.message_id,
+            query_text=job.query_text,
+            use_local_model=job.use_local_model,
+            model_name=job.model_name,
+            use_think_mode=job.use_think_mode,
+            attempts=job.attempts,
+            max_attempts=job.max_attempts
+        )
+
+
+class AIJobQueue:
+    """
+    AI回复生成任务队列
+
+    任务保存在 ai_jobs 表中，进程重启后未完成的任务仍会被执行。每个进程启动 AI_JOB_WORKERS 个worker，
+    通过 SELECT ... FOR UPDATE SKIP LOCKED 和带状态条件的更新领取任务，多进程部署时同一任务只会被一个worker执行。
+    执行失败（所有节点不可用、繁忙或超时）后按 AI_JOB_RETRY_BASE_DELAY 指数退避重试，
+    达到 max_attempts 次后标记为失败。执行中的任务超过 AI_JOB_LEASE_SECONDS 秒未完成视为worker已退出，重新领取。
+    执行中的任务与其他生成一样登记到 generation_registry，同一会话有新的问题或用户取消时停止生成并标记为已取消。
+    任务状态变化时通过AI助手WebSocket推送给用户。
+    """
+
+    def __init__(self):
+        self._workers: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        # worker序号 -> 正在执行的任务ID，停止时放回队列
+        self._current: Dict[int, int] = {}
+        self._instance = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    async def enqueue(
+        self,
+        db: AsyncSession,
+        *,
+        user_id: int,
+        conversation_id: int,
+        query_text: str,
+        message_id: Optional[int] = None,
+        use_local_model: bool = True,
+        model_name: Optional[str] = None,
+        use_think_mode: bool = True
+    ) -> AIJob:
+        """创建任务并唤醒worker，返回已提交的任务"""
+        now = datetime.now()
+        job = AIJob(
+            user_id=user_id,
+            conversation_id=conversation_id,
+            message_id=message_id,
+            query_text=query_text,
+            use_local_model=use_local_model,
+            model_name=model_name,
+            use_think_mode=use_think_mode,
+            status=JOB_PENDING,
+            attempts=0,
+            max_attempts=max(1, settings.AI_JOB_MAX_ATTEMPTS),
+            run_after=now,
+            created_at=now,
+            updated_at=now
+        )
+        db.add(job)
+        await db.commit()
+        await db.refresh(job)
+        logger.info(f"创建AI回复任务: job={job.id}, conversation={conversation_id}")
+        self._wakeup.set()
+        return job
+
+    async def cancel_pending(
+        self,
+        db: AsyncSession,
+        *,
+        user_id: int,
+        conversation_id: Optional[int] = None
+    ) -> int:
+        """取消用户（指定会话或全部会话）尚未执行的任务，返回取消的数量"""
+        conditions = [AIJob.user_id == user_id, AIJob.status == JOB_PENDING]
+        if conversation_id is not None:
+            conditions.append(AIJob.conversation_id == conversation_id)
+        now = datetime.now()
+        result = await db.execute(
+            update(AIJob)
+            .where(*conditions)
+            .values(status=JOB_CANCELLED, finished_at=now, updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        if result.rowcount:
+            AI_JOBS_PROCESSED.labels(status=JOB_CANCELLED).inc(result.rowcount)
+            logger.info(f"取消AI回复任务: user={user_id}, conversation={conversation_id}, count={result.rowcount}")
+        return result.rowcount
+
+    async def get_job(self, db: AsyncSession, job_id: int) -> Optional[AIJob]:
+        result = await db.execute(select(AIJob).where(AIJob.id == job_id))
+        return result.scalar_one_or_none()
+
+    def start(self) -> None:
+        """启动worker，应用启动时调用"""
+        if self._workers:
+            return
+        self._wakeup = asyncio.Event()
+        self._workers = [
+            asyncio.create_task(self._worker(index), name=f"ai-job-worker-{index}")
+            for index in range(max(0, settings.AI_JOB_WORKERS))
+        ]
+        logger.info(f"AI回复任务队列已启动: workers={len(self._workers)}")
+
+    async def stop(self) -> None:
+        """停止worker，正在执行的任务放回队列，由重启后的进程继续执行"""
+        workers, self._workers = self._workers, []
+        for task in workers:
+            task.cancel()
+        if workers:
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        interrupted, self._current = list(self._current.values()), {}
+        for job_id in interrupted:
+            try:
+                await self._requeue(job_id)
+            except Exception as e:
+                logger.error(f"放回AI回复任务失败: job={job_id}, {str(e)}")
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            try:
+                job = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"领取AI回复任务失败: {str(e)}")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.AI_JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._current[index] = job.id
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 任务保持执行中状态，租约过期后重新领取
+                logger.error(f"执行AI回复任务出错: job={job.id}, {str(e)}")
+            self._current.pop(index, None)
+
+    async def _claim(self) -> Optional[_ClaimedJob]:
+        """领取一个到期的任务，没有时返回None"""
+        now = datetime.now()
+        lease_expired = now - timedelta(seconds=settings.AI_JOB_LEASE_SECONDS)
+        async with async_session() as session:
+            result = await session.execute(
+                select(AIJob)
+                .where(
+                    or_(
+                        and_(AIJob.status == JOB_PENDING, AIJob.run_after <= now),
+                        and_(AIJob.status == JOB_RUNNING, AIJob.locked_at < lease_expired)
+                    )
+                )
+                .order_by(AIJob.run_after, AIJob.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            job = result.scalar_one_or_none()
+            if job is None:
+                await session.rollback()
+                return None
+
+            if job.status == JOB_RUNNING:
+                logger.warning(f"AI回复任务租约过期，重新执行: job={job.id}, worker={job.locked_by}")
+
+            # 不支持 SKIP LOCKED 的数据库上由状态条件保证只有一个worker领取成功
+            guard = AIJob.locked_at.is_(None) if job.locked_at is None else AIJob.locked_at == job.locked_at
+            claimed = await session.execute(
+                update(AIJob)
+                .where(AIJob.id == job.id, AIJob.status == job.status, guard)
+                .values(
+                    status=JOB_RUNNING,
+                    attempts=AIJob.attempts + 1,
+                    locked_by=self._instance,
+                    locked_at=now,
+                    updated_at=now
+                )
+                .execution_options(synchronize_session=False)
+            )
+            if claimed.rowcount != 1:
+                await session.rollback()
+                return None
+            await session.commit()
+            await session.refresh(job)
+            return _ClaimedJob.from_model(job)
+
+    async def _run(self, job: _ClaimedJob) -> None:
+        # 延迟导入，避免循环依赖
+        from app.services.ai_service import ai_assistant
+        from app.services.conversation_history import conversation_history
+        from app.services.generation_registry import generation_registry
+
+        started_at = time.monotonic()
+        if job.attempts > job.max_attempts:
+            # 最后一次执行未能完成（worker退出或租约过期）
+            await self._fail(job, "AI回复任务执行中断", started_at)
+            return
+
+        session = async_session()
+        try:
+            recent = await conversation_history.get_recent(session, job.conversation_id)
+            # 上次执行已保存回答但未来得及更新任务状态时不再重复生成
+            if job.message_id is not None:
+                answered = next(
+                    (m for m in reversed(recent) if m.role == "assistant" and m.id > job.message_id),
+                    None
+                )
+                if answered is not None:
+                    await self._succeed(job, answered.to_dict(), started_at)
+                    return
+
+            try:
+                result = await generation_registry.run(
+                    ai_assistant.process_query(
+                        session,
+                        user_id=job.user_id,
+                        query_text=job.query_text,
+                        context_data={
+                            "conversation_id": job.conversation_id,
+                            "useLocalModel": job.use_local_model,
+                            "modelName": job.model_name,
+                            "useThinkMode": job.use_think_mode,
+                            "messages": [message.to_context() for message in recent]
+                        },
+                        timeout=settings.AI_JOB_TIMEOUT,
+                        raise_backend_errors=True
+                    ),
+                    user_id=job.user_id,
+                    conversation_id=job.conversation_id,
+                    source="job"
+                )
+                error = result.get("error")
+            except asyncio.TimeoutError:
+                error = f"AI响应超时（{settings.AI_JOB_TIMEOUT}秒）"
+            except ServiceOverloadedError as e:
+                error = e.error_message
+            except GenerationCancelledError as e:
+                await session.rollback()
+                await self._cancelled(job, e.reason, started_at)
+                return
+            if error:
+                await session.rollback()
+                await self._fail(job, str(error), started_at)
+            else:
+                await self._succeed(job, result, started_at)
+        finally:
+            await session.close()
+
+    async def _finish(self, job_id: int, values: Dict[str, Any]) -> None:
+        """更新本worker持有的任务，租约已被其他worker接管时不覆盖"""
+        async with async_session() as session:
+            await session.execute(
+                update(AIJob)
+                .where(AIJob.id == job_id, AIJob.status == JOB_RUNNING, AIJob.locked_by == self._instance)
+                .values(locked_by=None, locked_at=None, updated_at=datetime.now(), **values)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+
+    async def _succeed(self, job: _ClaimedJob, message: Dict[str, Any], started_at: float) -> None:
+        now = datetime.now()
+        await self._finish(job.id, {
+            "status": JOB_SUCCEEDED,
+            "result_message_id": message.get("id"),
+            "error": None,
+            "finished_at": now
+        })
+        AI_JOBS_PROCESSED.labels(status=JOB_SUCCEEDED).inc()
+        AI_JOB_DURATION.labels(status=JOB_SUCCEEDED).observe(time.monotonic() - started_at)
+        logger.info(f"AI回复任务完成: job={job.id}, attempts={job.attempts}")
+        await self._notify(job, JOB_SUCCEEDED, message=message)
+
+    async def _fail(self, job: _ClaimedJob, error: str, started_at: float) -> None:
+        now = datetime.now()
+        if job.attempts >= job.max_attempts:
+            await self._finish(job.id, {"status": JOB_FAILED, "error": error, "finished_at": now})
+            AI_JOBS_PROCESSED.labels(status=JOB_FAILED).inc()
+            AI_JOB_DURATION.labels(status=JOB_FAILED).observe(time.monotonic() - started_at)
+            logger.error(f"AI回复任务失败: job={job.id}, attempts={job.attempts}, error={error}")
+            await self._notify(job, JOB_FAILED, error=error)
+            return
+
+        delay = min(
+            settings.AI_JOB_RETRY_BASE_DELAY * 2 ** (job.attempts - 1),
+            settings.AI_JOB_RETRY_MAX_DELAY
+        )
+        run_after = now + timedelta(seconds=delay)
+        await self._finish(job.id, {"status": JOB_PENDING, "error": error, "run_after": run_after})
+        AI_JOBS_PROCESSED.labels(status="retried").inc()
+        AI_JOB_DURATION.labels(status="retried").observe(time.monotonic() - started_at)
+        logger.warning(f"AI回复任务将在{delay}秒后重试: job={job.id}, attempts={job.attempts}, error={error}")
+        await self._notify(job, JOB_PENDING, error=error, run_after=run_after)
+
+    async def _cancelled(self, job: _ClaimedJob, reason: str, started_at: float) -> None:
+        await self._finish(job.id, {"status": JOB_CANCELLED, "error": reason, "finished_at": datetime.now()})
+        AI_JOBS_PROCESSED.labels(status=JOB_CANCELLED).inc()
+        AI_JOB_DURATION.labels(status=JOB_CANCELLED).observe(time.monotonic() - started_at)
+        logger.info(f"AI回复任务已取消: job={job.id}, reason={reason}")
+        await self._notify(job, JOB_CANCELLED, reason=reason)
+
+    async def _requeue(self, job_id: int) -> None:
+        """把被中断的任务放回队列，本次执行不计入次数"""
+        async with async_session() as session:
+            await session.execute(
+                update(AIJob)
+                .where(AIJob.id == job_id, AIJob.status == JOB_RUNNING, AIJob.locked_by == self._instance)
+                .values(
+                    status=JOB_PENDING,
+                    attempts=AIJob.attempts - 1,
+                    locked_by=None,
+                    locked_at=None,
+                    run_after=datetime.now(),
+                    updated_at=datetime.now()
+                )
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+        logger.info(f"AI回复任务已放回队列: job={job_id}")
+
+    async def _notify(self, job: _ClaimedJob, status: str, **data: Any) -> None:
+        """通过AI助手WebSocket推送任务状态，用户未连接时忽略"""
+        from app.websockets.ai_assistant import ai_connection_manager
+
+        try:
+            await ai_connection_manager.send_response(job.user_id, {
+                "type": "ai_job",
+                "data": {
+                    "job_id": job.id,
+                    "status": status,
+                    "conversation_id": job.conversation_id,
+                    "attempts": job.attempts,
+                    **data
+                }
+            })
+        except Exception as e:
+            logger.error(f"推送AI回复任务状态失败: job={job.id}, {str(e)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "workers": len(self._workers),
+            "running": len(self._current)
+        }
+
+
+# 创建全局AI回复任务队列实例
+ai_job_queue = AIJobQueue()
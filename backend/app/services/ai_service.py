@@ -1,25 +1,51 @@
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, AsyncIterator, Callable, Tuple
 from datetime import datetime, timezone
 import json
 import asyncio
 import time
-import aiohttp
 from urllib.parse import urljoin
 
+import aiohttp
+
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import WebSocket
 
 from app.crud.ai_conversation import conversation as conversation_crud, message as message_crud
 from app.schemas.ai_conversation import MessageCreate, ConversationCreate
 from app.core.config import settings
+from app.core.errors import ServiceOverloadedError
 from app.core.logging import get_logger
+from app.core.monitoring import (
+    AI_TIME_TO_FIRST_TOKEN,
+    OLLAMA_PREFILL_SECONDS,
+    OLLAMA_PREFILL_SECONDS_SAVED,
+    OLLAMA_PREFILL_TOKENS_SAVED
+)
+from app.services.llm_backends import LLMBackendError, LLMRequestError, llm_backend_pool, status_error
+from app.services.llm_client import llm_client_pool
+from app.services.attachment_extractor import attachment_extractor
+from app.services.context_builder import context_builder, estimate_tokens
+from app.services.conversation_summarizer import conversation_summarizer
+from app.services.conversation_history import conversation_history
+from app.services.llm_scheduler import llm_scheduler
+from app.services.generation_stats import (
+    OUTCOME_CANCELLED,
+    OUTCOME_ERROR,
+    OUTCOME_OVERLOADED,
+    OUTCOME_TIMEOUT,
+    GenerationStats
+)
+from app.services.ollama_context import ContextReuse, ollama_context_store
+from app.services.quant_insights import quant_insights
+from app.services.query_suggestions import query_suggestions
+from app.services.response_cache import RESULT_MISS, GeneratedResponse, ResponseCacheKey, response_cache
 
 logger = get_logger(__name__)
 
 class AIAssistantService:
     def __init__(self):
         self.model = None  # 可以在这里初始化AI模型
-        self.context_window = 10  # 保持最近10次对话作为上下文
+        self._warmup_task: Optional[asyncio.Task] = None
         # --- 1. 定义你的 System Prompt ---
         self.SYSTEM_PROMPT = """
         # 指令：
@@ -63,173 +89,694 @@ class AIAssistantService:
     
     async def initialize(self):
         """初始化AI模型和必要的资源"""
-        # 在这里初始化AI模型
-        # 实际项目中可能需要加载模型、配置等
-        pass
+        # 在后台预加载Ollama模型，不阻塞应用启动
+        if settings.OLLAMA_WARMUP_ON_STARTUP:
+            self._warmup_task = asyncio.create_task(self.warmup_ollama())
+    
+    async def shutdown(self):
+        """释放初始化时创建的资源"""
+        if self._warmup_task is not None and not self._warmup_task.done():
+            self._warmup_task.cancel()
+            try:
+                await self._warmup_task
+            except asyncio.CancelledError:
+                pass
+        self._warmup_task = None
+    
+    async def warmup_ollama(self, model_name: Optional[str] = None) -> Dict[str, bool]:
+        """
+        在全部Ollama节点上加载模型并设置 keep_alive
         
-    async def call_ollama_api(self, prompt: str, model_name: str) -> str:
-        """调用Ollama API生成响应"""
-        try:
-            # 构建API请求参数
-            url = urljoin(settings.OLLAMA_BASE_URL, "/api/generate")
-            headers = {"Content-Type": "application/json"}
-            if settings.OLLAMA_API_KEY and settings.OLLAMA_API_KEY != "your-ollama-api-key-here":
-                headers["Authorization"] = f"Bearer {settings.OLLAMA_API_KEY}"
-            
-            # 提取系统提示，它已经在prepare_prompt_with_context中被包含到prompt中
-            # 但在需要时也可以使用system参数
-            payload = {
-                "model": model_name or settings.OLLAMA_MODEL_NAME,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.7,
-                    "top_p": 0.9,
-                    "max_tokens": 800
-                }
+        不带prompt的generate请求只加载模型，不生成内容。返回各节点是否加载成功。
+        """
+        model_name = model_name or settings.OLLAMA_MODEL_NAME
+        
+        async def _warmup(endpoint) -> bool:
+            url, headers, _ = self._build_ollama_request(endpoint.base_url, "", model_name, stream=False)
+            payload = {"model": model_name, "keep_alive": settings.OLLAMA_KEEP_ALIVE}
+            started_at = time.monotonic()
+            try:
+                session = llm_client_pool.get_session(url)
+                async with session.post(url, headers=headers, json=payload) as response:
+                    if response.status != 200:
+                        logger.warning(f"预加载Ollama模型失败: {endpoint.name}, 状态码: {response.status}")
+                        return False
+                    await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"预加载Ollama模型失败: {endpoint.name}, error={str(e) or e.__class__.__name__}")
+                return False
+            logger.info(f"Ollama模型已加载: {endpoint.name}, 模型: {model_name}, 耗时: {time.monotonic() - started_at:.2f}秒")
+            return True
+        
+        endpoints = llm_backend_pool.endpoints("ollama")
+        results = await asyncio.gather(*(_warmup(endpoint) for endpoint in endpoints))
+        return {endpoint.name: result for endpoint, result in zip(endpoints, results)}
+    
+
+    def _build_ollama_request(
+        self,
+        base_url: str,
+        prompt: str,
+        model_name: str,
+        stream: bool,
+        context: Optional[List[int]] = None
+    ) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+        """构建Ollama API请求的URL、请求头和请求体，context 为上一轮返回的会话上下文"""
+        url = urljoin(base_url, "/api/generate")
+        headers = {"Content-Type": "application/json"}
+        if settings.OLLAMA_API_KEY and settings.OLLAMA_API_KEY != "your-ollama-api-key-here":
+            headers["Authorization"] = f"Bearer {settings.OLLAMA_API_KEY}"
+        
+        # 提取系统提示，它已经在prepare_prompt_with_context中被包含到prompt中
+        # 但在需要时也可以使用system参数
+        payload = {
+            "model": model_name or settings.OLLAMA_MODEL_NAME,
+            "prompt": prompt,
+            "stream": stream,
+            "keep_alive": settings.OLLAMA_KEEP_ALIVE,
+            "options": {
+                "temperature": 0.7,
+                "top_p": 0.9,
+                "max_tokens": 800
             }
-            
+        }
+        
+        if context:
+            # 系统提示和对话历史已包含在context中，只发送新的问题
+            payload["context"] = context
+        elif hasattr(settings, "OLLAMA_USE_SYSTEM_PARAM") and settings.OLLAMA_USE_SYSTEM_PARAM:
             # 部分Ollama版本支持system参数，可以尝试添加
-            if hasattr(settings, "OLLAMA_USE_SYSTEM_PARAM") and settings.OLLAMA_USE_SYSTEM_PARAM:
-                payload["system"] = self.SYSTEM_PROMPT.strip()
+            payload["system"] = self.SYSTEM_PROMPT.strip()
+        
+        return url, headers, payload
+    
+    def _build_open_webui_request(self, base_url: str, prompt: str, model_name: Optional[str], stream: bool) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+        """构建Open-WebUI API请求的URL、请求头和请求体"""
+        url = urljoin(base_url, "/api/chat")
+        headers = {"Content-Type": "application/json"}
+        if settings.OPEN_WEBUI_API_KEY and settings.OPEN_WEBUI_API_KEY != "your-open-webui-api-key-here":
+            headers["Authorization"] = f"Bearer {settings.OPEN_WEBUI_API_KEY}"
+        
+        # 分离系统提示和用户消息
+        system_prompt = self.SYSTEM_PROMPT.strip()
+        
+        # Open-WebUI通常使用类似OpenAI的API格式
+        payload = {
+            "model": model_name or settings.OPEN_WEBUI_MODEL_NAME,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "control", "content": "thinking"},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.7,
+            "max_tokens": 800,
+            "stream": stream
+        }
+        
+        return url, headers, payload
+    
+    def _build_request(
+        self,
+        kind: str,
+        base_url: str,
+        prompt: str,
+        model_name: str,
+        stream: bool,
+        context: Optional[List[int]] = None
+    ) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+        if kind == "ollama":
+            return self._build_ollama_request(base_url, prompt, model_name, stream, context)
+        return self._build_open_webui_request(base_url, prompt, model_name, stream)
+    
+    @staticmethod
+    def _collect_ollama_stats(data: Dict[str, Any], stats: Optional[Dict[str, Any]]) -> None:
+        """记录Ollama最终响应中的会话上下文、预填充和输出统计"""
+        if stats is None:
+            return
+        for key in ("context", "prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration"):
+            if key in data:
+                stats[key] = data[key]
+    
+    async def _generate_once(
+        self,
+        kind: str,
+        base_url: str,
+        prompt: str,
+        model_name: str,
+        context: Optional[List[int]] = None,
+        stats: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """在单个节点上非流式生成，连接失败、超时或非200响应时抛出LLMBackendError，4xx响应抛出LLMRequestError"""
+        url, headers, payload = self._build_request(kind, base_url, prompt, model_name, stream=False, context=context)
+        logger.info(f"调用{kind} API: {url}, 模型: {model_name}")
+        
+        try:
+            session = llm_client_pool.get_session(url)
+            async with session.post(url, headers=headers, json=payload) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    logger.error(f"{kind} API错误: {response.status}, {error_text}")
+                    raise status_error(response.status)
+                
+                data = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            raise LLMBackendError(str(e) or e.__class__.__name__) from e
+        
+        if kind == "ollama":
+            self._collect_ollama_stats(data, stats)
+            # Ollama通常返回response键
+            if "response" in data:
+                return data["response"]
+            logger.warning(f"Ollama返回的数据缺少response字段: {data}")
+            return "抱歉，模型响应格式异常"
+        
+        # 解析响应，Open-WebUI通常遵循OpenAI格式
+        if stats is not None and data.get("usage"):
+            stats["usage"] = data["usage"]
+        if "choices" in data and len(data["choices"]) > 0:
+            if "message" in data["choices"][0] and "content" in data["choices"][0]["message"]:
+                return data["choices"][0]["message"]["content"]
+        
+        logger.warning(f"Open-WebUI返回的数据格式异常: {data}")
+        return "抱歉，模型响应格式异常"
+    
+    async def _stream_once(
+        self,
+        kind: str,
+        base_url: str,
+        prompt: str,
+        model_name: str,
+        context: Optional[List[int]] = None,
+        stats: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        """
+        在单个节点上流式生成，出错时抛出LLMBackendError
+        
+        Ollama流式响应为每行一个JSON对象（NDJSON），response字段为增量文本，done为true时结束。
+        Open-WebUI流式响应为OpenAI格式的SSE（"data: {...}"，以"data: [DONE]"结束），
+        增量文本位于choices[0].delta.content；兼容直接透传的Ollama格式（message.content）。
+        """
+        url, headers, payload = self._build_request(kind, base_url, prompt, model_name, stream=True, context=context)
+        logger.info(f"流式调用{kind} API: {url}, 模型: {model_name}")
+        
+        try:
+            session = llm_client_pool.get_session(url)
+            async with session.post(url, headers=headers, json=payload) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    logger.error(f"{kind} API错误: {response.status}, {error_text}")
+                    raise status_error(response.status)
+                
+                async for raw_line in response.content:
+                    line = raw_line.decode("utf-8").strip()
+                    if not line or line.startswith(":"):
+                        continue
+                    if line.startswith("data:"):
+                        line = line[len("data:"):].strip()
+                    if line == "[DONE]":
+                        break
+                    data = json.loads(line)
+                    if data.get("error"):
+                        raise LLMBackendError(str(data["error"]))
+                    if stats is not None and data.get("usage"):
+                        stats["usage"] = data["usage"]
+                    
+                    chunk = None
+                    if kind == "ollama":
+                        chunk = data.get("response")
+                    elif data.get("choices"):
+                        chunk = (data["choices"][0].get("delta") or {}).get("content")
+                    elif "message" in data:
+                        chunk = data["message"].get("content")
+                    if chunk:
+                        yield chunk
+                    if data.get("done"):
+                        if kind == "ollama":
+                            self._collect_ollama_stats(data, stats)
+                        break
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            raise LLMBackendError(str(e) or e.__class__.__name__) from e
+    
+    @staticmethod
+    def _attempt_prompt(
+        prompt: str,
+        endpoint_name: str,
+        model_name: str,
+        reuse: Optional[ContextReuse]
+    ) -> Tuple[str, Optional[List[int]]]:
+        """在持有会话上下文的节点和模型上只发送新的问题，其他节点发送完整提示"""
+        if reuse is not None and reuse.endpoint == endpoint_name and reuse.model_name == model_name:
+            return reuse.delta_prompt, reuse.tokens
+        return prompt, None
+    
+    @staticmethod
+    def _record_route_error(route_info: Optional[Dict[str, Any]], error: Optional[LLMBackendError]) -> None:
+        """所有节点都失败时记录最后一次失败的类型"""
+        if route_info is not None:
+            timed_out = error is not None and isinstance(error.__cause__, asyncio.TimeoutError)
+            route_info["error_kind"] = OUTCOME_TIMEOUT if timed_out else OUTCOME_ERROR
+    
+    async def generate(
+        self,
+        kind: str,
+        prompt: str,
+        model_name: str,
+        route_info: Optional[Dict[str, Any]] = None,
+        reuse: Optional[ContextReuse] = None
+    ) -> str:
+        """
+        按节点池路由非流式生成，节点失败时切换到下一个节点或备用模型
+        
+        route_info 不为空时写入实际使用的节点和模型，Ollama还会写入返回的 context 和预填充统计；
+        reuse 不为空时优先路由到持有会话上下文的节点。所有节点都失败时抛出LLMBackendError；
+        节点返回4xx时请求本身无效，直接抛出LLMRequestError，不熔断节点也不切换
+        """
+        last_error: Optional[LLMBackendError] = None
+        prefer = reuse.endpoint if reuse is not None else None
+        for endpoint, candidate_model in llm_backend_pool.route(kind, model_name, prefer=prefer):
+            endpoint.begin()
+            started_at = time.monotonic()
+            attempt_prompt, context = self._attempt_prompt(prompt, endpoint.name, candidate_model, reuse)
+            try:
+                text = await self._generate_once(
+                    kind, endpoint.base_url, attempt_prompt, candidate_model, context, route_info
+                )
+            except LLMRequestError as e:
+                # 请求本身无效，换节点或备用模型也会失败，不计入节点熔断
+                logger.warning(f"LLM请求无效，不切换节点: {endpoint.name}, error={str(e)}")
+                self._record_route_error(route_info, e)
+                raise
+            except LLMBackendError as e:
+                logger.warning(f"LLM节点调用失败，尝试下一个节点: {endpoint.name}, error={str(e)}")
+                endpoint.record_failure(str(e))
+                last_error = e
+                continue
+            finally:
+                endpoint.end()
             
-            logger.info(f"调用Ollama API: {url}, 模型: {model_name}")
+            endpoint.record_success(time.monotonic() - started_at)
+            if route_info is not None:
+                route_info.update(endpoint=endpoint.name, model=candidate_model, context_reused=context is not None)
+            return text
+        
+        self._record_route_error(route_info, last_error)
+        raise last_error or LLMBackendError("没有可用的模型服务节点")
+    
+    async def generate_stream(
+        self,
+        kind: str,
+        prompt: str,
+        model_name: str,
+        route_info: Optional[Dict[str, Any]] = None,
+        reuse: Optional[ContextReuse] = None
+    ) -> AsyncIterator[str]:
+        """
+        按节点池路由流式生成，route_info 和 reuse 与 generate 相同
+        
+        在输出第一段文本之前失败时切换到下一个节点或备用模型；已输出部分内容后失败只记录日志并结束。
+        所有节点都在输出前失败时抛出LLMBackendError，4xx响应与 generate 相同直接抛出LLMRequestError
+        """
+        last_error: Optional[LLMBackendError] = None
+        prefer = reuse.endpoint if reuse is not None else None
+        for endpoint, candidate_model in llm_backend_pool.route(kind, model_name, prefer=prefer):
+            endpoint.begin()
+            started_at = time.monotonic()
+            started = False
+            attempt_prompt, context = self._attempt_prompt(prompt, endpoint.name, candidate_model, reuse)
+            chunks = self._stream_once(kind, endpoint.base_url, attempt_prompt, candidate_model, context, route_info)
+            try:
+                async for chunk in chunks:
+                    if not started:
+                        started = True
+                        # 以首个token的延迟作为节点延迟
+                        endpoint.record_success(time.monotonic() - started_at)
+                        if route_info is not None:
+                            route_info.update(
+                                endpoint=endpoint.name, model=candidate_model, context_reused=context is not None
+                            )
+                    yield chunk
+            except LLMRequestError as e:
+                # 状态码在输出前检查，此时尚未输出；请求本身无效，不计入节点熔断
+                logger.warning(f"LLM请求无效，不切换节点: {endpoint.name}, error={str(e)}")
+                self._record_route_error(route_info, e)
+                raise
+            except LLMBackendError as e:
+                endpoint.record_failure(str(e))
+                if started:
+                    logger.error(f"流式生成中断: {endpoint.name}, error={str(e)}")
+                    if route_info is not None:
+                        route_info["interrupted"] = True
+                    return
+                logger.warning(f"LLM节点调用失败，尝试下一个节点: {endpoint.name}, error={str(e)}")
+                last_error = e
+                continue
+            finally:
+                await chunks.aclose()
+                endpoint.end()
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=payload) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"Ollama API错误: {response.status}, {error_text}")
-                        return f"抱歉，调用模型时出现错误: {response.status}"
-                    
-                    data = await response.json()
-                    
-                    # Ollama通常返回response键
-                    if "response" in data:
-                        return data["response"]
-                    else:
-                        logger.warning(f"Ollama返回的数据缺少response字段: {data}")
-                        return "抱歉，模型响应格式异常"
-                        
+            if not started:
+                # 节点正常结束但没有输出
+                endpoint.record_success(time.monotonic() - started_at)
+                if route_info is not None:
+                    route_info.update(endpoint=endpoint.name, model=candidate_model, context_reused=context is not None)
+            return
+        
+        self._record_route_error(route_info, last_error)
+        raise last_error or LLMBackendError("没有可用的模型服务节点")
+    
+    async def call_ollama_api(
+        self,
+        prompt: str,
+        model_name: str,
+        route_info: Optional[Dict[str, Any]] = None,
+        reuse: Optional[ContextReuse] = None
+    ) -> str:
+        """调用Ollama API生成响应"""
+        try:
+            return await self.generate("ollama", prompt, model_name, route_info, reuse)
         except Exception as e:
             logger.error(f"调用Ollama API时发生错误: {str(e)}")
             return f"抱歉，无法连接到Ollama模型服务: {str(e)}"
     
-    async def call_open_webui_api(self, prompt: str, model_name: str = None) -> str:
+    async def stream_ollama_api(
+        self,
+        prompt: str,
+        model_name: str,
+        route_info: Optional[Dict[str, Any]] = None,
+        reuse: Optional[ContextReuse] = None
+    ) -> AsyncIterator[str]:
+        """
+        流式调用Ollama API，逐段返回生成的文本
+        
+        与call_ollama_api一致，出错时返回错误提示文本；已输出部分内容后出错则只记录日志并结束。
+        """
+        chunks = self.generate_stream("ollama", prompt, model_name, route_info, reuse)
+        try:
+            async for chunk in chunks:
+                yield chunk
+        except Exception as e:
+            logger.error(f"流式调用Ollama API时发生错误: {str(e)}")
+            yield f"抱歉，无法连接到Ollama模型服务: {str(e)}"
+        finally:
+            await chunks.aclose()
+    
+    async def call_open_webui_api(self, prompt: str, model_name: str = None, route_info: Optional[Dict[str, Any]] = None) -> str:
         """调用Open-WebUI API生成响应"""
         try:
-            # 构建API请求参数
-            url = urljoin(settings.OPEN_WEBUI_BASE_URL, "/api/chat")
-            headers = {"Content-Type": "application/json"}
-            if settings.OPEN_WEBUI_API_KEY and settings.OPEN_WEBUI_API_KEY != "your-open-webui-api-key-here":
-                headers["Authorization"] = f"Bearer {settings.OPEN_WEBUI_API_KEY}"
-            
-            # 分离系统提示和用户消息
-            system_prompt = self.SYSTEM_PROMPT.strip()
-            
-            # Open-WebUI通常使用类似OpenAI的API格式
-            payload = {
-                "model": model_name or settings.OPEN_WEBUI_MODEL_NAME,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "control", "content": "thinking"},
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": 0.7,
-                "max_tokens": 800,
-                "stream": False
-            }
-            
-            logger.info(f"调用Open-WebUI API: {url}, 模型: {model_name or settings.OPEN_WEBUI_MODEL_NAME}")
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=payload) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"Open-WebUI API错误: {response.status}, {error_text}")
-                        return f"抱歉，调用模型时出现错误: {response.status}"
-                    
-                    data = await response.json()
-                    
-                    # 解析响应，Open-WebUI通常遵循OpenAI格式
-                    if "choices" in data and len(data["choices"]) > 0:
-                        if "message" in data["choices"][0] and "content" in data["choices"][0]["message"]:
-                            return data["choices"][0]["message"]["content"]
-                    
-                    logger.warning(f"Open-WebUI返回的数据格式异常: {data}")
-                    return "抱歉，模型响应格式异常"
-                    
+            return await self.generate(
+                "open_webui", prompt, model_name or settings.OPEN_WEBUI_MODEL_NAME, route_info
+            )
         except Exception as e:
             logger.error(f"调用Open-WebUI API时发生错误: {str(e)}")
             return f"抱歉，无法连接到Open-WebUI服务: {str(e)}"
     
-    async def prepare_think_mode_prompt(self, query_text: str, conversation_messages: List[Dict[str, Any]]) -> str:
-        """准备带有思考模式的提示"""
-        if not conversation_messages:
-            # 使用特定格式包装用户问题，添加思考模式指令
-            return f"""
-{self.SYSTEM_PROMPT}
-
-[来自用户的请求，请在"智学伴侣"的角色和规则内回答]
-用户问题: "{query_text}"
-[请按照以下步骤思考和回答：
-1. 思考：请先对问题进行思考分析，梳理解答思路、列出关键点和可能的解决方案。这部分是你的内部思考过程，不会直接展示给学生。
-2. 回答：然后基于你的思考，给出简洁明了、符合高中生理解水平的回答。
-请确保你的回答符合高中生学习助手的设定，严格遵守安全准则，避免任何不当内容。]
-"""
-            
-        # 构建带有对话历史的提示
-        prompt = f"{self.SYSTEM_PROMPT}\n\n以下是对话历史：\n\n"
-        
-        # 只保留最近的10条消息作为上下文
-        recent_messages = conversation_messages[-self.context_window:] if len(conversation_messages) > self.context_window else conversation_messages
+    async def stream_open_webui_api(self, prompt: str, model_name: str = None, route_info: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """
+        流式调用Open-WebUI API，逐段返回生成的文本
         
-        for msg in recent_messages:
-            role = "用户" if msg["role"] == "user" else "助手"
-            prompt += f"{role}: {msg['content']}\n\n"
-            
-        # 添加当前用户问题，使用特定格式包装，并添加思考模式指令
-        prompt += """
+        与call_open_webui_api一致，出错时返回错误提示文本；已输出部分内容后出错则只记录日志并结束。
+        """
+        chunks = self.generate_stream(
+            "open_webui", prompt, model_name or settings.OPEN_WEBUI_MODEL_NAME, route_info
+        )
+        try:
+            async for chunk in chunks:
+                yield chunk
+        except Exception as e:
+            logger.error(f"流式调用Open-WebUI API时发生错误: {str(e)}")
+            yield f"抱歉，无法连接到Open-WebUI服务: {str(e)}"
+        finally:
+            await chunks.aclose()
+    
+    # 当前问题的包装格式
+    QUERY_TEMPLATE = """
 [来自用户的请求，请在"智学伴侣"的角色和规则内回答]
-用户问题: "{0}"
-[请按照以下步骤思考和回答：
+用户问题: "{query}"
+[{instruction}]
+"""
+    THINK_MODE_INSTRUCTION = """请按照以下步骤思考和回答：
 1. 思考：请先对问题进行思考分析，梳理解答思路、列出关键点和可能的解决方案。这部分是你的内部思考过程，不会直接展示给学生。
 2. 回答：然后基于你的思考，给出简洁明了、符合高中生理解水平的回答。
-请确保你的回答符合高中生学习助手的设定，严格遵守安全准则，避免任何不当内容。]
-""".format(query_text)
-        
-        return prompt
+请确保你的回答符合高中生学习助手的设定，严格遵守安全准则，避免任何不当内容。"""
+    DEFAULT_INSTRUCTION = "请确保你的回答符合高中生学习助手的设定，严格遵守安全准则，避免任何不当内容。"
+    
+    def _build_context_prompt(
+        self,
+        query_text: str,
+        conversation_messages: List[Dict[str, Any]],
+        instruction: str,
+        conversation_id: Optional[int],
+        mode: str,
+        grounding: Optional[str] = None,
+        conversation_summary: Optional[str] = None
+    ) -> str:
+        """按token预算组装系统提示、参考数据、对话摘要、最近的对话历史和当前问题"""
+        query_block = self.QUERY_TEMPLATE.format(query=query_text, instruction=instruction)
+        built = context_builder.build(
+            system_prompt=self.SYSTEM_PROMPT,
+            query_block=query_block,
+            messages=conversation_messages or [],
+            conversation_id=conversation_id,
+            mode=mode,
+            grounding=grounding,
+            stored_summary=conversation_summary
+        )
+        return built.text
+    
+    async def prepare_think_mode_prompt(
+        self,
+        query_text: str,
+        conversation_messages: List[Dict[str, Any]],
+        conversation_id: Optional[int] = None,
+        grounding: Optional[str] = None,
+        conversation_summary: Optional[str] = None
+    ) -> str:
+        """准备带有思考模式的提示"""
+        return self._build_context_prompt(
+            query_text, conversation_messages, self.THINK_MODE_INSTRUCTION, conversation_id, "think",
+            grounding, conversation_summary
+        )
 
-    async def prepare_prompt_with_context(self, query_text: str, conversation_messages: List[Dict[str, Any]]) -> str:
+    async def prepare_prompt_with_context(
+        self,
+        query_text: str,
+        conversation_messages: List[Dict[str, Any]],
+        conversation_id: Optional[int] = None,
+        grounding: Optional[str] = None,
+        conversation_summary: Optional[str] = None
+    ) -> str:
         """准备带有上下文的提示"""
-        if not conversation_messages:
-            # 使用特定格式包装用户问题
-            return f"""
-{self.SYSTEM_PROMPT}
+        return self._build_context_prompt(
+            query_text, conversation_messages, self.DEFAULT_INSTRUCTION, conversation_id, "chat",
+            grounding, conversation_summary
+        )
 
-[来自用户的请求，请在"智学伴侣"的角色和规则内回答]
-用户问题: "{query_text}"
-[请确保你的回答符合高中生学习助手的设定，严格遵守安全准则，避免任何不当内容。]
-"""
-            
-        # 构建带有对话历史的提示
-        prompt = f"{self.SYSTEM_PROMPT}\n\n以下是对话历史：\n\n"
+    def _resolve_query_options(self, context_data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """从上下文数据中提取查询参数"""
+        # 设置默认参数
+        options = {
+            "conversation_id": None,
+            "use_local_model": True,
+            "model_name": settings.OLLAMA_MODEL_NAME,
+            "use_think_mode": True,
+            "messages": [],
+            # 学生本人的量化数据，由 _attach_context 根据当前用户检索，不从上下文数据读取
+            "grounding": None,
+            # 后台生成的会话摘要，由 _attach_context 读取
+            "conversation_summary": None
+        }
         
-        # 只保留最近的10条消息作为上下文
-        recent_messages = conversation_messages[-self.context_window:] if len(conversation_messages) > self.context_window else conversation_messages
+        # 从上下文数据中提取参数
+        if context_data:
+            options["conversation_id"] = context_data.get("conversation_id")
+            options["use_local_model"] = context_data.get("useLocalModel", True)
+            options["model_name"] = context_data.get("modelName", settings.OLLAMA_MODEL_NAME)
+            options["use_think_mode"] = context_data.get("useThinkMode", True)
+            options["messages"] = context_data.get("messages", [])
         
-        for msg in recent_messages:
-            role = "用户" if msg["role"] == "user" else "助手"
-            prompt += f"{role}: {msg['content']}\n\n"
+        return options
+    
+    def _backend_name(self, options: Dict[str, Any]) -> str:
+        """查询使用的后端名称，用于调度和指标"""
+        return "ollama" if options["use_local_model"] else "open_webui"
+    
+    def _cache_key(self, query_text: str, options: Dict[str, Any]) -> ResponseCacheKey:
+        """响应缓存键，较早的对话会折叠进提示的摘要，因此使用全部对话历史和后台生成的会话摘要"""
+        return response_cache.build_key(
+            self._backend_name(options),
+            options["model_name"],
+            "think" if options["use_think_mode"] else "chat",
+            query_text,
+            options["messages"],
+            options["grounding"],
+            options["conversation_summary"]
+        )
+    
+    @staticmethod
+    def _is_cacheable(route_info: Dict[str, Any]) -> bool:
+        """后端成功完成生成时才缓存回答，错误提示和中断的流式输出不缓存"""
+        return "endpoint" in route_info and not route_info.get("interrupted")
+    
+    def _find_context_reuse(self, query_text: str, options: Dict[str, Any]) -> Optional[ContextReuse]:
+        """本地模型的会话查询复用上一轮返回的Ollama context，只发送新的问题"""
+        if not options["use_local_model"]:
+            return None
+        instruction = self.THINK_MODE_INSTRUCTION if options["use_think_mode"] else self.DEFAULT_INSTRUCTION
+        delta_prompt = self.QUERY_TEMPLATE.format(query=query_text, instruction=instruction)
+        if options["grounding"]:
+            # 复用的context不含本轮检索的数据，随问题一起发送
+            delta_prompt = f"{options['grounding']}\n\n{delta_prompt}"
+        return ollama_context_store.find_reuse(
+            options["conversation_id"],
+            options["model_name"],
+            query_text,
+            options["messages"],
+            delta_prompt
+        )
+    
+    def _record_ollama_generation(
+        self,
+        options: Dict[str, Any],
+        prompt: str,
+        route_info: Dict[str, Any],
+        response_text: str
+    ) -> None:
+        """保存本轮返回的context供下一轮复用，并记录预填充耗时和复用节省的时间"""
+        if not options["use_local_model"] or "endpoint" not in route_info:
+            return
+        model_name = route_info.get("model", options["model_name"]) or ""
+        
+        if options["conversation_id"] and route_info.get("context") and not route_info.get("interrupted"):
+            ollama_context_store.save(
+                options["conversation_id"],
+                route_info["endpoint"],
+                model_name,
+                route_info["context"],
+                response_text
+            )
+        
+        eval_count = route_info.get("prompt_eval_count")
+        eval_duration = route_info.get("prompt_eval_duration")
+        if not eval_count or eval_duration is None:
+            return
+        prefill_seconds = eval_duration / 1e9
+        reused = bool(route_info.get("context_reused"))
+        OLLAMA_PREFILL_SECONDS.labels(
+            model=model_name, context="reused" if reused else "full"
+        ).observe(prefill_seconds)
+        if reused:
+            # 按本轮的预填充速度估算完整提示需要的预填充时间
+            tokens_saved = max(estimate_tokens(prompt) - eval_count, 0)
+            OLLAMA_PREFILL_TOKENS_SAVED.labels(model=model_name).inc(tokens_saved)
+            OLLAMA_PREFILL_SECONDS_SAVED.labels(model=model_name).inc(tokens_saved * prefill_seconds / eval_count)
+    
+    async def _attach_context(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        query_text: str,
+        options: Dict[str, Any]
+    ) -> None:
+        """
+        读取组装提示需要的数据库数据
+
+        学生询问自己的量化情况时检索相关的统计数据，只使用当前用户本人的数据；
+        会话查询读取用户上传的附件内容，和统计数据一起作为参考数据，
+        以及后台生成的会话摘要，较早的对话放不下时用它代替。
+        """
+        references = [await quant_insights.retrieve(db, user_id, query_text)]
+        if options["conversation_id"]:
+            references.append(await attachment_extractor.build_context(db, user_id, options["conversation_id"]))
+            options["conversation_summary"] = await conversation_summarizer.get_summary(
+                db, options["conversation_id"], user_id
+            )
+        options["grounding"] = "\n\n".join(reference for reference in references if reference) or None
+
+    async def _build_prompt(self, query_text: str, options: Dict[str, Any]) -> str:
+        """根据查询参数准备提示"""
+        if options["use_think_mode"]:
+            return await self.prepare_think_mode_prompt(
+                query_text, options["messages"], options["conversation_id"],
+                options["grounding"], options["conversation_summary"]
+            )
+        return await self.prepare_prompt_with_context(
+            query_text, options["messages"], options["conversation_id"],
+            options["grounding"], options["conversation_summary"]
+        )
+    
+    async def _save_response(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        options: Dict[str, Any],
+        response_text: str,
+        processing_time: float,
+        stats: Optional[GenerationStats] = None
+    ) -> Dict[str, Any]:
+        """保存助手消息（有conversation_id时）并构建响应，stats 为本次生成的统计"""
+        conversation_id = options["conversation_id"]
+        use_local_model = options["use_local_model"]
+        model_name = options["model_name"]
+        
+        # 如果有conversation_id，保存消息到数据库
+        if conversation_id:
+            # 确认会话存在
+            db_conversation = await conversation_crud.get(db, id=conversation_id)
             
-        # 添加当前用户问题，使用特定格式包装
-        prompt += """
-[来自用户的请求，请在"智学伴侣"的角色和规则内回答]
-用户问题: "{0}"
-[请确保你的回答符合高中生学习助手的设定，严格遵守安全准则，避免任何不当内容。]
-""".format(query_text)
+            if not db_conversation:
+                # 如果会话不存在，创建新会话
+                conversation_in = ConversationCreate(title="新会话")
+                db_conversation = await conversation_crud.create_conversation(
+                    db, obj_in=conversation_in, user_id=user_id
+                )
+                conversation_id = db_conversation.id
+            
+            # 创建助手消息
+            assistant_message = MessageCreate(
+                role="assistant",
+                content=response_text,
+                useLocalModel=use_local_model,
+                modelName=model_name,
+                processingTime=processing_time,
+                **(stats.to_message_fields() if stats is not None else {})
+            )
+            
+            # 保存到数据库
+            db_message = await message_crud.create_message(
+                db, conversation_id=conversation_id, obj_in=assistant_message
+            )
+            conversation_history.on_created(db_message)
+            
+            # 更新会话的更新时间
+            await conversation_crud.touch_conversation(db, conversation_id=conversation_id)
+            
+            # 构建响应 - 确保包含前端期望的字段格式
+            return {
+                "id": db_message.id,
+                "role": db_message.role,
+                "content": db_message.content,
+                "response": db_message.content,  # 添加response字段与content内容相同
+                "conversation_id": db_message.conversation_id,
+                "timestamp": db_message.created_at,
+                "processing_time": db_message.processing_time,
+                "query_id": str(db_message.id),  # 添加query_id字段
+                "use_local_model": db_message.use_local_model,
+                "model_name": db_message.model_name,
+                "details": {}  # 添加空的details字段
+            }
         
-        return prompt
+        # 无conversation_id的情况，直接返回文本响应
+        return {
+            "role": "assistant",
+            "content": response_text,
+            "response": response_text,  # 添加response字段与content内容相同
+            "processing_time": processing_time,
+            "query_id": "",  # 添加query_id字段
+            "use_local_model": use_local_model,
+            "model_name": model_name,
+            "timestamp": datetime.now(timezone.utc),
+            "details": {}  # 添加空的details字段
+        }
 
     async def process_query(
         self,
@@ -237,7 +784,9 @@ class AIAssistantService:
         user_id: int,
         query_text: str,
         context_data: Optional[Dict[str, Any]] = None,
-        timeout: Optional[int] = None
+        timeout: Optional[int] = None,
+        on_queue_position: Optional[Callable[[int], None]] = None,
+        raise_backend_errors: bool = False
     ) -> Dict[str, Any]:
         """处理AI查询
         
@@ -246,16 +795,21 @@ class AIAssistantService:
             user_id: 用户ID
             query_text: 查询文本
             context_data: 可选的上下文数据
-            timeout: 可选的超时时间（秒）
+            timeout: 可选的超时时间（秒），包含排队时间
+            on_queue_position: 可选的排队位置回调，需要排队时调用
+            raise_backend_errors: 为True时所有节点都不可用不再保存错误提示作为回答，
+                而是返回包含error的字典，供后台任务重试
         
         Returns:
             包含AI响应的字典
         
         Raises:
             asyncio.TimeoutError: 当处理超过设定的超时时间
+            ServiceOverloadedError: 后端繁忙，排队时间超过上限
         """
         # 开始计时
         start_time = time.time()
+        stats: Optional[GenerationStats] = None
         
         try:
             # 验证输入
@@ -270,97 +824,69 @@ class AIAssistantService:
             
             # 实际处理逻辑包装在一个内部异步函数中，以便应用超时
             async def _process_query_with_timeout():
-                # 设置默认参数
-                conversation_id = None
-                use_local_model = True
-                model_name = settings.OLLAMA_MODEL_NAME
-                use_think_mode = True
-                messages = []
-                
-                # 从上下文数据中提取参数
-                if context_data:
-                    conversation_id = context_data.get("conversation_id")
-                    use_local_model = context_data.get("useLocalModel", True)
-                    model_name = context_data.get("modelName", settings.OLLAMA_MODEL_NAME)
-                    use_think_mode = context_data.get("useThinkMode", True)
-                    messages = context_data.get("messages", [])
-                
-                # 生成模型响应
-                model_start_time = time.time()
+                nonlocal stats
+                options = self._resolve_query_options(context_data)
+                backend = self._backend_name(options)
+                stats = GenerationStats(backend, options["model_name"] or "")
+                await self._attach_context(db, user_id, query_text, options)
                 
                 # 准备提示
-                if use_think_mode:
-                    prompt = await self.prepare_think_mode_prompt(query_text, messages)
-                else:
-                    prompt = await self.prepare_prompt_with_context(query_text, messages)
+                prompt = await self._build_prompt(query_text, options)
+                reuse = self._find_context_reuse(query_text, options)
                 
-                # 调用本地或远程模型
-                if use_local_model:
-                    response_text = await self.call_ollama_api(prompt, model_name)
-                else:
-                    response_text = await self.call_open_webui_api(prompt, model_name)
-                
-                # 计算处理时间
-                model_end_time = time.time()
-                processing_time = model_end_time - model_start_time
-                
-                # 如果有conversation_id，保存消息到数据库
-                if conversation_id:
-                    # 确认会话存在
-                    db_conversation = await conversation_crud.get(db, id=conversation_id)
+                async def _generate() -> GeneratedResponse:
+                    stats.started = True
+                    queue_start_time = time.time()
+                    # 在调度器分配的槽位内调用本地或远程模型
+                    async with llm_scheduler.slot(backend, user_id, on_position=on_queue_position):
+                        # 生成模型响应
+                        model_start_time = time.time()
+                        stats.queue_time = model_start_time - queue_start_time
+                        
+                        route_info: Dict[str, Any] = {}
+                        if options["use_local_model"]:
+                            response_text = await self.call_ollama_api(
+                                prompt, options["model_name"], route_info, reuse
+                            )
+                        else:
+                            response_text = await self.call_open_webui_api(prompt, options["model_name"], route_info)
+                        
+                        # 计算处理时间
+                        model_end_time = time.time()
+                        generation_time = model_end_time - model_start_time
                     
-                    if not db_conversation:
-                        # 如果会话不存在，创建新会话
-                        conversation_in = ConversationCreate(title="新会话")
-                        db_conversation = await conversation_crud.create_conversation(
-                            db, obj_in=conversation_in, user_id=user_id
-                        )
-                        conversation_id = db_conversation.id
+                    stats.complete(route_info, prompt, response_text, generation_time)
+                    if raise_backend_errors and "endpoint" not in route_info:
+                        raise LLMBackendError(response_text)
                     
-                    # 创建助手消息
-                    assistant_message = MessageCreate(
-                        role="assistant",
-                        content=response_text,
-                        useLocalModel=use_local_model,
-                        modelName=model_name,
-                        processingTime=processing_time
-                    )
+                    # 非流式调用在生成完成后才返回首个token
+                    AI_TIME_TO_FIRST_TOKEN.labels(
+                        backend=backend,
+                        model=options["model_name"] or "",
+                        mode="blocking"
+                    ).observe(generation_time)
+                    self._record_ollama_generation(options, prompt, route_info, response_text)
                     
-                    # 保存到数据库
-                    db_message = await message_crud.create_message(
-                        db, conversation_id=conversation_id, obj_in=assistant_message
+                    # 切换到备用模型时记录实际使用的模型
+                    return GeneratedResponse(
+                        text=response_text,
+                        model_name=route_info.get("model", options["model_name"]),
+                        generation_time=generation_time,
+                        cacheable=self._is_cacheable(route_info)
                     )
-                    
-                    # 更新会话的更新时间
-                    await conversation_crud.touch_conversation(db, conversation_id=conversation_id)
-                    
-                    # 构建响应 - 确保包含前端期望的字段格式
-                    return {
-                        "id": db_message.id,
-                        "role": db_message.role,
-                        "content": db_message.content,
-                        "response": db_message.content,  # 添加response字段与content内容相同
-                        "conversation_id": db_message.conversation_id,
-                        "timestamp": db_message.created_at,
-                        "processing_time": db_message.processing_time,
-                        "query_id": str(db_message.id),  # 添加query_id字段
-                        "use_local_model": db_message.use_local_model,
-                        "model_name": db_message.model_name,
-                        "details": {}  # 添加空的details字段
-                    }
-                else:
-                    # 无conversation_id的情况，直接返回文本响应
-                    return {
-                        "role": "assistant",
-                        "content": response_text,
-                        "response": response_text,  # 添加response字段与content内容相同
-                        "processing_time": processing_time,
-                        "query_id": "",  # 添加query_id字段
-                        "use_local_model": use_local_model,
-                        "model_name": model_name,
-                        "timestamp": datetime.now(timezone.utc),
-                        "details": {}  # 添加空的details字段
-                    }
+                
+                # 相同问题命中缓存或等待进行中的生成，否则生成并写入缓存
+                result = await response_cache.get_or_generate(
+                    self._cache_key(query_text, options), backend, _generate
+                )
+                options["model_name"] = result.response.model_name
+                processing_time = time.time() - start_time if result.source != RESULT_MISS else result.response.generation_time
+                
+                # 命中缓存的回答没有本次生成的统计
+                return await self._save_response(
+                    db, user_id, options, result.response.text, processing_time,
+                    stats if result.source == RESULT_MISS else None
+                )
                 
             # 应用超时处理
             if timeout:
@@ -373,9 +899,22 @@ class AIAssistantService:
         except asyncio.TimeoutError:
             # 超时异常，需要向上传播
             logger.warning(f"处理AI查询超时 (timeout={timeout}秒)")
+            if stats is not None:
+                stats.fail(OUTCOME_TIMEOUT)
+            raise
+        except ServiceOverloadedError:
+            # 后端繁忙被拒绝，需要向上传播
+            if stats is not None:
+                stats.fail(OUTCOME_OVERLOADED)
+            raise
+        except asyncio.CancelledError:
+            if stats is not None:
+                stats.fail(OUTCOME_CANCELLED)
             raise
         except Exception as e:
             # 记录其他异常
+            if stats is not None:
+                stats.fail(OUTCOME_ERROR)
             end_time = time.time()
             processing_time = end_time - start_time
             logger.error(f"处理AI查询出错: {str(e)}")
@@ -389,20 +928,192 @@ class AIAssistantService:
                 "details": {}
             }
     
+    async def process_query_stream(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        query_text: str,
+        context_data: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """流式处理AI查询
+        
+        Args:
+            db: 数据库会话
+            user_id: 用户ID
+            query_text: 查询文本
+            context_data: 可选的上下文数据，参数与process_query一致
+        
+        Yields:
+            {"type": "queue", "data": {"position": 排队位置}}，需要排队时在位置变化时返回；
+            {"type": "token", "data": {"content": 增量文本}}，生成过程中逐段返回；
+            {"type": "response", "data": 与process_query返回值相同的字典}，生成完成后返回一次，
+            助手消息只在此时保存到数据库。调用方提前停止迭代时不会保存消息。
+            命中响应缓存或等待相同问题的进行中生成时，完整回答作为一个token返回。
+        """
+        start_time = time.time()
+        
+        # 验证输入
+        if not query_text or not query_text.strip():
+            yield {
+                "type": "response",
+                "data": {
+                    "error": "查询内容不能为空",
+                    "response": "请提供有效的查询内容",
+                    "query_id": "",
+                    "processing_time": 0,
+                    "details": {}
+                }
+            }
+            return
+        
+        cache_key: Optional[ResponseCacheKey] = None
+        stats: Optional[GenerationStats] = None
+        try:
+            options = self._resolve_query_options(context_data)
+            backend = self._backend_name(options)
+            await self._attach_context(db, user_id, query_text, options)
+            
+            # 相同问题命中缓存或等待进行中的生成
+            cached = await response_cache.acquire(self._cache_key(query_text, options), backend)
+            if cached is not None:
+                options["model_name"] = cached.response.model_name
+                yield {"type": "token", "data": {"content": cached.response.text}}
+                result = await self._save_response(
+                    db, user_id, options, cached.response.text, time.time() - start_time
+                )
+                yield {"type": "response", "data": result}
+                return
+            # 本请求负责生成，结束时必须调用 finish 或 abandon
+            cache_key = self._cache_key(query_text, options)
+            stats = GenerationStats(backend, options["model_name"] or "", started=True)
+            
+            prompt = await self._build_prompt(query_text, options)
+            
+            # 排队等待生成槽位，期间返回排队位置
+            queue_start_time = time.time()
+            positions: asyncio.Queue = asyncio.Queue()
+            acquire_task = asyncio.ensure_future(
+                llm_scheduler.acquire(backend, user_id, on_position=positions.put_nowait)
+            )
+            try:
+                while not acquire_task.done():
+                    position_task = asyncio.ensure_future(positions.get())
+                    done, _ = await asyncio.wait(
+                        {acquire_task, position_task}, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    if position_task in done:
+                        yield {"type": "queue", "data": {"position": position_task.result()}}
+                    else:
+                        position_task.cancel()
+                acquire_task.result()
+            except BaseException:
+                if not acquire_task.done():
+                    acquire_task.cancel()
+                elif not acquire_task.cancelled() and acquire_task.exception() is None:
+                    # 已获得槽位但调用方停止了迭代，归还槽位
+                    llm_scheduler.release(backend)
+                raise
+            
+            route_info: Dict[str, Any] = {}
+            if options["use_local_model"]:
+                chunks_stream = self.stream_ollama_api(
+                    prompt, options["model_name"], route_info, self._find_context_reuse(query_text, options)
+                )
+            else:
+                chunks_stream = self.stream_open_webui_api(prompt, options["model_name"], route_info)
+            
+            model_start_time = time.time()
+            stats.queue_time = model_start_time - queue_start_time
+            chunks: List[str] = []
+            completed = False
+            try:
+                async for chunk in chunks_stream:
+                    if not chunks:
+                        stats.time_to_first_token = time.time() - model_start_time
+                        AI_TIME_TO_FIRST_TOKEN.labels(
+                            backend=backend,
+                            model=options["model_name"] or "",
+                            mode="stream"
+                        ).observe(stats.time_to_first_token)
+                    chunks.append(chunk)
+                    yield {"type": "token", "data": {"content": chunk}}
+                completed = True
+            finally:
+                # 调用方提前停止迭代或生成被取消时关闭上游连接，停止生成；未完成的生成不计入平均耗时
+                await chunks_stream.aclose()
+                llm_scheduler.release(backend, time.time() - model_start_time if completed else None)
+            
+            processing_time = time.time() - model_start_time
+            # 切换到备用模型时记录实际使用的模型
+            options["model_name"] = route_info.get("model", options["model_name"])
+            response_text = "".join(chunks)
+            stats.complete(route_info, prompt, response_text, processing_time)
+            self._record_ollama_generation(options, prompt, route_info, response_text)
+            response_cache.finish(cache_key, GeneratedResponse(
+                text=response_text,
+                model_name=options["model_name"],
+                generation_time=processing_time,
+                cacheable=self._is_cacheable(route_info)
+            ))
+            result = await self._save_response(db, user_id, options, response_text, processing_time, stats)
+            yield {"type": "response", "data": result}
+        
+        except ServiceOverloadedError as e:
+            if cache_key is not None:
+                response_cache.abandon(cache_key, e)
+            if stats is not None:
+                stats.fail(OUTCOME_OVERLOADED)
+            yield {
+                "type": "response",
+                "data": {
+                    "error": e.error_message,
+                    "code": e.code,
+                    "response": e.error_message,
+                    "processing_time": time.time() - start_time,
+                    "query_id": "",
+                    "details": e.details or {}
+                }
+            }
+        except Exception as e:
+            if cache_key is not None:
+                response_cache.abandon(cache_key, e)
+            if stats is not None:
+                stats.fail(OUTCOME_ERROR)
+            processing_time = time.time() - start_time
+            logger.error(f"流式处理AI查询出错: {str(e)}")
+            yield {
+                "type": "response",
+                "data": {
+                    "error": str(e),
+                    "response": f"处理查询时出错: {str(e)}",
+                    "processing_time": processing_time,
+                    "query_id": "",
+                    "details": {}
+                }
+            }
+        finally:
+            # 调用方提前停止迭代时，等待相同问题的请求各自重新生成
+            if cache_key is not None:
+                response_cache.abandon(cache_key)
+            # 生成已完成或出错时已记录，此时只剩被取消的情况
+            if stats is not None:
+                stats.fail(OUTCOME_CANCELLED)
+    
+    def forget_conversation(self, conversation_id: int) -> None:
+        """会话删除后清理按会话缓存的数据"""
+        context_builder.forget(conversation_id)
+        ollama_context_store.forget(conversation_id)
+        conversation_history.forget(conversation_id)
+        conversation_summarizer.forget(conversation_id)
+    
     async def get_suggestions(
         self,
         db: AsyncSession,
         user_id: int,
         prefix: str
     ) -> List[str]:
-        """获取查询建议"""
-        # 在实际项目中，这里可以基于用户历史查询和当前输入提供建议
-        # 示例实现
-        return [
-            f"{prefix} 的建议1",
-            f"{prefix} 的建议2",
-            f"{prefix} 的建议3"
-        ]
+        """获取查询建议，从内存中的前缀索引查找用户问过的问题和热门问题，不访问数据库"""
+        return query_suggestions.suggest(user_id, prefix)
 
 # 创建全局AI助手服务实例
 ai_assistant = AIAssistantService()
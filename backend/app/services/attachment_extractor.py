@@ -0,0 +1,199 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+import asyncio
+import multiprocessing
+import time
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.monitoring import AI_ATTACHMENT_EXTRACTION_SECONDS, AI_ATTACHMENT_EXTRACTIONS
+from app.crud import uploads as crud_uploads
+from app.services.context_builder import estimate_tokens, truncate_to_tokens
+from app.utils.text_extraction import KIND_ERROR, KIND_IMAGE, KIND_TEXT, KIND_UNSUPPORTED, extract_cached
+
+logger = get_logger(__name__)
+
+_HEADER = "以下是用户在本对话中上传的附件内容（最新的在前），回答时可以参考："
+
+
+class AttachmentExtractor:
+    """
+    AI助手附件的文本提取
+
+    PDF、DOCX、XLSX、CSV和纯文本文件提取文本，图片只读取格式和尺寸。
+    解析在进程池中执行，不阻塞事件循环，也不受GIL限制；子进程按文件内容的SHA-256
+    把结果缓存在 AI_ATTACHMENT_CACHE_DIR，内容相同的文件（包括重复上传）只解析一次，重启后仍然有效。
+    进程内再按文件路径缓存最近的结果，上传文件不会原地修改，路径相同即内容相同。
+
+    上传后调用 prefetch 在后台提前提取，组装提示时 build_context 等待同一次提取，
+    按 AI_ATTACHMENT_MAX_TOKENS 把最近的附件内容放入提示。
+    """
+
+    def __init__(self):
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # file_path -> 提取结果
+        self._results: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # 进行中的提取，同一文件同时只提取一次
+        self._inflight: Dict[str, "asyncio.Future[Optional[Dict[str, Any]]]"] = {}
+        self._prefetch_tasks: Set[asyncio.Task] = set()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # 使用spawn启动子进程，避免fork复制事件循环、数据库连接和线程状态
+            self._pool = ProcessPoolExecutor(
+                max_workers=settings.AI_ATTACHMENT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    def _reset_pool(self) -> None:
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _remember(self, file_path: str, result: Dict[str, Any]) -> None:
+        self._results[file_path] = result
+        self._results.move_to_end(file_path)
+        while len(self._results) > settings.AI_ATTACHMENT_MEMORY_CACHE_SIZE:
+            self._results.popitem(last=False)
+
+    async def _run(self, file_path: str, file_type: str) -> Optional[Dict[str, Any]]:
+        task = partial(
+            extract_cached,
+            str(Path(settings.UPLOADS_DIR) / file_path),
+            file_type,
+            settings.AI_ATTACHMENT_CACHE_DIR,
+            settings.AI_ATTACHMENT_MAX_CHARS,
+            settings.AI_ATTACHMENT_MAX_PAGES,
+            settings.AI_ATTACHMENT_MAX_ROWS
+        )
+        started_at = time.monotonic()
+        loop = asyncio.get_running_loop()
+        try:
+            result = await asyncio.wait_for(
+                loop.run_in_executor(self._get_pool(), task), timeout=settings.AI_ATTACHMENT_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            # 子进程无法中断，超时的解析会继续占用一个进程直到完成
+            AI_ATTACHMENT_EXTRACTIONS.labels(result="timeout").inc()
+            logger.warning(f"附件文本提取超时: {file_path}")
+            return None
+        except BrokenProcessPool:
+            AI_ATTACHMENT_EXTRACTIONS.labels(result="error").inc()
+            logger.error(f"附件文本提取进程异常退出，重建进程池: {file_path}")
+            self._reset_pool()
+            return None
+        except FileNotFoundError:
+            AI_ATTACHMENT_EXTRACTIONS.labels(result="error").inc()
+            logger.warning(f"附件文件不存在: {file_path}")
+            return None
+        finally:
+            AI_ATTACHMENT_EXTRACTION_SECONDS.observe(time.monotonic() - started_at)
+
+        if result["kind"] == KIND_ERROR:
+            # 出错的结果不写入磁盘缓存，但在进程内记住，避免每次组装提示都重新解析
+            AI_ATTACHMENT_EXTRACTIONS.labels(result="error").inc()
+            logger.warning(f"附件文本提取失败: {file_path}, error={result['meta'].get('error')}")
+        elif result["kind"] == KIND_UNSUPPORTED:
+            AI_ATTACHMENT_EXTRACTIONS.labels(result="unsupported").inc()
+        else:
+            AI_ATTACHMENT_EXTRACTIONS.labels(result="disk_hit" if result["cached"] else "extracted").inc()
+        self._remember(file_path, result)
+        return result
+
+    async def extract(self, file_path: str, file_type: str) -> Optional[Dict[str, Any]]:
+        """
+        提取上传文件（相对上传目录的路径）的内容
+
+        返回 {"kind", "text", "truncated", "meta", "sha256", "cached"}，文件不存在、超时或进程异常时返回None
+        """
+        cached = self._results.get(file_path)
+        if cached is not None:
+            self._results.move_to_end(file_path)
+            AI_ATTACHMENT_EXTRACTIONS.labels(result="memory_hit").inc()
+            return cached
+
+        future = self._inflight.get(file_path)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[file_path] = future
+        result = None
+        try:
+            result = await self._run(file_path, file_type)
+        except Exception as e:
+            logger.error(f"附件文本提取出错: {file_path}, error={e}")
+        finally:
+            # 本次提取被取消时，等待同一文件的其他请求得到None
+            self._inflight.pop(file_path, None)
+            future.set_result(result)
+        return result
+
+    def prefetch(self, attachments: Iterable[Tuple[str, str]]) -> None:
+        """在后台提前提取刚上传的附件，参数为 (file_path, file_type)"""
+        if not settings.AI_ATTACHMENT_ENABLED:
+            return
+        for file_path, file_type in attachments:
+            task = asyncio.create_task(self.extract(file_path, file_type))
+            self._prefetch_tasks.add(task)
+            task.add_done_callback(self._prefetch_tasks.discard)
+
+    @staticmethod
+    def _render(filename: str, result: Dict[str, Any], max_tokens: int) -> str:
+        if result["kind"] == KIND_IMAGE:
+            meta = result["meta"]
+            if meta.get("width"):
+                return f"[图片: {filename}] {meta['format']} {meta['width']}x{meta['height']}，无法查看图片内容"
+            return f"[图片: {filename}] 无法查看图片内容"
+        if result["kind"] != KIND_TEXT or not result["text"]:
+            return f"[文件: {filename}] 无法读取该文件的内容"
+        header = f"[文件: {filename}]"
+        text = truncate_to_tokens(result["text"], max(max_tokens - estimate_tokens(header), 0))
+        if result["truncated"] and not text.endswith("……"):
+            text += "……"
+        return f"{header}\n{text}"
+
+    async def build_context(self, db: AsyncSession, user_id: int, conversation_id: int) -> Optional[str]:
+        """
+        组装对话中最近附件的内容，总长度不超过 AI_ATTACHMENT_MAX_TOKENS
+
+        只读取当前用户本人上传的附件；预算在附件之间平分，较短的附件剩余的预算留给后面的附件。
+        """
+        if not settings.AI_ATTACHMENT_ENABLED:
+            return None
+        uploads = await crud_uploads.get_conversation_attachments(
+            db, conversation_id=conversation_id, uploader_id=user_id, limit=settings.AI_ATTACHMENT_MAX_FILES
+        )
+        if not uploads:
+            return None
+        results = await asyncio.gather(*(self.extract(upload.file_path, upload.file_type) for upload in uploads))
+
+        remaining = settings.AI_ATTACHMENT_MAX_TOKENS - estimate_tokens(_HEADER)
+        blocks: List[str] = []
+        available = [(upload, result) for upload, result in zip(uploads, results) if result is not None]
+        for index, (upload, result) in enumerate(available):
+            share = remaining // (len(available) - index)
+            block = self._render(upload.original_filename, result, share)
+            blocks.append(block)
+            remaining -= estimate_tokens(block)
+        if not blocks:
+            return None
+        return "\n\n".join([_HEADER] + blocks)
+
+    async def shutdown(self) -> None:
+        """关闭进程池，应用退出时调用"""
+        for task in list(self._prefetch_tasks):
+            task.cancel()
+        await asyncio.gather(*self._prefetch_tasks, return_exceptions=True)
+        self._reset_pool()
+
+
+# 创建全局附件文本提取实例
+attachment_extractor = AttachmentExtractor()
@@ -0,0 +1,228 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+import hashlib
+import re
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.monitoring import AI_PROMPT_TOKENS
+
+logger = get_logger(__name__)
+
+# 中日韩文字及全角符号，分词器通常按字切分，每个字约一个token
+_WIDE_CHAR = re.compile(r"[^\x00-\x7f]")
+# 其他文本平均约4个字符一个token
+_ASCII_CHARS_PER_TOKEN = 4
+
+_ROLE_NAMES = {"user": "用户", "assistant": "助手"}
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的token数，不依赖具体模型的分词器"""
+    if not text:
+        return 0
+    wide = len(_WIDE_CHAR.findall(text))
+    return wide + (len(text) - wide + _ASCII_CHARS_PER_TOKEN - 1) // _ASCII_CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text: str, max_tokens: int, marker: str = "……") -> str:
+    """按估算的token数截断文本，保留开头部分"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    budget = max(max_tokens - estimate_tokens(marker), 0) * _ASCII_CHARS_PER_TOKEN
+    used = 0
+    for index, char in enumerate(text):
+        used += _ASCII_CHARS_PER_TOKEN if _WIDE_CHAR.match(char) else 1
+        if used > budget:
+            return text[:index] + marker
+    return text
+
+
+def _role_name(message: Dict[str, Any]) -> str:
+    return _ROLE_NAMES.get(message.get("role"), "助手")
+
+
+def _fingerprint(message: Dict[str, Any]) -> str:
+    raw = f"{message.get('role')}\x00{message.get('content', '')}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class _ConversationSummary:
+    """单个会话已折叠进摘要的历史消息"""
+    lines: List[str] = field(default_factory=list)
+    fingerprints: List[str] = field(default_factory=list)
+    omitted: bool = False
+
+    @property
+    def last_fingerprint(self) -> Optional[str]:
+        return self.fingerprints[-1] if self.fingerprints else None
+
+
+@dataclass
+class BuiltPrompt:
+    text: str
+    tokens: int
+    history_messages: int
+    summarized_messages: int
+
+
+class ContextBuilder:
+    """
+    按token预算组装提示
+
+    从最新的消息开始向前放入对话历史，直到达到 AI_CONTEXT_MAX_TOKENS 预算或 AI_CONTEXT_MAX_MESSAGES 条；
+    放不下的较早消息按会话折叠成摘要，每条消息保留开头 AI_CONTEXT_SUMMARY_LINE_CHARS 个字符，
+    摘要总长度不超过 AI_CONTEXT_SUMMARY_MAX_TOKENS，超出时丢弃最早的摘要行。
+    摘要按会话缓存并增量更新：已折叠的消息不会再次回到历史中，新折叠的消息只追加到摘要末尾，
+    使同一会话的提示前缀保持稳定。
+    会话已有后台生成的摘要时直接使用该摘要，不再逐条摘录。
+    """
+
+    def __init__(self):
+        self._summaries: "OrderedDict[Any, _ConversationSummary]" = OrderedDict()
+
+    def _get_summary(self, conversation_id: Any) -> _ConversationSummary:
+        summary = self._summaries.get(conversation_id)
+        if summary is None:
+            summary = _ConversationSummary()
+            self._summaries[conversation_id] = summary
+            while len(self._summaries) > settings.AI_CONTEXT_SUMMARY_CACHE_SIZE:
+                self._summaries.popitem(last=False)
+        else:
+            self._summaries.move_to_end(conversation_id)
+        return summary
+
+    def _pack(self, messages: List[Dict[str, Any]], budget: int) -> int:
+        """返回能放入预算的最早消息下标，最新的消息超出预算时截断放入"""
+        start = len(messages)
+        used = 0
+        for index in range(len(messages) - 1, max(len(messages) - settings.AI_CONTEXT_MAX_MESSAGES, 0) - 1, -1):
+            cost = estimate_tokens(self._format_message(messages[index]))
+            if used + cost > budget and start < len(messages):
+                break
+            used += cost
+            start = index
+        return start
+
+    @staticmethod
+    def _format_message(message: Dict[str, Any]) -> str:
+        return f"{_role_name(message)}: {message.get('content', '')}"
+
+    def _fold(self, summary: _ConversationSummary, messages: List[Dict[str, Any]]) -> None:
+        """把尚未折叠的消息追加到摘要"""
+        known = set(summary.fingerprints)
+        for message in messages:
+            fingerprint = _fingerprint(message)
+            if fingerprint in known:
+                continue
+            content = " ".join(str(message.get("content", "")).split())
+            excerpt = content[:settings.AI_CONTEXT_SUMMARY_LINE_CHARS]
+            if len(content) > len(excerpt):
+                excerpt += "……"
+            summary.lines.append(f"{_role_name(message)}: {excerpt}")
+            summary.fingerprints.append(fingerprint)
+            known.add(fingerprint)
+
+        # 摘要超出预算时丢弃最早的行
+        while summary.lines and estimate_tokens("\n".join(summary.lines)) > settings.AI_CONTEXT_SUMMARY_MAX_TOKENS:
+            summary.lines.pop(0)
+            summary.omitted = True
+        # 指纹只需覆盖可能仍在消息列表中的范围
+        del summary.fingerprints[:-settings.AI_CONTEXT_MAX_MESSAGES * 4]
+
+    def _split_index(self, summary: _ConversationSummary, messages: List[Dict[str, Any]], start: int) -> int:
+        """已折叠的消息不再回到历史中，保持提示前缀稳定"""
+        last = summary.last_fingerprint
+        if last is None:
+            return start
+        for index in range(len(messages) - 1, -1, -1):
+            if _fingerprint(messages[index]) == last:
+                return max(start, index + 1)
+        return start
+
+    @staticmethod
+    def _render_summary(summary: _ConversationSummary) -> str:
+        parts = ["以下是更早对话的摘要："]
+        if summary.omitted:
+            parts.append("（更早的对话已省略）")
+        parts.extend(summary.lines)
+        return "\n".join(parts)
+
+    def build(
+        self,
+        *,
+        system_prompt: str,
+        query_block: str,
+        messages: List[Dict[str, Any]],
+        conversation_id: Any = None,
+        mode: str = "chat",
+        grounding: Optional[str] = None,
+        stored_summary: Optional[str] = None
+    ) -> BuiltPrompt:
+        """
+        组装提示：系统提示、参考数据、较早对话的摘要、最近的对话历史和当前问题
+
+        conversation_id 为空时不缓存摘要，放不下的较早消息直接丢弃。
+        grounding 为检索到的参考数据（如学生本人的量化统计），计入固定部分的预算。
+        stored_summary 为后台生成的会话摘要，历史放不下时代替逐条摘录的较早消息。
+        """
+        fixed_tokens = estimate_tokens(system_prompt) + estimate_tokens(query_block)
+        if grounding:
+            fixed_tokens += estimate_tokens(grounding)
+        budget = max(settings.AI_CONTEXT_MAX_TOKENS - fixed_tokens, 0)
+
+        start = self._pack(messages, budget)
+        summary: Optional[_ConversationSummary] = None
+        summary_text: Optional[str] = None
+        if stored_summary and (start > 0 or len(messages) >= settings.AI_CONTEXT_MAX_MESSAGES):
+            # 前端只发送最近的消息，条数达到上限时同样说明有更早的对话
+            summary_text = "以下是更早对话的摘要：\n" + truncate_to_tokens(
+                stored_summary, settings.AI_CONTEXT_SUMMARY_MAX_TOKENS
+            )
+            start = self._pack(messages, max(budget - estimate_tokens(summary_text), 0))
+        elif conversation_id is not None:
+            summary = self._get_summary(conversation_id)
+            if start > 0 or summary.lines:
+                # 为摘要预留预算后重新放入历史
+                start = self._pack(messages, max(budget - settings.AI_CONTEXT_SUMMARY_MAX_TOKENS, 0))
+                start = self._split_index(summary, messages, start)
+                self._fold(summary, messages[:start])
+                if summary.lines:
+                    summary_text = self._render_summary(summary)
+
+        history = messages[start:]
+        remaining = budget - (estimate_tokens(summary_text) if summary_text else 0)
+        history_lines = [self._format_message(message) for message in history]
+        if history_lines and estimate_tokens("\n\n".join(history_lines)) > remaining:
+            # 只剩最新一条且超出预算时截断
+            history_lines[-1] = truncate_to_tokens(history_lines[-1], max(remaining, 0))
+
+        parts = [system_prompt]
+        if grounding:
+            parts.append(grounding)
+        if summary_text:
+            parts.append(summary_text)
+        if history_lines:
+            parts.append("以下是对话历史：")
+            parts.extend(history_lines)
+        parts.append(query_block)
+        text = "\n\n".join(parts)
+
+        tokens = estimate_tokens(text)
+        AI_PROMPT_TOKENS.labels(mode=mode).observe(tokens)
+        return BuiltPrompt(
+            text=text,
+            tokens=tokens,
+            history_messages=len(history),
+            summarized_messages=start
+        )
+
+    def forget(self, conversation_id: Any) -> None:
+        """会话删除或清空后丢弃缓存的摘要"""
+        self._summaries.pop(conversation_id, None)
+
+
+# 创建全局提示组装器实例
+context_builder = ContextBuilder()
@@ -0,0 +1,193 @@
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+import time
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.models.ai_conversation import AIMessage
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class HistoryMessage:
+    """缓存的消息，只保存构建上下文和接口响应需要的字段"""
+    id: int
+    conversation_id: int
+    role: str
+    content: str
+    created_at: datetime
+    processing_time: Optional[float]
+    use_local_model: Optional[bool]
+    model_name: Optional[str]
+
+    @classmethod
+    def from_model(cls, message: AIMessage) -> "HistoryMessage":
+        return cls(
+            id=message.id,
+            conversation_id=message.conversation_id,
+            role=message.role,
+            content=message.content,
+            created_at=message.created_at,
+            processing_time=message.processing_time,
+            use_local_model=message.use_local_model,
+            model_name=message.model_name
+        )
+
+    def to_context(self) -> Dict[str, str]:
+        """AI助手上下文使用的格式"""
+        return {"role": self.role, "content": self.content}
+
+    def to_dict(self) -> Dict[str, Any]:
+        """消息接口返回的格式"""
+        return {
+            "id": self.id,
+            "role": self.role,
+            "content": self.content,
+            "conversation_id": self.conversation_id,
+            "timestamp": self.created_at,
+            "processing_time": self.processing_time,
+            "use_local_model": self.use_local_model,
+            "model_name": self.model_name
+        }
+
+
+class _ConversationEntry:
+    def __init__(self, messages: List[HistoryMessage], complete: bool):
+        self.messages: Deque[HistoryMessage] = deque(messages, maxlen=settings.AI_CONTEXT_MAX_MESSAGES)
+        # 为True时缓存包含会话的全部消息
+        self.complete = complete
+        self.loaded_at = time.monotonic()
+
+
+class ConversationHistoryCache:
+    """
+    会话最近消息缓存
+
+    按会话缓存最近 AI_CONTEXT_MAX_MESSAGES 条消息，供发送消息时的重复检查和AI上下文使用。
+    本进程内的消息创建和删除通过 on_created / on_deleted 直接写入缓存（write-through），
+    未缓存的会话在首次读取时从数据库加载，超过 CACHE_TIMEOUT 秒后重新加载，
+    以纠正多进程部署下其他进程的修改。最多缓存 AI_HISTORY_CACHE_SIZE 个会话，超出时淘汰最久未使用的。
+    """
+
+    def __init__(self):
+        self._entries: "OrderedDict[int, _ConversationEntry]" = OrderedDict()
+        # 正在从数据库加载的会话及加载期间的写入次数，有写入时不缓存加载结果，避免覆盖新消息
+        self._loading: Dict[int, int] = {}
+        self._writes: Dict[int, int] = {}
+
+    def _get_fresh(self, conversation_id: int) -> Optional[_ConversationEntry]:
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.loaded_at > settings.CACHE_TIMEOUT:
+            del self._entries[conversation_id]
+            return None
+        self._entries.move_to_end(conversation_id)
+        return entry
+
+    def _mark_write(self, conversation_id: int) -> None:
+        if conversation_id in self._loading:
+            self._writes[conversation_id] = self._writes.get(conversation_id, 0) + 1
+
+    async def _load(self, db: AsyncSession, conversation_id: int) -> _ConversationEntry:
+        self._loading[conversation_id] = self._loading.get(conversation_id, 0) + 1
+        writes_before = self._writes.get(conversation_id, 0)
+        capacity = settings.AI_CONTEXT_MAX_MESSAGES
+        try:
+            result = await db.execute(
+                select(AIMessage)
+                .where(AIMessage.conversation_id == conversation_id)
+                .order_by(AIMessage.created_at.desc(), AIMessage.id.desc())
+                .limit(capacity)
+            )
+            rows = list(reversed(result.scalars().all()))
+        finally:
+            stale = self._writes.get(conversation_id, 0) != writes_before
+            self._loading[conversation_id] -= 1
+            if not self._loading[conversation_id]:
+                del self._loading[conversation_id]
+                self._writes.pop(conversation_id, None)
+
+        entry = _ConversationEntry([HistoryMessage.from_model(row) for row in rows], len(rows) < capacity)
+        if not stale:
+            self._entries[conversation_id] = entry
+            self._entries.move_to_end(conversation_id)
+            while len(self._entries) > settings.AI_HISTORY_CACHE_SIZE:
+                self._entries.popitem(last=False)
+        return entry
+
+    async def get_recent(
+        self,
+        db: AsyncSession,
+        conversation_id: int,
+        limit: Optional[int] = None
+    ) -> List[HistoryMessage]:
+        """获取会话最近的消息，按创建时间升序排序，limit 不超过 AI_CONTEXT_MAX_MESSAGES"""
+        entry = self._get_fresh(conversation_id)
+        if entry is None:
+            entry = await self._load(db, conversation_id)
+        messages = list(entry.messages)
+        if limit is not None:
+            messages = messages[-limit:] if limit > 0 else []
+        return messages
+
+    async def get_context(self, db: AsyncSession, conversation_id: int) -> List[Dict[str, str]]:
+        """获取AI助手上下文格式的最近消息"""
+        return [message.to_context() for message in await self.get_recent(db, conversation_id)]
+
+    def get_newest(self, conversation_id: int, role: Optional[str] = None) -> Optional[HistoryMessage]:
+        """从缓存中获取会话最新的消息，会话未缓存时返回None"""
+        entry = self._get_fresh(conversation_id)
+        if entry is None:
+            return None
+        for message in reversed(entry.messages):
+            if role is None or message.role == role:
+                return message
+        return None
+
+    def on_created(self, message: AIMessage) -> None:
+        """消息提交后写入缓存"""
+        self._mark_write(message.conversation_id)
+        entry = self._entries.get(message.conversation_id)
+        if entry is None:
+            return
+        cached = HistoryMessage.from_model(message)
+        if len(entry.messages) == entry.messages.maxlen:
+            entry.complete = False
+        entry.messages.append(cached)
+
+    def on_deleted(self, conversation_id: int, message_id: int) -> None:
+        """消息删除后从缓存中移除"""
+        self._mark_write(conversation_id)
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return
+        remaining = [message for message in entry.messages if message.id != message_id]
+        if len(remaining) == len(entry.messages):
+            return
+        if entry.complete:
+            entry.messages = deque(remaining, maxlen=settings.AI_CONTEXT_MAX_MESSAGES)
+        else:
+            # 缓存不完整时删除后缺少更早的一条，下次读取时重新加载
+            del self._entries[conversation_id]
+
+    def forget(self, conversation_id: int) -> None:
+        """会话删除后丢弃缓存"""
+        self._mark_write(conversation_id)
+        self._entries.pop(conversation_id, None)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "conversations": len(self._entries),
+            "messages": sum(len(entry.messages) for entry in self._entries.values())
+        }
+
+
+# 创建全局会话消息缓存实例
+conversation_history = ConversationHistoryCache()
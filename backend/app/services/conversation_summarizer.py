@@ -0,0 +1,300 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+import asyncio
+import re
+import time
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.monitoring import AI_CONVERSATION_SUMMARIES
+from app.crud.ai_conversation import DEFAULT_CONVERSATION_TITLES, conversation as conversation_crud
+from app.db.session import async_session
+from app.models.ai_conversation import AIConversation, AIMessage
+from app.services.context_builder import estimate_tokens
+from app.services.llm_backends import LLMBackendError
+from app.services.llm_scheduler import llm_scheduler
+
+logger = get_logger(__name__)
+
+# 后台任务使用的后端，只调用本地模型
+_BACKEND = "ollama"
+# 每次最多读取的新消息数，再按token上限截取
+_MAX_MESSAGES_PER_RUN = 200
+# 只生成标题时使用的消息数
+_TITLE_MESSAGES = 6
+
+_THINK_BLOCK = re.compile(r"<think>[\s\S]*?</think>", re.IGNORECASE)
+_TITLE_LINE = re.compile(r"^\s*标题\s*[:：]\s*(.+)$", re.MULTILINE)
+_SUMMARY_BLOCK = re.compile(r"^\s*摘要\s*[:：]\s*([\s\S]+)$", re.MULTILINE)
+_TITLE_STRIP = "\"'“”‘’《》「」【】[]()（）*#。.,，!！?？:： "
+
+_ROLE_NAMES = {"user": "学生", "assistant": "助手"}
+
+
+class _Busy(Exception):
+    """后端没有空闲槽位"""
+
+
+class _Preempted(Exception):
+    """有交互请求排队，后台生成让出槽位"""
+
+
+class ConversationSummarizer:
+    """
+    会话标题和摘要的后台生成
+
+    每 AI_SUMMARY_POLL_INTERVAL 秒查找上次处理后有新消息、且已空闲 AI_SUMMARY_MIN_AGE 秒的会话，
+    为仍是默认标题的会话生成标题，为消息数达到 AI_SUMMARY_MIN_MESSAGES 的会话生成或增量更新摘要。
+    生成只在调度器判断后端空闲时进行，不参与排队；生成期间有交互请求排队时立即取消并归还槽位，
+    本轮剩余的会话留到下次。摘要在组装长对话的提示时代替较早的消息。
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        # conversation_id -> (加载时间, 所属用户ID, 摘要)，用于组装提示
+        self._summaries: "OrderedDict[int, Tuple[float, int, Optional[str]]]" = OrderedDict()
+
+    def start(self) -> None:
+        """启动后台任务，应用启动时调用"""
+        if settings.AI_SUMMARY_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._run(), name="conversation-summarizer")
+            logger.info("会话标题和摘要后台任务已启动")
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"会话标题和摘要后台任务出错: {e}")
+            await asyncio.sleep(settings.AI_SUMMARY_POLL_INTERVAL)
+
+    async def run_once(self) -> int:
+        """处理一批待处理的会话，返回处理完成的会话数；后端繁忙或让出槽位时提前结束"""
+        now = datetime.utcnow()
+        async with async_session() as db:
+            candidates = await conversation_crud.get_summary_candidates(
+                db,
+                updated_after=now - timedelta(days=settings.AI_SUMMARY_LOOKBACK_DAYS),
+                updated_before=now - timedelta(seconds=settings.AI_SUMMARY_MIN_AGE),
+                limit=settings.AI_SUMMARY_BATCH_SIZE
+            )
+            processed = 0
+            for conversation in candidates:
+                result = await self._process(db, conversation)
+                AI_CONVERSATION_SUMMARIES.labels(result=result).inc()
+                if result in ("busy", "preempted"):
+                    break
+                processed += 1
+        return processed
+
+    async def _load_new_messages(
+        self,
+        db: AsyncSession,
+        conversation: AIConversation
+    ) -> Tuple[List[AIMessage], bool]:
+        """读取摘要之后的消息，按token上限截取较早的部分，返回 (消息, 是否还有剩余)"""
+        query = (
+            select(AIMessage)
+            .where(AIMessage.conversation_id == conversation.id)
+            .order_by(AIMessage.created_at.asc(), AIMessage.id.asc())
+            .limit(_MAX_MESSAGES_PER_RUN + 1)
+        )
+        if conversation.summary_message_id is not None:
+            query = query.where(AIMessage.id > conversation.summary_message_id)
+        messages = list((await db.execute(query)).scalars().all())
+        truncated = len(messages) > _MAX_MESSAGES_PER_RUN
+        messages = messages[:_MAX_MESSAGES_PER_RUN]
+
+        used = estimate_tokens(conversation.summary or "")
+        for index, message in enumerate(messages):
+            used += estimate_tokens(message.content)
+            if used > settings.AI_SUMMARY_MAX_INPUT_TOKENS and index > 0:
+                return messages[:index], True
+        return messages, truncated
+
+    @staticmethod
+    def _build_prompt(
+        conversation: AIConversation,
+        messages: List[AIMessage],
+        want_title: bool,
+        want_summary: bool
+    ) -> str:
+        tasks = []
+        formats = []
+        if want_title:
+            tasks.append(f"为对话拟一个不超过{settings.AI_SUMMARY_TITLE_MAX_CHARS}个字的标题，概括讨论的主题")
+            formats.append("标题：……")
+        if want_summary:
+            if conversation.summary:
+                tasks.append(
+                    f"把已有摘要和新的对话合并成一段不超过{settings.AI_SUMMARY_MAX_CHARS}字的摘要，"
+                    "保留学生问过的问题、得到的结论和尚未解决的疑问"
+                )
+            else:
+                tasks.append(
+                    f"用不超过{settings.AI_SUMMARY_MAX_CHARS}字概括对话，"
+                    "保留学生问过的问题、得到的结论和尚未解决的疑问"
+                )
+            formats.append("摘要：……")
+
+        lines = ["请阅读下面学生与学习助手的对话，完成以下任务："]
+        lines.extend(f"{index}. {task}；" for index, task in enumerate(tasks, 1))
+        lines.append("请严格按以下格式输出，不要输出其他内容：")
+        lines.extend(formats)
+        lines.append("")
+        if want_summary and conversation.summary:
+            lines.append(f"已有摘要：{conversation.summary}")
+            lines.append("")
+        lines.append("对话：")
+        for message in messages:
+            content = " ".join(message.content.split())
+            lines.append(f"{_ROLE_NAMES.get(message.role, '助手')}：{content}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def _parse(text: str) -> Tuple[Optional[str], Optional[str]]:
+        text = _THINK_BLOCK.sub("", text)
+        title = None
+        summary = None
+        title_match = _TITLE_LINE.search(text)
+        if title_match:
+            title = title_match.group(1).strip().strip(_TITLE_STRIP)[:settings.AI_SUMMARY_TITLE_MAX_CHARS] or None
+        summary_match = _SUMMARY_BLOCK.search(text)
+        if summary_match:
+            # 摘要在标题之前输出时截去后面的标题行
+            summary = _TITLE_LINE.sub("", summary_match.group(1)).strip()
+            summary = " ".join(summary.split())[:settings.AI_SUMMARY_MAX_CHARS] or None
+        return title, summary
+
+    async def _generate(self, prompt: str) -> str:
+        """
+        在后端空闲的槽位中生成
+
+        异常:
+        - _Busy: 后端没有空闲槽位
+        - _Preempted: 生成期间有交互请求排队，已取消生成
+        - LLMBackendError: 模型服务调用失败
+        """
+        generation: Optional[asyncio.Future] = None
+        preempted = False
+
+        def _on_preempt() -> None:
+            nonlocal preempted
+            preempted = True
+            if generation is not None:
+                generation.cancel()
+
+        token = llm_scheduler.try_acquire_background(_BACKEND, _on_preempt)
+        if token is None:
+            raise _Busy()
+        try:
+            generation = asyncio.ensure_future(_ai_assistant().generate(
+                _BACKEND, prompt, settings.AI_SUMMARY_MODEL_NAME or settings.OLLAMA_MODEL_NAME
+            ))
+            try:
+                return await generation
+            except asyncio.CancelledError:
+                if preempted and generation.cancelled():
+                    raise _Preempted()
+                raise
+        finally:
+            llm_scheduler.release_background(_BACKEND, token)
+
+    async def _process(self, db: AsyncSession, conversation: AIConversation) -> str:
+        """处理单个会话，返回结果：success、skipped、failed、busy、preempted"""
+        processed_at = conversation.updated_at
+        total = (await db.execute(
+            select(func.count(AIMessage.id)).where(AIMessage.conversation_id == conversation.id)
+        )).scalar_one()
+        messages, truncated = await self._load_new_messages(db, conversation)
+
+        want_title = conversation.title in DEFAULT_CONVERSATION_TITLES and total >= 2
+        want_summary = total >= settings.AI_SUMMARY_MIN_MESSAGES and bool(messages) and (
+            not conversation.summary or len(messages) >= settings.AI_SUMMARY_REFRESH_MESSAGES
+        )
+        if not want_title and not want_summary:
+            await conversation_crud.save_summary(db, conversation_id=conversation.id, processed_at=processed_at)
+            return "skipped"
+        if want_summary and truncated:
+            # 本次只合并了部分新消息，处理时间记为最后一条的时间，下一轮继续合并其余的
+            processed_at = min(processed_at, messages[-1].created_at)
+        elif not want_summary:
+            # 标题只需要对话开头的几轮
+            messages = messages[:_TITLE_MESSAGES]
+
+        prompt = self._build_prompt(conversation, messages, want_title, want_summary)
+        try:
+            text = await self._generate(prompt)
+        except _Busy:
+            return "busy"
+        except _Preempted:
+            logger.info(f"有交互请求排队，暂停生成会话标题和摘要: conversation_id={conversation.id}")
+            return "preempted"
+        except LLMBackendError as e:
+            logger.warning(f"生成会话标题和摘要失败: conversation_id={conversation.id}, error={e}")
+            # 记录处理时间，会话有新消息后再重试
+            await conversation_crud.save_summary(db, conversation_id=conversation.id, processed_at=processed_at)
+            return "failed"
+
+        title, summary = self._parse(text)
+        if want_summary and summary is None:
+            logger.warning(f"模型输出中没有摘要: conversation_id={conversation.id}")
+        await conversation_crud.save_summary(
+            db,
+            conversation_id=conversation.id,
+            processed_at=processed_at,
+            title=title if want_title else None,
+            summary=summary if want_summary else None,
+            summary_message_id=messages[-1].id if want_summary and messages else None
+        )
+        if want_summary and summary:
+            self._remember(conversation.id, conversation.user_id, summary)
+        return "success" if (title or not want_title) and (summary or not want_summary) else "failed"
+
+    def _remember(self, conversation_id: int, user_id: int, summary: Optional[str]) -> None:
+        self._summaries[conversation_id] = (time.monotonic(), user_id, summary)
+        self._summaries.move_to_end(conversation_id)
+        while len(self._summaries) > settings.AI_CONTEXT_SUMMARY_CACHE_SIZE:
+            self._summaries.popitem(last=False)
+
+    async def get_summary(self, db: AsyncSession, conversation_id: Optional[int], user_id: int) -> Optional[str]:
+        """获取用户本人会话的摘要，用于组装提示；缓存 CACHE_TIMEOUT 秒"""
+        if conversation_id is None:
+            return None
+        cached = self._summaries.get(conversation_id)
+        if cached is not None and time.monotonic() - cached[0] <= settings.CACHE_TIMEOUT:
+            self._summaries.move_to_end(conversation_id)
+            return cached[2] if cached[1] == user_id else None
+        row = (await db.execute(
+            select(AIConversation.user_id, AIConversation.summary).where(AIConversation.id == conversation_id)
+        )).first()
+        if row is None:
+            return None
+        self._remember(conversation_id, row.user_id, row.summary)
+        return row.summary if row.user_id == user_id else None
+
+    def forget(self, conversation_id: int) -> None:
+        """会话删除后丢弃缓存的摘要"""
+        self._summaries.pop(conversation_id, None)
+
+
+def _ai_assistant():
+    # 延迟导入，ai_service 在组装提示时使用本模块
+    from app.services.ai_service import ai_assistant
+    return ai_assistant
+
+
+# 创建全局会话标题和摘要生成实例
+conversation_summarizer = ConversationSummarizer()
@@ -16,6 +16,8 @@ from app.crud.student import student as student_crud
 from app.crud.quant_record import quant_record_crud
 from app.schemas.student import StudentCreate
 from app.schemas.quant_record import QuantRecordCreate
+from app.services.quant_insights import quant_insights
+from app.services.student_directory import student_directory
 
 class FileService:
     @staticmethod
@@ -65,7 +67,8 @@ class FileService:
                     class_id=row['class_id'],
                     created_by=current_user_id
                 )
-                await student_crud.create(db, obj_in=student_in)
+                student_obj = await student_crud.create(db, obj_in=student_in)
+                student_directory.on_saved(student_obj)
                 success_count += 1
             except Exception as e:
                 errors.append(f"导入学生 {row['student_id_no']} 失败: {str(e)}")
@@ -121,6 +124,7 @@ class FileService:
                     recorder_id=current_user_id
                 )
                 await quant_record_crud.create(db, obj_in=record_in)
+                quant_insights.mark_stale(record_in.student_id)
                 success_count += 1
             except Exception as e:
                 errors.append(f"导入记录失败: {str(e)}")
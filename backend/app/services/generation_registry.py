@@ -0,0 +1,206 @@
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Dict, Optional, TypeVar
+import asyncio
+import itertools
+import time
+
+from fastapi import Request
+
+from app.core.config import settings
+from app.core.errors import GenerationCancelledError
+from app.core.logging import get_logger
+from app.core.monitoring import AI_CANCELLED_GENERATION_SECONDS, AI_GENERATIONS_CANCELLED
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+# 取消原因
+CANCEL_DISCONNECT = "disconnect"
+CANCEL_REQUESTED = "requested"
+CANCEL_SUPERSEDED = "superseded"
+
+_CANCEL_MESSAGES = {
+    CANCEL_DISCONNECT: "客户端已断开，AI生成已停止",
+    CANCEL_REQUESTED: "AI生成已取消",
+    CANCEL_SUPERSEDED: "同一会话有新的问题，之前的AI生成已停止"
+}
+
+
+@dataclass(eq=False)
+class _Generation:
+    """进行中的生成"""
+    id: int
+    user_id: int
+    conversation_id: Optional[int]
+    source: str
+    owner: Any
+    task: Optional[asyncio.Future] = None
+    started_at: float = field(default_factory=time.monotonic)
+    reason: Optional[str] = None
+
+
+class GenerationRegistry:
+    """
+    进行中的AI生成登记表
+
+    每次生成在独立的任务中执行并按（用户、会话、发起方）登记，以下情况取消生成任务：
+    WebSocket断开或等待响应的HTTP客户端断开、客户端主动取消、同一会话发送了新的问题。
+    任务取消后调度槽位立即归还，到模型服务的HTTP请求随之关闭，Ollama停止生成，回答不会保存。
+    被取消的生成按来源和原因单独计数，不计入正常完成的生成耗时。
+    """
+
+    def __init__(self):
+        self._generations: Dict[int, _Generation] = {}
+        self._ids = itertools.count(1)
+
+    def _register(self, user_id: int, conversation_id: Optional[int], source: str, owner: Any) -> _Generation:
+        if conversation_id is not None:
+            self.cancel(user_id, conversation_id, reason=CANCEL_SUPERSEDED)
+        generation = _Generation(
+            id=next(self._ids),
+            user_id=user_id,
+            conversation_id=conversation_id,
+            source=source,
+            owner=owner
+        )
+        self._generations[generation.id] = generation
+        return generation
+
+    def _cancel(self, generation: _Generation, reason: str) -> bool:
+        if generation.reason is not None or generation.task is None or generation.task.done():
+            return False
+        generation.reason = reason
+        generation.task.cancel()
+        elapsed = time.monotonic() - generation.started_at
+        AI_GENERATIONS_CANCELLED.labels(source=generation.source, reason=reason).inc()
+        AI_CANCELLED_GENERATION_SECONDS.labels(source=generation.source, reason=reason).inc(elapsed)
+        logger.info(
+            f"取消AI生成: user={generation.user_id}, conversation={generation.conversation_id}, "
+            f"source={generation.source}, reason={reason}, elapsed={elapsed:.2f}s"
+        )
+        return True
+
+    def cancel(self, user_id: int, conversation_id: Optional[int] = None, reason: str = CANCEL_REQUESTED) -> int:
+        """取消用户（指定会话或全部会话）进行中的生成，返回取消的数量"""
+        return sum(
+            self._cancel(generation, reason)
+            for generation in list(self._generations.values())
+            if generation.user_id == user_id
+            and (conversation_id is None or generation.conversation_id == conversation_id)
+        )
+
+    def cancel_owner(self, owner: Any, reason: str = CANCEL_DISCONNECT) -> int:
+        """取消由指定连接发起的生成，返回取消的数量"""
+        return sum(
+            self._cancel(generation, reason)
+            for generation in list(self._generations.values())
+            if generation.owner is owner
+        )
+
+    def _raise_cancelled(self, generation: _Generation) -> None:
+        raise GenerationCancelledError(_CANCEL_MESSAGES[generation.reason], generation.reason)
+
+    async def _watch_disconnect(self, request: Request, generation: _Generation) -> None:
+        while True:
+            await asyncio.sleep(settings.AI_DISCONNECT_CHECK_INTERVAL)
+            if await request.is_disconnected():
+                self._cancel(generation, CANCEL_DISCONNECT)
+                return
+
+    async def run(
+        self,
+        awaitable: Awaitable[T],
+        *,
+        user_id: int,
+        conversation_id: Optional[int] = None,
+        source: str,
+        owner: Any = None,
+        request: Optional[Request] = None
+    ) -> T:
+        """
+        在可取消的任务中执行生成并返回结果
+
+        参数:
+        - conversation_id: 不为空时取代该会话进行中的生成
+        - source: 发起方，用于指标统计（websocket、http、job）
+        - owner: 发起生成的连接，连接断开时通过 cancel_owner 取消
+        - request: 不为空时定期检查HTTP客户端是否已断开
+
+        异常:
+        - GenerationCancelledError: 生成被取消
+        """
+        generation = self._register(user_id, conversation_id, source, owner)
+        generation.task = asyncio.ensure_future(awaitable)
+        watcher = asyncio.create_task(self._watch_disconnect(request, generation)) if request is not None else None
+        try:
+            return await generation.task
+        except asyncio.CancelledError:
+            if generation.reason is None:
+                # 调用方本身被取消（如服务关闭），生成随之停止
+                raise
+            self._raise_cancelled(generation)
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            self._generations.pop(generation.id, None)
+
+    async def iterate(
+        self,
+        events: AsyncIterator[T],
+        *,
+        user_id: int,
+        conversation_id: Optional[int] = None,
+        source: str,
+        owner: Any = None
+    ) -> AsyncIterator[T]:
+        """
+        在可取消的任务中迭代流式生成，参数与 run 相同
+
+        调用方提前停止迭代（如SSE客户端断开）时同样取消生成并计为断开。
+        """
+        generation = self._register(user_id, conversation_id, source, owner)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+
+        async def _pump() -> None:
+            try:
+                async for event in events:
+                    await queue.put(event)
+            finally:
+                await events.aclose()
+
+        generation.task = asyncio.ensure_future(_pump())
+        getter: Optional[asyncio.Future] = None
+        try:
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({getter, generation.task}, return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    yield getter.result()
+                    continue
+                getter.cancel()
+                while not queue.empty():
+                    yield queue.get_nowait()
+                if generation.task.cancelled():
+                    if generation.reason is None:
+                        raise asyncio.CancelledError()
+                    self._raise_cancelled(generation)
+                # 生成出错时向调用方抛出
+                generation.task.result()
+                return
+        finally:
+            if getter is not None and not getter.done():
+                getter.cancel()
+            if not generation.task.done():
+                self._cancel(generation, CANCEL_DISCONNECT)
+            self._generations.pop(generation.id, None)
+
+    def get_stats(self) -> Dict[str, int]:
+        stats: Dict[str, int] = {}
+        for generation in self._generations.values():
+            stats[generation.source] = stats.get(generation.source, 0) + 1
+        return stats
+
+
+# 创建全局AI生成登记表实例
+generation_registry = GenerationRegistry()
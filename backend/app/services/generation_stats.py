@@ -0,0 +1,120 @@
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from app.core.monitoring import (
+    AI_GENERATION_QUEUE_SECONDS,
+    AI_GENERATION_REQUESTS,
+    AI_GENERATION_SECONDS,
+    AI_GENERATION_TOKENS,
+    AI_GENERATION_TOKENS_PER_SECOND
+)
+from app.services.context_builder import estimate_tokens
+
+# 生成结果
+OUTCOME_SUCCESS = "success"
+OUTCOME_ERROR = "error"
+OUTCOME_TIMEOUT = "timeout"
+OUTCOME_OVERLOADED = "overloaded"
+OUTCOME_CANCELLED = "cancelled"
+
+_NANOSECONDS = 1_000_000_000
+
+
+@dataclass
+class GenerationStats:
+    """
+    一次模型生成的耗时和token统计
+
+    Ollama 使用最终响应中的 prompt_eval_count / eval_count 和对应耗时，
+    OpenAI 格式的后端使用 usage 字段，后端未返回时按文本估算token数。
+    complete 或 fail 时写入Prometheus指标，每次生成只记录一次。
+    """
+    backend: str
+    model_name: str
+    started: bool = False
+    queue_time: Optional[float] = None
+    time_to_first_token: Optional[float] = None
+    prefill_time: Optional[float] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    generation_time: Optional[float] = None
+    decode_time: Optional[float] = None
+    outcome: Optional[str] = None
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        if not self.completion_tokens or not self.decode_time:
+            return None
+        return self.completion_tokens / self.decode_time
+
+    def complete(
+        self,
+        route_info: Dict[str, Any],
+        prompt: str,
+        response_text: str,
+        generation_time: float
+    ) -> None:
+        """生成结束，route_info 为 generate / generate_stream 写入的节点和统计信息"""
+        self.model_name = route_info.get("model", self.model_name)
+        self.generation_time = generation_time
+        if self.time_to_first_token is None:
+            # 非流式调用在生成完成后才返回首个token
+            self.time_to_first_token = generation_time
+
+        usage = route_info.get("usage") or {}
+        self.prompt_tokens = route_info.get("prompt_eval_count") or usage.get("prompt_tokens")
+        self.completion_tokens = route_info.get("eval_count") or usage.get("completion_tokens")
+        if self.prompt_tokens is None:
+            self.prompt_tokens = estimate_tokens(prompt)
+        if self.completion_tokens is None:
+            self.completion_tokens = estimate_tokens(response_text)
+
+        if route_info.get("prompt_eval_duration"):
+            self.prefill_time = route_info["prompt_eval_duration"] / _NANOSECONDS
+        if route_info.get("eval_duration"):
+            self.decode_time = route_info["eval_duration"] / _NANOSECONDS
+        elif generation_time > self.time_to_first_token:
+            # 流式调用以首个token之后的时间作为输出耗时
+            self.decode_time = generation_time - self.time_to_first_token
+        else:
+            self.decode_time = generation_time
+
+        if "endpoint" in route_info and not route_info.get("interrupted"):
+            self._record(OUTCOME_SUCCESS)
+        else:
+            self._record(route_info.get("error_kind", OUTCOME_ERROR))
+
+    def fail(self, outcome: str) -> None:
+        """生成未完成（超时、繁忙被拒绝、取消或出错），尚未开始生成时不记录"""
+        if self.started:
+            self._record(outcome)
+
+    def _record(self, outcome: str) -> None:
+        if self.outcome is not None:
+            return
+        self.outcome = outcome
+        labels = {"backend": self.backend, "model": self.model_name or ""}
+        AI_GENERATION_REQUESTS.labels(outcome=outcome, **labels).inc()
+        if self.queue_time is not None:
+            AI_GENERATION_QUEUE_SECONDS.labels(**labels).observe(self.queue_time)
+        if outcome != OUTCOME_SUCCESS:
+            return
+        AI_GENERATION_SECONDS.labels(**labels).observe(self.generation_time or 0.0)
+        AI_GENERATION_TOKENS.labels(kind="prompt", **labels).inc(self.prompt_tokens or 0)
+        AI_GENERATION_TOKENS.labels(kind="completion", **labels).inc(self.completion_tokens or 0)
+        if self.tokens_per_second is not None:
+            AI_GENERATION_TOKENS_PER_SECOND.labels(**labels).observe(self.tokens_per_second)
+
+    def to_message_fields(self) -> Dict[str, Any]:
+        """保存到助手消息的统计字段，生成失败时保存的错误提示不记录统计"""
+        if self.outcome != OUTCOME_SUCCESS:
+            return {}
+        return {
+            "backend": self.backend,
+            "queue_time": self.queue_time,
+            "time_to_first_token": self.time_to_first_token,
+            "prefill_time": self.prefill_time,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "tokens_per_second": self.tokens_per_second
+        }
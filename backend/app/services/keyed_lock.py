@@ -0,0 +1,97 @@
+from typing import Dict, Hashable, Optional
+import asyncio
+import time
+
+from app.core.monitoring import KEYED_LOCK_KEYS, KEYED_LOCK_TIMEOUTS, KEYED_LOCK_WAIT_SECONDS
+
+
+class _Entry:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # 持有和等待该锁的请求数，为0时删除
+        self.users = 0
+
+
+class KeyLease:
+    """已获取的锁，release 可重复调用，也可作为异步上下文管理器使用"""
+
+    def __init__(self, owner: "KeyedLock", key: Hashable, entry: _Entry):
+        self._owner = owner
+        self._key = key
+        self._entry = entry
+        self._released = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._entry.lock.release()
+        self._owner._leave(self._key, self._entry)
+
+    async def __aenter__(self) -> "KeyLease":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.release()
+
+
+class KeyedLock:
+    """
+    按键加锁（进程内）
+
+    每个键对应一个 asyncio.Lock，同一键的请求依次执行，不同键互不影响。
+    锁只在有请求持有或等待时存在，最后一个请求释放后自动删除，键的数量不会随时间增长。
+    多进程部署时只保证本进程内的顺序，进程间需配合数据库行锁等共享的机制。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._entries: Dict[Hashable, _Entry] = {}
+
+    def _leave(self, key: Hashable, entry: _Entry) -> None:
+        entry.users -= 1
+        if not entry.users and self._entries.get(key) is entry:
+            del self._entries[key]
+        KEYED_LOCK_KEYS.labels(name=self.name).set(len(self._entries))
+
+    async def acquire(self, key: Hashable, timeout: Optional[float] = None) -> KeyLease:
+        """
+        获取键对应的锁，返回需要释放的 KeyLease
+
+        异常:
+        - asyncio.TimeoutError: timeout 秒内未能获取
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _Entry()
+        entry.users += 1
+        KEYED_LOCK_KEYS.labels(name=self.name).set(len(self._entries))
+
+        begin = time.monotonic()
+        try:
+            await asyncio.wait_for(entry.lock.acquire(), timeout)
+        except asyncio.TimeoutError:
+            KEYED_LOCK_TIMEOUTS.labels(name=self.name).inc()
+            self._leave(key, entry)
+            raise
+        except BaseException:
+            self._leave(key, entry)
+            raise
+        KEYED_LOCK_WAIT_SECONDS.labels(name=self.name).observe(time.monotonic() - begin)
+        return KeyLease(self, key, entry)
+
+    def locked(self, key: Hashable) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry.lock.locked()
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "keys": len(self._entries),
+            "locked": sum(1 for entry in self._entries.values() if entry.lock.locked())
+        }
+
+
+# 创建全局会话消息创建锁实例
+conversation_locks = KeyedLock("conversation_message")
@@ -0,0 +1,284 @@
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urljoin
+import asyncio
+import time
+
+import aiohttp
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.monitoring import LLM_BACKEND_CIRCUIT_STATE, LLM_BACKEND_FAILOVERS
+from app.services.llm_client import backend_origin, llm_client_pool
+
+logger = get_logger(__name__)
+
+# 熔断器状态
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_HALF_OPEN = "half_open"
+CIRCUIT_OPEN = "open"
+
+_CIRCUIT_STATE_VALUES = {CIRCUIT_CLOSED: 0, CIRCUIT_HALF_OPEN: 1, CIRCUIT_OPEN: 2}
+
+# 尚无延迟测量时使用的默认延迟（秒），保证新节点也能分到请求
+_DEFAULT_LATENCY = 1.0
+
+
+class LLMBackendError(Exception):
+    """LLM后端调用失败（连接失败、超时或5xx响应），计入节点熔断，可以切换到其他节点重试"""
+
+
+class LLMRequestError(LLMBackendError):
+    """请求本身无效（4xx响应，如模型不存在、提示过长），换节点重试也会失败，不计入节点熔断"""
+
+
+def status_error(status: int) -> LLMBackendError:
+    """按响应状态码构造异常：4xx为请求错误，其他为节点错误"""
+    message = f"调用模型时出现错误: {status}"
+    if 400 <= status < 500:
+        return LLMRequestError(message)
+    return LLMBackendError(message)
+
+
+class LLMEndpoint:
+    """
+    单个LLM服务节点
+
+    记录进行中的请求数、首字节延迟的指数加权平均和熔断器状态。
+    连续失败达到 LLM_CIRCUIT_FAILURE_THRESHOLD 次后熔断，
+    LLM_CIRCUIT_RESET_TIMEOUT 秒后进入半开状态，放行一个试探请求，成功则恢复。
+    """
+
+    def __init__(self, kind: str, base_url: str):
+        self.kind = kind
+        self.base_url = base_url
+        self.name = backend_origin(base_url)
+        self.in_flight = 0
+        self.latency: Optional[float] = None
+        self.failures = 0
+        self.state = CIRCUIT_CLOSED
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        # 健康检查获取的模型列表，None表示尚未获取
+        self.models: Optional[Set[str]] = None
+        self.last_checked_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._set_state(CIRCUIT_CLOSED)
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            logger.info(f"LLM节点熔断状态变化: {self.name} {self.state} -> {state}")
+        self.state = state
+        LLM_BACKEND_CIRCUIT_STATE.labels(backend=self.name).set(_CIRCUIT_STATE_VALUES[state])
+
+    def serves(self, model: str) -> bool:
+        """节点是否提供指定模型，模型列表未知时视为提供"""
+        if self.models is None or not model:
+            return True
+        return model in self.models or f"{model}:latest" in self.models
+
+    def is_available(self, now: float) -> bool:
+        if self.state == CIRCUIT_CLOSED:
+            return True
+        if self.state == CIRCUIT_OPEN and now - self.opened_at >= settings.LLM_CIRCUIT_RESET_TIMEOUT:
+            self._set_state(CIRCUIT_HALF_OPEN)
+        # 半开状态只放行一个试探请求
+        return self.state == CIRCUIT_HALF_OPEN and not self.trial_in_flight
+
+    def score(self) -> float:
+        """路由评分，越小越优先：延迟乘以（进行中的请求数 + 1）"""
+        return (self.latency or _DEFAULT_LATENCY) * (self.in_flight + 1)
+
+    def begin(self) -> None:
+        self.in_flight += 1
+        if self.state == CIRCUIT_HALF_OPEN:
+            self.trial_in_flight = True
+
+    def end(self) -> None:
+        self.in_flight = max(self.in_flight - 1, 0)
+        self.trial_in_flight = False
+
+    def record_success(self, latency: float) -> None:
+        self.latency = latency if self.latency is None else 0.7 * self.latency + 0.3 * latency
+        self.failures = 0
+        self.last_error = None
+        if self.state != CIRCUIT_CLOSED:
+            self._set_state(CIRCUIT_CLOSED)
+
+    def record_failure(self, error: str) -> None:
+        self.failures += 1
+        self.last_error = error
+        if self.state == CIRCUIT_HALF_OPEN or self.failures >= settings.LLM_CIRCUIT_FAILURE_THRESHOLD:
+            self.trip()
+
+    def trip(self) -> None:
+        """熔断节点"""
+        self.opened_at = time.monotonic()
+        self._set_state(CIRCUIT_OPEN)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "name": self.name,
+            "state": self.state,
+            "in_flight": self.in_flight,
+            "latency": round(self.latency, 3) if self.latency is not None else None,
+            "failures": self.failures,
+            "models": sorted(self.models) if self.models is not None else None,
+            "last_error": self.last_error
+        }
+
+
+class LLMBackendPool:
+    """
+    LLM后端节点池
+
+    每类后端（ollama / open_webui）可以配置多个节点，按延迟和负载评分路由，
+    节点失败时切换到下一个节点，所有节点都不可用时切换到备用模型。
+    后台任务定期检查节点健康状态和模型列表，并据此调整调度器的并发槽位数。
+    """
+
+    def __init__(self):
+        self._endpoints: Dict[str, List[LLMEndpoint]] = {}
+        self._health_task: Optional[asyncio.Task] = None
+
+    def _configured_urls(self) -> Dict[str, List[str]]:
+        return {
+            "ollama": settings.get_ollama_base_urls,
+            "open_webui": settings.get_open_webui_base_urls
+        }
+
+    def _ensure_loaded(self) -> None:
+        if not self._endpoints:
+            self._endpoints = {
+                kind: [LLMEndpoint(kind, url) for url in urls]
+                for kind, urls in self._configured_urls().items()
+            }
+
+    def endpoints(self, kind: Optional[str] = None) -> List[LLMEndpoint]:
+        self._ensure_loaded()
+        if kind is not None:
+            return self._endpoints.get(kind, [])
+        return [endpoint for endpoints in self._endpoints.values() for endpoint in endpoints]
+
+    def fallback_model(self, kind: str) -> str:
+        if kind == "ollama":
+            return settings.OLLAMA_FALLBACK_MODEL_NAME
+        return settings.OPEN_WEBUI_FALLBACK_MODEL_NAME
+
+    def route(self, kind: str, model: str, prefer: Optional[str] = None) -> Iterator[Tuple[LLMEndpoint, str]]:
+        """
+        按优先顺序依次给出可尝试的 (节点, 模型)
+
+        先尝试提供请求模型的节点，再尝试提供备用模型的节点；
+        每次取下一个候选时重新评分，反映最新的负载和熔断状态。
+        prefer 为节点名称时优先尝试该节点（如持有会话KV缓存的节点），不可用时按评分选择。
+        """
+        models = [model]
+        fallback = self.fallback_model(kind)
+        if fallback and fallback != model:
+            models.append(fallback)
+
+        attempts = 0
+        for candidate_model in models:
+            tried: Set[str] = set()
+            while True:
+                now = time.monotonic()
+                candidates = [
+                    endpoint for endpoint in self.endpoints(kind)
+                    if endpoint.name not in tried
+                    and endpoint.serves(candidate_model)
+                    and endpoint.is_available(now)
+                ]
+                if not candidates:
+                    break
+                preferred = [endpoint for endpoint in candidates if endpoint.name == prefer]
+                endpoint = preferred[0] if preferred else min(candidates, key=lambda item: item.score())
+                tried.add(endpoint.name)
+                if attempts > 0:
+                    reason = "endpoint" if candidate_model == model else "fallback_model"
+                    LLM_BACKEND_FAILOVERS.labels(kind=kind, reason=reason).inc()
+                attempts += 1
+                yield endpoint, candidate_model
+
+    def available_count(self, kind: str) -> int:
+        now = time.monotonic()
+        return sum(1 for endpoint in self.endpoints(kind) if endpoint.is_available(now))
+
+    async def _check_endpoint(self, endpoint: LLMEndpoint) -> None:
+        """获取节点的模型列表，失败则熔断节点"""
+        path = "/api/tags" if endpoint.kind == "ollama" else "/api/models"
+        url = urljoin(endpoint.base_url, path)
+        headers = {}
+        api_key = settings.OLLAMA_API_KEY if endpoint.kind == "ollama" else settings.OPEN_WEBUI_API_KEY
+        if api_key and not api_key.startswith("your-"):
+            headers["Authorization"] = f"Bearer {api_key}"
+
+        session = llm_client_pool.get_session(endpoint.base_url)
+        try:
+            async with session.get(
+                url,
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=settings.LLM_HEALTH_CHECK_TIMEOUT)
+            ) as response:
+                if response.status != 200:
+                    raise LLMBackendError(f"健康检查返回状态码 {response.status}")
+                data = await response.json(content_type=None)
+        except Exception as e:
+            endpoint.last_checked_at = time.monotonic()
+            endpoint.last_error = str(e) or e.__class__.__name__
+            if endpoint.state != CIRCUIT_OPEN:
+                logger.warning(f"LLM节点健康检查失败，熔断节点: {endpoint.name}, error={endpoint.last_error}")
+            endpoint.trip()
+            return
+
+        endpoint.last_checked_at = time.monotonic()
+        if endpoint.kind == "ollama":
+            endpoint.models = {item.get("name") for item in data.get("models", []) if item.get("name")}
+        else:
+            endpoint.models = {item.get("id") for item in data.get("data", []) if item.get("id")}
+        # 健康检查通过的熔断节点进入半开状态，由下一个真实请求确认恢复
+        if endpoint.state == CIRCUIT_OPEN:
+            endpoint._set_state(CIRCUIT_HALF_OPEN)
+
+    async def check_health(self) -> None:
+        """检查全部节点并按可用节点数调整调度器槽位"""
+        # 延迟导入，避免与调度器循环依赖
+        from app.services.llm_scheduler import llm_scheduler
+
+        await asyncio.gather(*(self._check_endpoint(endpoint) for endpoint in self.endpoints()))
+        for kind in self._endpoints:
+            llm_scheduler.set_endpoint_count(kind, max(self.available_count(kind), 1))
+
+    async def _health_loop(self) -> None:
+        while True:
+            try:
+                await self.check_health()
+            except Exception as e:
+                logger.error(f"LLM节点健康检查出错: {str(e)}")
+            await asyncio.sleep(settings.LLM_HEALTH_CHECK_INTERVAL)
+
+    async def start(self) -> None:
+        """加载节点配置并启动健康检查任务"""
+        self._ensure_loaded()
+        await llm_client_pool.start([endpoint.base_url for endpoint in self.endpoints()])
+        if settings.LLM_HEALTH_CHECK_INTERVAL > 0 and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+
+    def get_status(self) -> Dict[str, List[Dict[str, Any]]]:
+        return {
+            kind: [endpoint.to_dict() for endpoint in self.endpoints(kind)]
+            for kind in self._configured_urls()
+        }
+
+
+# 创建全局LLM后端节点池实例
+llm_backend_pool = LLMBackendPool()
@@ -0,0 +1,100 @@
+from types import SimpleNamespace
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.monitoring import (
+    LLM_HTTP_CONNECTIONS_CREATED,
+    LLM_HTTP_CONNECTIONS_REUSED,
+    LLM_HTTP_REQUESTS
+)
+
+logger = get_logger(__name__)
+
+
+def backend_origin(url: str) -> str:
+    """获取URL的协议、主机和端口，作为连接池的键和指标标签"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+class LLMClientPool:
+    """
+    LLM后端HTTP客户端池
+
+    每个后端（按协议、主机和端口区分）共享一个长期存在的 aiohttp.ClientSession，
+    复用keep-alive连接，避免每次查询都重新建立连接器、解析DNS和TCP握手。
+    连接数按后端限制，超过上限的请求在连接器内排队。
+    在应用 lifespan 中启动和关闭，启动前的调用（如脚本）会按需创建会话。
+    """
+
+    def __init__(self):
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+
+    def _create_trace_config(self, origin: str) -> aiohttp.TraceConfig:
+        """记录新建连接与复用连接的次数"""
+
+        async def on_connection_create_end(session, context, params):
+            LLM_HTTP_CONNECTIONS_CREATED.labels(backend=origin).inc()
+
+        async def on_connection_reuseconn(session, context, params):
+            LLM_HTTP_CONNECTIONS_REUSED.labels(backend=origin).inc()
+
+        async def on_request_end(session, context, params):
+            LLM_HTTP_REQUESTS.labels(backend=origin, status=params.response.status).inc()
+
+        trace_config = aiohttp.TraceConfig(trace_config_ctx_factory=SimpleNamespace)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_request_end.append(on_request_end)
+        return trace_config
+
+    def _create_session(self, origin: str) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=settings.LLM_HTTP_MAX_CONNECTIONS,
+            limit_per_host=settings.LLM_HTTP_MAX_CONNECTIONS,
+            keepalive_timeout=settings.LLM_HTTP_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=300
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=settings.LLM_HTTP_CONNECT_TIMEOUT,
+            # 流式生成时两段输出之间的最长间隔，非流式时为等待完整响应的时间
+            sock_read=settings.LLM_HTTP_READ_TIMEOUT
+        )
+        logger.info(f"创建LLM后端HTTP客户端: {origin}, 最大连接数: {settings.LLM_HTTP_MAX_CONNECTIONS}")
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            trace_configs=[self._create_trace_config(origin)]
+        )
+
+    def get_session(self, url: str) -> aiohttp.ClientSession:
+        """获取URL所属后端的共享会话，调用方不要关闭返回的会话"""
+        origin = backend_origin(url)
+        session = self._sessions.get(origin)
+        if session is None or session.closed:
+            session = self._create_session(origin)
+            self._sessions[origin] = session
+        return session
+
+    async def start(self, urls: Optional[list] = None) -> None:
+        """启动时为已配置的后端预先创建会话"""
+        for url in urls or []:
+            self.get_session(url)
+
+    async def close(self) -> None:
+        """关闭全部会话及其连接"""
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for session in sessions:
+            if not session.closed:
+                await session.close()
+        logger.info("LLM后端HTTP客户端已关闭")
+
+
+# 创建全局LLM客户端池实例
+llm_client_pool = LLMClientPool()
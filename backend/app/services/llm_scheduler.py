@@ -0,0 +1,320 @@
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Callable, Deque, Dict, List, Optional, Set
+import asyncio
+import itertools
+import time
+
+from app.core.config import settings
+from app.core.errors import ServiceOverloadedError
+from app.core.logging import get_logger
+from app.core.monitoring import (
+    LLM_ACTIVE_GENERATIONS,
+    LLM_BACKGROUND_PREEMPTIONS,
+    LLM_QUEUE_DEPTH,
+    LLM_QUEUE_WAIT,
+    LLM_REQUESTS_SHED
+)
+
+logger = get_logger(__name__)
+
+# 排队位置回调，参数为从1开始的位置
+PositionCallback = Callable[[int], None]
+
+
+class _Ticket:
+    """排队中的请求"""
+    __slots__ = ("user_id", "future", "on_position", "position")
+
+    def __init__(self, user_id: int, future: asyncio.Future, on_position: Optional[PositionCallback]):
+        self.user_id = user_id
+        self.future = future
+        self.on_position = on_position
+        self.position = 0
+
+
+class _BackendQueue:
+    """单个后端的并发槽位和按用户分组的等待队列"""
+
+    def __init__(self, name: str, per_endpoint_capacity: int):
+        self.name = name
+        self.per_endpoint_capacity = per_endpoint_capacity
+        self.capacity = per_endpoint_capacity
+        self.active = 0
+        # user_id -> 该用户的等待请求，字典顺序即轮转顺序
+        self.waiting: "OrderedDict[int, Deque[_Ticket]]" = OrderedDict()
+        self.size = 0
+        # 单次生成耗时的指数加权平均，用于估算排队时间
+        self.avg_service_time: Optional[float] = None
+        # 后台任务占用的槽位（计入 active）及其让出槽位的回调
+        self.background: Dict[int, Callable[[], None]] = {}
+        self.preempted: Set[int] = set()
+
+    def ordered_tickets(self) -> List[_Ticket]:
+        """按轮转顺序展开等待队列：每轮每个用户各取一个请求"""
+        queues = list(self.waiting.values())
+        tickets: List[_Ticket] = []
+        depth = 0
+        while len(tickets) < self.size:
+            for queue in queues:
+                if depth < len(queue):
+                    tickets.append(queue[depth])
+            depth += 1
+        return tickets
+
+    def estimated_wait(self, position: int) -> float:
+        """估算排在指定位置的请求需要等待的时间"""
+        if self.avg_service_time is None:
+            return 0.0
+        rounds = (position + self.capacity - 1) // self.capacity
+        return rounds * self.avg_service_time
+
+
+class LLMScheduler:
+    """
+    LLM请求调度器
+
+    每个后端有固定数量的并发槽位（Ollama通常只能同时生成一到两个请求），
+    槽位数为单节点并发数乘以可用节点数，由节点池的健康检查更新。
+    超出的请求按用户分组排队，空出槽位时在用户之间轮转分配，
+    避免单个用户连续提交的请求占满队列。
+    排队位置变化时通过回调通知调用方；预计等待或实际等待超过 LLM_QUEUE_MAX_WAIT 秒时
+    抛出 ServiceOverloadedError 拒绝请求，而不是让所有请求一起超时。
+
+    后台任务（如生成会话标题）通过 try_acquire_background 在后端空闲时占用槽位，不排队；
+    之后有交互请求排队时调用后台任务的回调让其停止并归还槽位。
+    """
+
+    def __init__(self):
+        self._backends: Dict[str, _BackendQueue] = {}
+        self._background_tokens = itertools.count(1)
+
+    def _capacity_for(self, backend: str) -> int:
+        if backend == "ollama":
+            return settings.OLLAMA_MAX_CONCURRENCY
+        if backend == "open_webui":
+            return settings.OPEN_WEBUI_MAX_CONCURRENCY
+        return settings.LLM_DEFAULT_MAX_CONCURRENCY
+
+    def _get_backend(self, backend: str) -> _BackendQueue:
+        queue = self._backends.get(backend)
+        if queue is None:
+            queue = _BackendQueue(backend, max(1, self._capacity_for(backend)))
+            self._backends[backend] = queue
+        return queue
+
+    def set_endpoint_count(self, backend: str, count: int) -> None:
+        """按可用节点数调整后端的槽位数"""
+        queue = self._get_backend(backend)
+        capacity = max(1, queue.per_endpoint_capacity * count)
+        if capacity != queue.capacity:
+            logger.info(f"LLM后端槽位数变化: {backend} {queue.capacity} -> {capacity}")
+            queue.capacity = capacity
+            self._dispatch(queue)
+
+    def _shed(self, queue: _BackendQueue, reason: str, waited: float) -> ServiceOverloadedError:
+        LLM_REQUESTS_SHED.labels(backend=queue.name, reason=reason).inc()
+        logger.warning(f"LLM请求被拒绝: backend={queue.name}, reason={reason}, queue_size={queue.size}")
+        retry_after = queue.estimated_wait(queue.size) or settings.LLM_QUEUE_MAX_WAIT
+        return ServiceOverloadedError(
+            "AI助手当前繁忙，请稍后再试",
+            details={
+                "backend": queue.name,
+                "reason": reason,
+                "queue_size": queue.size,
+                "waited_seconds": round(waited, 2),
+                "retry_after_seconds": round(retry_after, 1)
+            }
+        )
+
+    def _update_metrics(self, queue: _BackendQueue) -> None:
+        LLM_QUEUE_DEPTH.labels(backend=queue.name).set(queue.size)
+        LLM_ACTIVE_GENERATIONS.labels(backend=queue.name).set(queue.active)
+
+    def _notify_positions(self, queue: _BackendQueue) -> None:
+        """通知排队位置发生变化的请求"""
+        for position, ticket in enumerate(queue.ordered_tickets(), start=1):
+            if ticket.position == position:
+                continue
+            ticket.position = position
+            if ticket.on_position is not None:
+                try:
+                    ticket.on_position(position)
+                except Exception as e:
+                    logger.error(f"排队位置回调出错: {str(e)}")
+
+    def _remove_ticket(self, queue: _BackendQueue, ticket: _Ticket) -> None:
+        user_queue = queue.waiting.get(ticket.user_id)
+        if user_queue is None or ticket not in user_queue:
+            return
+        user_queue.remove(ticket)
+        queue.size -= 1
+        if not user_queue:
+            del queue.waiting[ticket.user_id]
+
+    def _dispatch(self, queue: _BackendQueue) -> None:
+        """把空闲槽位轮流分配给等待中的用户"""
+        while queue.active < queue.capacity and queue.waiting:
+            user_id, user_queue = queue.waiting.popitem(last=False)
+            ticket = user_queue.popleft()
+            queue.size -= 1
+            if user_queue:
+                # 该用户还有请求，排到轮转顺序末尾
+                queue.waiting[user_id] = user_queue
+            if ticket.future.done():
+                continue
+            queue.active += 1
+            ticket.future.set_result(True)
+        self._notify_positions(queue)
+        self._update_metrics(queue)
+
+    async def acquire(
+        self,
+        backend: str,
+        user_id: int,
+        on_position: Optional[PositionCallback] = None
+    ) -> None:
+        """
+        获取后端的生成槽位，必须与 release 成对调用
+
+        参数:
+        - backend: 后端名称
+        - user_id: 发起请求的用户，用于轮转分配
+        - on_position: 排队位置变化时的回调，获得槽位前至少调用一次
+
+        异常:
+        - ServiceOverloadedError: 预计等待或实际等待超过 LLM_QUEUE_MAX_WAIT 秒，或队列已满
+        """
+        queue = self._get_backend(backend)
+        enqueued_at = time.monotonic()
+
+        if queue.active < queue.capacity and not queue.waiting:
+            queue.active += 1
+            self._update_metrics(queue)
+            LLM_QUEUE_WAIT.labels(backend=backend).observe(0)
+            return
+
+        if queue.size >= settings.LLM_QUEUE_MAX_SIZE:
+            raise self._shed(queue, "queue_full", 0)
+        if queue.estimated_wait(queue.size + 1) > settings.LLM_QUEUE_MAX_WAIT:
+            raise self._shed(queue, "estimated_wait", 0)
+
+        ticket = _Ticket(user_id, asyncio.get_running_loop().create_future(), on_position)
+        queue.waiting.setdefault(user_id, deque()).append(ticket)
+        queue.size += 1
+        self._notify_positions(queue)
+        self._update_metrics(queue)
+        self._preempt_background(queue)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), timeout=settings.LLM_QUEUE_MAX_WAIT)
+        except asyncio.TimeoutError:
+            if not ticket.future.done():
+                ticket.future.cancel()
+                self._remove_ticket(queue, ticket)
+                self._notify_positions(queue)
+                self._update_metrics(queue)
+                raise self._shed(queue, "wait_timeout", time.monotonic() - enqueued_at)
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # 取消前已获得槽位，归还给下一个请求
+                self.release(backend)
+            else:
+                ticket.future.cancel()
+                self._remove_ticket(queue, ticket)
+                self._notify_positions(queue)
+                self._update_metrics(queue)
+            raise
+
+        LLM_QUEUE_WAIT.labels(backend=backend).observe(time.monotonic() - enqueued_at)
+
+    def release(self, backend: str, service_time: Optional[float] = None) -> None:
+        """归还槽位，service_time 为本次生成耗时，用于更新排队时间估算"""
+        queue = self._get_backend(backend)
+        queue.active = max(queue.active - 1, 0)
+        if service_time is not None:
+            if queue.avg_service_time is None:
+                queue.avg_service_time = service_time
+            else:
+                queue.avg_service_time = 0.8 * queue.avg_service_time + 0.2 * service_time
+        self._dispatch(queue)
+
+    def try_acquire_background(self, backend: str, on_preempt: Callable[[], None]) -> Optional[int]:
+        """
+        后台任务在后端空闲时获取槽位，不排队，获取不到时返回None
+
+        没有请求排队，并且后端完全空闲或获取后仍有 LLM_BACKGROUND_RESERVED_SLOTS 个空闲槽位时才分配。
+        之后有交互请求排队时调用 on_preempt，后台任务应尽快停止并调用 release_background 归还槽位。
+        返回的令牌用于 release_background。
+        """
+        queue = self._get_backend(backend)
+        if queue.waiting or queue.active >= queue.capacity:
+            return None
+        if queue.active and queue.active + 1 + settings.LLM_BACKGROUND_RESERVED_SLOTS > queue.capacity:
+            return None
+        token = next(self._background_tokens)
+        queue.background[token] = on_preempt
+        queue.active += 1
+        self._update_metrics(queue)
+        return token
+
+    def release_background(self, backend: str, token: int) -> None:
+        """归还后台任务的槽位，可重复调用"""
+        queue = self._get_backend(backend)
+        if queue.background.pop(token, None) is None:
+            return
+        queue.preempted.discard(token)
+        queue.active = max(queue.active - 1, 0)
+        self._dispatch(queue)
+
+    def _preempt_background(self, queue: _BackendQueue) -> None:
+        """有请求排队时让后台任务让出槽位，每个排队请求至多让出一个"""
+        pending = queue.size - len(queue.preempted)
+        for token, on_preempt in list(queue.background.items()):
+            if pending <= 0:
+                break
+            if token in queue.preempted:
+                continue
+            queue.preempted.add(token)
+            pending -= 1
+            LLM_BACKGROUND_PREEMPTIONS.labels(backend=queue.name).inc()
+            try:
+                on_preempt()
+            except Exception as e:
+                logger.warning(f"通知后台任务让出槽位失败: backend={queue.name}, error={e}")
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        backend: str,
+        user_id: int,
+        on_position: Optional[PositionCallback] = None
+    ):
+        """在上下文中占用一个生成槽位"""
+        await self.acquire(backend, user_id, on_position)
+        started_at = time.monotonic()
+        try:
+            yield
+        except BaseException:
+            # 被取消或出错的生成不计入平均耗时
+            self.release(backend)
+            raise
+        self.release(backend, time.monotonic() - started_at)
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """获取各后端的调度状态"""
+        return {
+            name: {
+                "capacity": queue.capacity,
+                "active": queue.active,
+                "waiting": queue.size,
+                "waiting_users": len(queue.waiting),
+                "background": len(queue.background),
+                "avg_service_time": round(queue.avg_service_time or 0.0, 3)
+            }
+            for name, queue in self._backends.items()
+        }
+
+
+# 创建全局LLM调度器实例
+llm_scheduler = LLMScheduler()
@@ -0,0 +1,128 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+import hashlib
+import time
+
+from app.core.config import settings
+from app.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha1((text or "").encode("utf-8")).hexdigest()
+
+
+@dataclass
+class OllamaContext:
+    """
+    会话上一轮生成后Ollama返回的 context
+
+    context 是上一轮提示和回答的token序列，只在生成它的节点和模型上复用才能命中该节点的KV缓存。
+    response_digest 用于确认对话历史的最后一条助手消息就是这一轮的回答，历史被修改过时不复用。
+    """
+    endpoint: str
+    model_name: str
+    tokens: List[int]
+    response_digest: str
+    updated_at: float
+
+
+@dataclass
+class ContextReuse:
+    """本轮可复用的 context：只需发送 delta_prompt，前文由 tokens 提供"""
+    endpoint: str
+    model_name: str
+    tokens: List[int]
+    delta_prompt: str
+
+
+class OllamaContextStore:
+    """
+    Ollama会话上下文缓存
+
+    按会话保存上一轮生成返回的 context，下一轮在同一节点、同一模型上只发送新的问题，
+    Ollama 无需重新预填充系统提示和对话历史。context 超过 OLLAMA_CONTEXT_MAX_TOKENS 个token
+    或超过 OLLAMA_CONTEXT_TTL 秒未使用时丢弃，下一轮重新发送完整提示（含较早对话的摘要）。
+    """
+
+    def __init__(self):
+        self._contexts: "OrderedDict[int, OllamaContext]" = OrderedDict()
+
+    def save(
+        self,
+        conversation_id: int,
+        endpoint: str,
+        model_name: str,
+        tokens: List[int],
+        response_text: str
+    ) -> None:
+        if not settings.OLLAMA_CONTEXT_REUSE or not tokens:
+            return
+        if len(tokens) > settings.OLLAMA_CONTEXT_MAX_TOKENS:
+            self.forget(conversation_id)
+            return
+        self._contexts[conversation_id] = OllamaContext(
+            endpoint=endpoint,
+            model_name=model_name,
+            tokens=list(tokens),
+            response_digest=_digest(response_text),
+            updated_at=time.monotonic()
+        )
+        self._contexts.move_to_end(conversation_id)
+        while len(self._contexts) > settings.OLLAMA_CONTEXT_CACHE_SIZE:
+            self._contexts.popitem(last=False)
+
+    def find_reuse(
+        self,
+        conversation_id: Optional[int],
+        model_name: str,
+        query_text: str,
+        messages: List[Dict[str, Any]],
+        delta_prompt: str
+    ) -> Optional[ContextReuse]:
+        """
+        判断本轮能否复用上一轮的 context
+
+        要求对话历史的最后一条助手消息是上一轮的回答，且之后只有当前问题。
+        """
+        if not settings.OLLAMA_CONTEXT_REUSE or conversation_id is None:
+            return None
+        context = self._contexts.get(conversation_id)
+        if context is None:
+            return None
+        if time.monotonic() - context.updated_at > settings.OLLAMA_CONTEXT_TTL or context.model_name != model_name:
+            self.forget(conversation_id)
+            return None
+
+        last_assistant = None
+        for index in range(len(messages) - 1, -1, -1):
+            if messages[index].get("role") == "assistant":
+                last_assistant = index
+                break
+        if last_assistant is None or _digest(messages[last_assistant].get("content", "")) != context.response_digest:
+            return None
+        pending = [message.get("content", "") for message in messages[last_assistant + 1:]]
+        if any(content.strip() != query_text.strip() for content in pending):
+            return None
+
+        return ContextReuse(
+            endpoint=context.endpoint,
+            model_name=context.model_name,
+            tokens=context.tokens,
+            delta_prompt=delta_prompt
+        )
+
+    def forget(self, conversation_id: int) -> None:
+        self._contexts.pop(conversation_id, None)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "conversations": len(self._contexts),
+            "tokens": sum(len(context.tokens) for context in self._contexts.values())
+        }
+
+
+# 创建全局Ollama会话上下文缓存实例
+ollama_context_store = OllamaContextStore()
@@ -0,0 +1,437 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import heapq
+import time
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.monitoring import (
+    AI_GROUNDING_INDEXED_STUDENTS,
+    AI_GROUNDING_LOOKUPS,
+    AI_GROUNDING_RETRIEVAL_SECONDS,
+    AI_GROUNDING_TOKENS,
+    AI_GROUNDING_TOKENS_SAVED
+)
+from app.models.quant_item import QuantItem
+from app.models.quant_item_category import QuantItemCategory
+from app.models.quant_record import QuantRecord
+from app.models.student import Student
+from app.services.context_builder import estimate_tokens, truncate_to_tokens
+from app.services.keyed_lock import KeyedLock
+
+logger = get_logger(__name__)
+
+# 问题中出现这些词时认为在询问自己的量化情况
+_TOPIC_WORDS = ("量化", "分数", "得分", "积分", "扣分", "加分", "减分", "排名", "名次", "总分", "表现", "记录", "扣了", "加了")
+_LAST_WEEK_WORDS = ("上周", "上一周", "上星期", "上个星期")
+_THIS_MONTH_WORDS = ("本月", "这个月", "这月")
+_MINUS_WORDS = ("扣分", "减分", "扣了", "被扣", "下降", "退步")
+_PLUS_WORDS = ("加分", "加了", "上升", "进步", "奖励")
+
+# 项目描述在提示中保留的字符数
+_DESCRIPTION_CHARS = 40
+
+_HEADER = "以下是该学生本人的量化数据（由系统统计，截至{today}）："
+_FOOTER = "回答涉及量化情况时请以上述数据为准，不要编造数据；数据中没有的信息请如实说明。"
+
+
+def _week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def _format_score(score: float) -> str:
+    return f"{score:+.1f}"
+
+
+@dataclass
+class _ItemInfo:
+    name: str
+    description: str
+    category: str
+
+
+class _Record:
+    __slots__ = ("item_id", "score", "record_date", "reason", "tokens")
+
+    def __init__(self, item_id: int, score: float, record_date: date, reason: str, tokens: int):
+        self.item_id = item_id
+        self.score = score
+        self.record_date = record_date
+        self.reason = reason
+        # 逐条列出该记录时的token数，用于估算节省的提示长度
+        self.tokens = tokens
+
+
+class _Aggregate:
+    __slots__ = ("total", "count", "plus", "minus", "last_date")
+
+    def __init__(self):
+        self.total = 0.0
+        self.count = 0
+        self.plus = 0.0
+        self.minus = 0.0
+        self.last_date: Optional[date] = None
+
+    def add(self, score: float, record_date: date, sign: int) -> None:
+        self.total += sign * score
+        self.count += sign
+        if score >= 0:
+            self.plus += sign * score
+        else:
+            self.minus += sign * score
+        if sign > 0 and (self.last_date is None or record_date > self.last_date):
+            self.last_date = record_date
+
+
+class _StudentIndex:
+    """
+    单个学生的量化数据索引
+
+    保存每条记录对分数的贡献，新增、修改的记录先减去旧值再加上新值，
+    按项目、周、月维护累计分数和次数，回答时直接读取，不再逐条统计。
+    """
+
+    def __init__(self, student_id: int):
+        self.student_id = student_id
+        self.full_name = ""
+        self.total_score: Optional[float] = None
+        self.rank: Optional[int] = None
+        self.records: Dict[int, _Record] = {}
+        self.items: Dict[int, _Aggregate] = {}
+        self.weeks: Dict[date, _Aggregate] = {}
+        self.months: Dict[Tuple[int, int], _Aggregate] = {}
+        # 已加载记录的最大更新时间，之后只查询更新时间不早于它的记录
+        self.watermark: Optional[datetime] = None
+        self.full_tokens = 0
+        self.checked_at = 0.0
+
+    def _apply(self, record: _Record, sign: int) -> None:
+        self.items.setdefault(record.item_id, _Aggregate()).add(record.score, record.record_date, sign)
+        self.weeks.setdefault(_week_start(record.record_date), _Aggregate()).add(record.score, record.record_date, sign)
+        month = (record.record_date.year, record.record_date.month)
+        self.months.setdefault(month, _Aggregate()).add(record.score, record.record_date, sign)
+        self.full_tokens += sign * record.tokens
+
+    def upsert(self, record_id: int, record: _Record) -> None:
+        previous = self.records.pop(record_id, None)
+        if previous is not None:
+            self._apply(previous, -1)
+            aggregate = self.items[previous.item_id]
+            if not aggregate.count:
+                del self.items[previous.item_id]
+            elif aggregate.last_date == previous.record_date:
+                aggregate.last_date = max(
+                    other.record_date for other in self.records.values() if other.item_id == previous.item_id
+                )
+        self.records[record_id] = record
+        self._apply(record, 1)
+
+    def recent(self, limit: int) -> List[_Record]:
+        return [
+            self.records[record_id]
+            for record_id in heapq.nlargest(
+                limit, self.records, key=lambda record_id: (self.records[record_id].record_date, record_id)
+            )
+        ]
+
+
+class QuantInsightService:
+    """
+    学生量化数据检索
+
+    学生向AI助手询问自己的量化情况时，从学生本人的量化记录中选取与问题相关的统计结果
+    （本周/上周/本月累计、相关项目的累计和最近记录等）加入提示，而不是把全部记录交给模型。
+
+    每个学生的统计结果缓存在进程内，按用户ID索引，只包含该用户本人对应学生的数据，
+    不接受调用方指定学生，因此不会把其他学生的数据放入提示。
+    索引首次访问时全量加载，之后至多每 AI_GROUNDING_REFRESH_INTERVAL 秒增量刷新一次：
+    只查询更新时间不早于上次加载的记录，记录数不一致（有记录被删除）时全量重建。
+    """
+
+    def __init__(self):
+        self._indexes: "OrderedDict[int, _StudentIndex]" = OrderedDict()
+        self._locks = KeyedLock("quant_insights")
+        self._catalog: Dict[int, _ItemInfo] = {}
+        self._catalog_loaded_at = 0.0
+        self._catalog_lock = asyncio.Lock()
+
+    async def _load_catalog(self, db: AsyncSession) -> Dict[int, _ItemInfo]:
+        """加载量化项目名称、描述和分类，超过 CACHE_TIMEOUT 秒后重新加载"""
+        if time.monotonic() - self._catalog_loaded_at <= settings.CACHE_TIMEOUT:
+            return self._catalog
+        async with self._catalog_lock:
+            if time.monotonic() - self._catalog_loaded_at <= settings.CACHE_TIMEOUT:
+                return self._catalog
+            result = await db.execute(
+                select(
+                    QuantItem.id,
+                    QuantItem.name,
+                    QuantItem.description,
+                    QuantItem.category,
+                    QuantItemCategory.name.label("category_name")
+                ).outerjoin(QuantItemCategory, QuantItem.category_id == QuantItemCategory.id)
+            )
+            self._catalog = {
+                row.id: _ItemInfo(
+                    name=row.name,
+                    description=(row.description or "").strip(),
+                    category=row.category_name or row.category or ""
+                )
+                for row in result.all()
+            }
+            self._catalog_loaded_at = time.monotonic()
+            return self._catalog
+
+    def _item_name(self, item_id: int) -> str:
+        info = self._catalog.get(item_id)
+        return info.name if info else f"项目{item_id}"
+
+    def _to_record(self, row) -> _Record:
+        score = float(row.score)
+        reason = (row.reason or "").strip()
+        line = f"{row.record_date.isoformat()} {self._item_name(row.item_id)} {_format_score(score)} {reason}"
+        return _Record(row.item_id, score, row.record_date, reason, estimate_tokens(line))
+
+    async def _load_records(self, db: AsyncSession, index: _StudentIndex, since: Optional[datetime]) -> None:
+        query = select(
+            QuantRecord.id,
+            QuantRecord.item_id,
+            QuantRecord.score,
+            QuantRecord.reason,
+            QuantRecord.record_date,
+            QuantRecord.updated_at
+        ).where(QuantRecord.student_id == index.student_id)
+        if since is not None:
+            # 更新时间精度为秒，同一秒内的修改可能已部分加载，重复加载的记录按ID覆盖
+            query = query.where(QuantRecord.updated_at >= since)
+        result = await db.execute(query)
+        for row in result.all():
+            index.upsert(row.id, self._to_record(row))
+            if index.watermark is None or row.updated_at > index.watermark:
+                index.watermark = row.updated_at
+
+    async def _refresh(self, db: AsyncSession, user_id: int, index: Optional[_StudentIndex]) -> Tuple[Optional[_StudentIndex], str]:
+        """
+        刷新用户对应学生的索引，返回 (索引, 来源)
+
+        用户没有对应的在读学生时返回 (None, 来源)。
+        """
+        await self._load_catalog(db)
+        student = (await db.execute(
+            select(Student.id, Student.full_name, Student.total_score, Student.rank)
+            .where(Student.user_id == user_id, Student.is_active == True)  # noqa: E712
+        )).first()
+        if student is None:
+            self._drop(user_id)
+            return None, "refresh"
+
+        source = "refresh"
+        if index is None or index.student_id != student.id:
+            index = _StudentIndex(student.id)
+            await self._load_records(db, index, None)
+            source = "rebuild"
+        else:
+            count, latest = (await db.execute(
+                select(func.count(QuantRecord.id), func.max(QuantRecord.updated_at))
+                .where(QuantRecord.student_id == index.student_id)
+            )).one()
+            if latest is not None and (
+                index.watermark is None or latest > index.watermark or count != len(index.records)
+            ):
+                await self._load_records(db, index, index.watermark)
+            if len(index.records) != count:
+                index = _StudentIndex(student.id)
+                await self._load_records(db, index, None)
+                source = "rebuild"
+
+        index.full_name = student.full_name
+        index.total_score = student.total_score
+        index.rank = student.rank
+        index.checked_at = time.monotonic()
+        self._indexes[user_id] = index
+        self._indexes.move_to_end(user_id)
+        while len(self._indexes) > settings.AI_GROUNDING_MAX_STUDENTS:
+            self._indexes.popitem(last=False)
+        AI_GROUNDING_INDEXED_STUDENTS.set(len(self._indexes))
+        return index, source
+
+    async def _get_index(self, db: AsyncSession, user_id: int) -> Tuple[Optional[_StudentIndex], str]:
+        index = self._indexes.get(user_id)
+        if index is not None and time.monotonic() - index.checked_at <= settings.AI_GROUNDING_REFRESH_INTERVAL:
+            self._indexes.move_to_end(user_id)
+            return index, "cache"
+        async with await self._locks.acquire(user_id):
+            # 等待期间其他请求可能已刷新
+            index = self._indexes.get(user_id)
+            if index is not None and time.monotonic() - index.checked_at <= settings.AI_GROUNDING_REFRESH_INTERVAL:
+                return index, "cache"
+            return await self._refresh(db, user_id, index)
+
+    @staticmethod
+    def _is_relevant(query: str, matched_items: List[int]) -> bool:
+        return bool(matched_items) or any(word in query for word in _TOPIC_WORDS)
+
+    def _match_items(self, query: str, index: _StudentIndex) -> List[int]:
+        """问题中提到名称或分类的项目，只保留该学生有记录的项目"""
+        return [
+            item_id for item_id in index.items
+            if item_id in self._catalog and (
+                self._catalog[item_id].name in query
+                or (self._catalog[item_id].category and self._catalog[item_id].category in query)
+            )
+        ]
+
+    def _item_line(self, item_id: int, aggregate: _Aggregate, with_description: bool) -> str:
+        info = self._catalog.get(item_id)
+        name = info.name if info else f"项目{item_id}"
+        category = f"（{info.category}）" if info and info.category else ""
+        line = f"- {name}{category}：累计{_format_score(aggregate.total)}，共{aggregate.count}次"
+        if aggregate.last_date is not None:
+            line += f"，最近一次{aggregate.last_date.isoformat()}"
+        if with_description and info and info.description:
+            line += f"；项目说明：{info.description[:_DESCRIPTION_CHARS]}"
+        return line
+
+    @staticmethod
+    def _period_line(label: str, aggregate: Optional[_Aggregate]) -> str:
+        if aggregate is None or not aggregate.count:
+            return f"- {label}：没有记录"
+        return (
+            f"- {label}：合计{_format_score(aggregate.total)}，共{aggregate.count}条"
+            f"（加分{aggregate.plus:.1f}，扣分{abs(aggregate.minus):.1f}）"
+        )
+
+    def _render(self, query: str, index: _StudentIndex, matched_items: List[int], today: date) -> str:
+        lines = [_HEADER.format(today=today.isoformat())]
+        summary = f"- 姓名：{index.full_name}"
+        if index.total_score is not None:
+            summary += f"，总分：{index.total_score:.1f}"
+        if index.rank is not None:
+            summary += f"，班级排名：第{index.rank}名"
+        summary += f"，量化记录共{len(index.records)}条"
+        lines.append(summary)
+
+        this_week = _week_start(today)
+        wants_last_week = any(word in query for word in _LAST_WEEK_WORDS)
+        wants_month = any(word in query for word in _THIS_MONTH_WORDS)
+        lines.append(self._period_line(f"本周（{this_week.isoformat()}起）", index.weeks.get(this_week)))
+        if wants_last_week:
+            last_week = this_week - timedelta(days=7)
+            lines.append(self._period_line(f"上周（{last_week.isoformat()}起）", index.weeks.get(last_week)))
+        if wants_month:
+            lines.append(self._period_line(f"本月（{today.month}月）", index.months.get((today.year, today.month))))
+
+        if matched_items:
+            item_ids = matched_items
+        else:
+            # 未提到具体项目时列出累计分数变化最大的项目，询问扣分或加分时只看对应方向
+            candidates = list(index.items.items())
+            if any(word in query for word in _MINUS_WORDS):
+                candidates = [(item_id, agg) for item_id, agg in candidates if agg.minus < 0]
+                key = lambda pair: pair[1].minus
+                reverse = False
+            elif any(word in query for word in _PLUS_WORDS):
+                candidates = [(item_id, agg) for item_id, agg in candidates if agg.plus > 0]
+                key = lambda pair: pair[1].plus
+                reverse = True
+            else:
+                key = lambda pair: abs(pair[1].total)
+                reverse = True
+            candidates.sort(key=key, reverse=reverse)
+            item_ids = [item_id for item_id, _ in candidates[:settings.AI_GROUNDING_MAX_ITEMS]]
+        if item_ids:
+            lines.append("相关项目：")
+            lines.extend(self._item_line(item_id, index.items[item_id], bool(matched_items)) for item_id in item_ids)
+
+        recent = index.recent(settings.AI_GROUNDING_RECENT_RECORDS)
+        if matched_items:
+            wanted = set(matched_items)
+            recent = [
+                record for record in index.recent(len(index.records))
+                if record.item_id in wanted
+            ][:settings.AI_GROUNDING_RECENT_RECORDS]
+        if recent:
+            lines.append("最近记录：")
+            for record in recent:
+                reason = f"（{record.reason[:_DESCRIPTION_CHARS]}）" if record.reason else ""
+                lines.append(
+                    f"- {record.record_date.isoformat()} {self._item_name(record.item_id)} "
+                    f"{_format_score(record.score)}{reason}"
+                )
+
+        budget = max(settings.AI_GROUNDING_MAX_TOKENS - estimate_tokens(_FOOTER), 0)
+        return truncate_to_tokens("\n".join(lines), budget) + "\n" + _FOOTER
+
+    async def retrieve(self, db: AsyncSession, user_id: int, query_text: str) -> Optional[str]:
+        """
+        返回加入提示的量化数据，问题与量化情况无关或用户不是学生时返回None
+
+        检索失败不影响回答，只记录日志并返回None。
+        """
+        if not settings.AI_GROUNDING_ENABLED or not query_text:
+            return None
+        query = query_text.strip()
+        begin = time.monotonic()
+        try:
+            # 先用固定关键词粗筛，避免与量化无关的问题访问数据库
+            if not any(word in query for word in _TOPIC_WORDS) and not self._catalog_mentions(query):
+                AI_GROUNDING_LOOKUPS.labels(result="irrelevant").inc()
+                return None
+
+            index, source = await self._get_index(db, user_id)
+            if index is None:
+                AI_GROUNDING_LOOKUPS.labels(result="no_student").inc()
+                return None
+            matched_items = self._match_items(query, index)
+            if not self._is_relevant(query, matched_items):
+                AI_GROUNDING_LOOKUPS.labels(result="irrelevant").inc()
+                return None
+
+            text = self._render(query, index, matched_items, date.today())
+        except Exception as e:
+            AI_GROUNDING_LOOKUPS.labels(result="error").inc()
+            logger.warning(f"检索学生量化数据失败: user_id={user_id}, error={e}")
+            return None
+
+        AI_GROUNDING_RETRIEVAL_SECONDS.labels(source=source).observe(time.monotonic() - begin)
+        AI_GROUNDING_LOOKUPS.labels(result="grounded").inc()
+        injected = estimate_tokens(text)
+        AI_GROUNDING_TOKENS.labels(kind="injected").observe(injected)
+        AI_GROUNDING_TOKENS.labels(kind="full").observe(index.full_tokens)
+        AI_GROUNDING_TOKENS_SAVED.inc(max(index.full_tokens - injected, 0))
+        return text
+
+    def _catalog_mentions(self, query: str) -> bool:
+        """问题是否提到已加载的项目名称或分类，目录尚未加载时返回True交给后续判断"""
+        if not self._catalog_loaded_at:
+            return True
+        return any(
+            info.name in query or (info.category and info.category in query)
+            for info in self._catalog.values()
+        )
+
+    def _drop(self, user_id: int) -> None:
+        if self._indexes.pop(user_id, None) is not None:
+            AI_GROUNDING_INDEXED_STUDENTS.set(len(self._indexes))
+
+    def mark_stale(self, student_id: Optional[int] = None) -> None:
+        """量化记录变更后调用，该学生的索引在下次访问时刷新；不指定学生时刷新全部"""
+        for index in self._indexes.values():
+            if student_id is None or index.student_id == student_id:
+                index.checked_at = 0.0
+
+    def invalidate(self) -> None:
+        """清空全部索引和项目目录"""
+        self._indexes.clear()
+        self._catalog_loaded_at = 0.0
+        AI_GROUNDING_INDEXED_STUDENTS.set(0)
+
+
+# 创建全局学生量化数据检索实例
+quant_insights = QuantInsightService()
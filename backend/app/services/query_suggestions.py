@@ -0,0 +1,252 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+import asyncio
+import heapq
+import itertools
+import time
+
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.monitoring import AI_SUGGESTION_INDEXED_QUERIES, AI_SUGGESTION_SECONDS
+from app.db.session import async_session
+from app.models.ai_conversation import AIConversation, AIMessage
+
+logger = get_logger(__name__)
+
+# 节点缓存的候选数为返回数的倍数，合并用户和全局结果去重后仍能凑满
+_CANDIDATE_FACTOR = 2
+
+
+def _normalize(text: str) -> str:
+    """合并空白，便于按前缀匹配"""
+    return " ".join(text.split())
+
+
+class _Query:
+    __slots__ = ("text", "count", "seq", "users")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.count = 0
+        # 最近一次提问的序号，次数相同时优先推荐最近问过的
+        self.seq = 0
+        # 问过该问题的用户，只在全局索引中记录，达到 AI_SUGGESTION_MIN_USERS 个后不再增加
+        self.users: Optional[Set[int]] = None
+
+
+class _TrieNode:
+    __slots__ = ("children", "terminal", "top", "top_size")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        # 在此结束的问题键
+        self.terminal: Optional[str] = None
+        # 子树中排名靠前的问题键，子树中的问题变化时置为None，下次查询时重新计算
+        self.top: Optional[List[str]] = None
+        # 计算 top 时请求的数量，子树中的问题不足时 top 比它短
+        self.top_size = 0
+
+
+class _PrefixIndex:
+    """
+    有容量上限的前缀树
+
+    每个节点缓存子树中提问次数最多的问题，查询时只需沿前缀走到对应节点；
+    新增或淘汰问题时只清除路径上节点的缓存，下次查询该前缀时重新统计子树。
+    超过容量时淘汰最久未被提问的问题。
+    """
+
+    def __init__(self, max_queries_setting: str, min_users: int = 0):
+        self._max_queries_setting = max_queries_setting
+        self._min_users = min_users
+        self.queries: "OrderedDict[str, _Query]" = OrderedDict()
+        self.root = _TrieNode()
+
+    def _eligible(self, query: _Query) -> bool:
+        return not self._min_users or len(query.users) >= self._min_users
+
+    def _path(self, key: str, create: bool = False) -> List[_TrieNode]:
+        """返回从根到键对应节点的路径，节点不存在且 create 为False时返回不完整的路径"""
+        node = self.root
+        path = [node]
+        for char in key:
+            child = node.children.get(char)
+            if child is None:
+                if not create:
+                    break
+                child = node.children[char] = _TrieNode()
+            node = child
+            path.append(node)
+        return path
+
+    @staticmethod
+    def _invalidate(path: List[_TrieNode]) -> None:
+        for node in path:
+            node.top = None
+
+    def add(self, key: str, text: str, seq: int, user_id: Optional[int] = None) -> None:
+        query = self.queries.get(key)
+        if query is None:
+            query = self.queries[key] = _Query(text)
+            if self._min_users:
+                query.users = set()
+            path = self._path(key, create=True)
+            path[-1].terminal = key
+        else:
+            path = self._path(key)
+            # 展示最近一次的写法
+            query.text = text
+        query.count += 1
+        query.seq = seq
+        if query.users is not None and user_id is not None and len(query.users) < self._min_users:
+            query.users.add(user_id)
+        self.queries.move_to_end(key)
+        self._invalidate(path)
+
+        while len(self.queries) > getattr(settings, self._max_queries_setting):
+            oldest, _ = self.queries.popitem(last=False)
+            self._remove_path(oldest)
+
+    def _remove_path(self, key: str) -> None:
+        path = self._path(key)
+        if len(path) != len(key) + 1:
+            return
+        path[-1].terminal = None
+        self._invalidate(path)
+        # 自下而上删除不再有问题的节点
+        for depth in range(len(key), 0, -1):
+            node = path[depth]
+            if node.children or node.terminal is not None:
+                break
+            del path[depth - 1].children[key[depth - 1]]
+
+    def _rank(self, node: _TrieNode, size: int) -> List[str]:
+        keys = []
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current.terminal is not None and self._eligible(self.queries[current.terminal]):
+                keys.append(current.terminal)
+            stack.extend(current.children.values())
+        return heapq.nlargest(size, keys, key=lambda key: (self.queries[key].count, self.queries[key].seq))
+
+    def search(self, prefix: str, size: int) -> List[_Query]:
+        path = self._path(prefix)
+        if len(path) != len(prefix) + 1:
+            return []
+        node = path[-1]
+        if node.top is None or node.top_size < size:
+            node.top = self._rank(node, size)
+            node.top_size = size
+        return [self.queries[key] for key in node.top[:size]]
+
+
+class QuerySuggestionService:
+    """
+    AI助手输入联想
+
+    在内存中为每个用户维护问过的问题的前缀树，同时维护所有用户的热门问题，
+    用户输入时先推荐自己问过的问题，不足时补充热门问题，查询不访问数据库。
+    热门问题至少有 AI_SUGGESTION_MIN_USERS 个不同用户问过才会推荐给其他用户，
+    避免把个别用户的提问展示给别人。
+
+    用户发送消息后调用 record 更新索引；索引只在本进程内，
+    启动时从最近的用户消息加载，多进程部署时各进程分别加载和更新。
+    """
+
+    def __init__(self):
+        self._users: "OrderedDict[int, _PrefixIndex]" = OrderedDict()
+        self._global = _PrefixIndex("AI_SUGGESTION_GLOBAL_MAX_QUERIES", settings.AI_SUGGESTION_MIN_USERS)
+        self._seq = itertools.count(1)
+        self._warmup_task: Optional[asyncio.Task] = None
+
+    def _update_gauges(self) -> None:
+        AI_SUGGESTION_INDEXED_QUERIES.labels(scope="user").set(
+            sum(len(index.queries) for index in self._users.values())
+        )
+        AI_SUGGESTION_INDEXED_QUERIES.labels(scope="global").set(len(self._global.queries))
+
+    def record(self, user_id: int, text: Optional[str], update_gauges: bool = True) -> None:
+        """记录用户的提问，过长或多行的内容不作为建议"""
+        if not text or "\n" in text.strip():
+            return
+        display = _normalize(text)
+        if not display or len(display) > settings.AI_SUGGESTION_MAX_QUERY_CHARS:
+            return
+        key = display.lower()
+        seq = next(self._seq)
+
+        index = self._users.get(user_id)
+        if index is None:
+            index = self._users[user_id] = _PrefixIndex("AI_SUGGESTION_USER_MAX_QUERIES")
+        self._users.move_to_end(user_id)
+        while len(self._users) > settings.AI_SUGGESTION_MAX_USERS:
+            self._users.popitem(last=False)
+        index.add(key, display, seq)
+        self._global.add(key, display, seq, user_id)
+        if update_gauges:
+            self._update_gauges()
+
+    def suggest(self, user_id: int, prefix: str, limit: Optional[int] = None) -> List[str]:
+        """按前缀返回建议，自己问过的问题在前"""
+        begin = time.perf_counter()
+        limit = limit or settings.AI_SUGGESTION_LIMIT
+        key = _normalize(prefix).lower()
+        if not key:
+            return []
+
+        size = limit * _CANDIDATE_FACTOR
+        suggestions: List[str] = []
+        seen = set()
+        index = self._users.get(user_id)
+        for source in ((index,) if index is not None else ()) + (self._global,):
+            for query in source.search(key, size):
+                query_key = query.text.lower()
+                if query_key in seen:
+                    continue
+                seen.add(query_key)
+                suggestions.append(query.text)
+                if len(suggestions) >= limit:
+                    break
+            if len(suggestions) >= limit:
+                break
+
+        AI_SUGGESTION_SECONDS.observe(time.perf_counter() - begin)
+        return suggestions
+
+    async def _warm_up(self) -> None:
+        """从最近的用户消息加载索引"""
+        try:
+            async with async_session() as db:
+                result = await db.execute(
+                    select(AIMessage.content, AIConversation.user_id)
+                    .join(AIConversation, AIConversation.id == AIMessage.conversation_id)
+                    .where(AIMessage.role == "user")
+                    .order_by(AIMessage.id.desc())
+                    .limit(settings.AI_SUGGESTION_WARMUP_MESSAGES)
+                )
+                rows = result.all()
+            # 按时间顺序写入，较新的提问排在前面
+            for content, user_id in reversed(rows):
+                self.record(user_id, content, update_gauges=False)
+            self._update_gauges()
+            logger.info(f"已加载输入联想索引: messages={len(rows)}, users={len(self._users)}")
+        except Exception as e:
+            logger.warning(f"加载输入联想索引失败: {e}")
+
+    def start(self) -> None:
+        """在后台加载索引，应用启动时调用"""
+        if settings.AI_SUGGESTION_WARMUP_MESSAGES > 0 and self._warmup_task is None:
+            self._warmup_task = asyncio.create_task(self._warm_up())
+
+    async def stop(self) -> None:
+        task, self._warmup_task = self._warmup_task, None
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+
+# 创建全局输入联想服务实例
+query_suggestions = QuerySuggestionService()
@@ -0,0 +1,181 @@
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import json
+import time
+
+from fastapi.encoders import jsonable_encoder
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.monitoring import (
+    REQUEST_DEDUPE_BACKEND_ERRORS,
+    REQUEST_DEDUPE_ENTRIES,
+    REQUEST_DEDUPE_EVICTIONS,
+    REQUEST_DEDUPE_LOOKUPS
+)
+from app.db.redis import get_redis
+
+logger = get_logger(__name__)
+
+# 已登记但尚未完成的请求在Redis中保存的值
+_PENDING = ""
+
+# 查询结果
+RESULT_HIT = "hit"
+RESULT_PENDING = "pending"
+RESULT_MISS = "miss"
+
+
+class DedupeStore:
+    """
+    带过期时间的重复请求记录
+
+    以键保存请求的响应，过期时间内相同键的请求直接返回保存的响应。
+    claim 先登记处理中的请求，同时到达的重复请求可以得知已有请求在处理（pending），
+    完成后 put 保存响应，失败时 discard 删除登记，之后的重复请求重新处理。
+
+    配置 REDIS_URL 时记录保存在Redis中（SET NX EX），多个进程共享；否则保存在进程内。
+    进程内的记录按过期时间顺序保存在 OrderedDict 中，所有记录的有效期相同，
+    写入时移到末尾即保持顺序，过期记录从头部依次删除；记录数超过 AI_MESSAGE_DEDUPE_MAX_ENTRIES 时淘汰最早的。
+    Redis出错时回退到进程内记录。
+    """
+
+    def __init__(self, name: str, ttl_setting: str):
+        self.name = name
+        # 有效期读取的配置项，便于运行时调整
+        self._ttl_setting = ttl_setting
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    @property
+    def ttl(self) -> int:
+        return getattr(settings, self._ttl_setting)
+
+    def _redis_key(self, key: str) -> str:
+        return f"dedupe:{self.name}:{key}"
+
+    def _backend_error(self, action: str, error: Exception) -> None:
+        REQUEST_DEDUPE_BACKEND_ERRORS.labels(store=self.name).inc()
+        logger.warning(f"重复请求记录读写Redis失败，使用进程内记录: store={self.name}, action={action}, error={error}")
+
+    def _record(self, result: str) -> None:
+        REQUEST_DEDUPE_LOOKUPS.labels(store=self.name, result=result).inc()
+
+    def _update_gauge(self) -> None:
+        REQUEST_DEDUPE_ENTRIES.labels(store=self.name).set(len(self._entries))
+
+    def _purge(self) -> None:
+        now = time.monotonic()
+        while self._entries:
+            key = next(iter(self._entries))
+            if self._entries[key][0] > now:
+                break
+            del self._entries[key]
+            REQUEST_DEDUPE_EVICTIONS.labels(store=self.name, reason="expired").inc()
+
+    def _local_get(self, key: str) -> Tuple[bool, Any]:
+        self._purge()
+        self._update_gauge()
+        if key not in self._entries:
+            return False, None
+        return True, self._entries[key][1]
+
+    def _local_set(self, key: str, value: Any) -> None:
+        self._purge()
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > settings.AI_MESSAGE_DEDUPE_MAX_ENTRIES:
+            self._entries.popitem(last=False)
+            REQUEST_DEDUPE_EVICTIONS.labels(store=self.name, reason="capacity").inc()
+        self._update_gauge()
+
+    @staticmethod
+    def _encode(value: Any) -> str:
+        return json.dumps(jsonable_encoder(value), ensure_ascii=False)
+
+    async def claim(self, key: str) -> Tuple[bool, Optional[Any]]:
+        """
+        登记处理中的请求
+
+        返回 (True, None) 表示登记成功，由调用方处理请求；
+        返回 (False, 响应) 表示重复请求，响应为None时原请求仍在处理中。
+        """
+        redis = get_redis()
+        if redis is not None:
+            try:
+                if await redis.set(self._redis_key(key), _PENDING, nx=True, ex=self.ttl):
+                    self._record(RESULT_MISS)
+                    return True, None
+                raw = await redis.get(self._redis_key(key))
+                if raw is None:
+                    # 记录恰好过期，重新登记
+                    claimed = await redis.set(self._redis_key(key), _PENDING, nx=True, ex=self.ttl)
+                    if claimed:
+                        self._record(RESULT_MISS)
+                        return True, None
+                    raw = _PENDING
+                if raw == _PENDING:
+                    self._record(RESULT_PENDING)
+                    return False, None
+                self._record(RESULT_HIT)
+                return False, json.loads(raw)
+            except Exception as e:
+                self._backend_error("claim", e)
+
+        found, value = self._local_get(key)
+        if not found:
+            self._local_set(key, None)
+            self._record(RESULT_MISS)
+            return True, None
+        self._record(RESULT_HIT if value is not None else RESULT_PENDING)
+        return False, value
+
+    async def get(self, key: str) -> Optional[Any]:
+        """获取已保存的响应，没有或仍在处理中时返回None"""
+        redis = get_redis()
+        if redis is not None:
+            try:
+                raw = await redis.get(self._redis_key(key))
+                value = json.loads(raw) if raw else None
+                self._record(RESULT_HIT if value is not None else RESULT_MISS)
+                return value
+            except Exception as e:
+                self._backend_error("get", e)
+
+        _, value = self._local_get(key)
+        self._record(RESULT_HIT if value is not None else RESULT_MISS)
+        return value
+
+    async def put(self, key: str, value: Any) -> None:
+        """保存请求的响应"""
+        redis = get_redis()
+        if redis is not None:
+            try:
+                await redis.set(self._redis_key(key), self._encode(value), ex=self.ttl)
+                return
+            except Exception as e:
+                self._backend_error("put", e)
+        self._local_set(key, value)
+
+    async def discard(self, key: str) -> None:
+        """删除登记，请求失败时调用"""
+        redis = get_redis()
+        if redis is not None:
+            try:
+                await redis.delete(self._redis_key(key))
+            except Exception as e:
+                self._backend_error("discard", e)
+        if self._entries.pop(key, None) is not None:
+            self._update_gauge()
+
+    def get_stats(self) -> Dict[str, Any]:
+        self._purge()
+        self._update_gauge()
+        return {
+            "backend": "redis" if get_redis() is not None else "memory",
+            "entries": len(self._entries)
+        }
+
+
+# 创建全局重复请求记录实例：按客户端请求ID保存发送消息的响应，以及短时间内相同内容的消息
+message_requests = DedupeStore("message_request", "AI_MESSAGE_REQUEST_TTL")
+message_submissions = DedupeStore("message_submission", "AI_MESSAGE_DUPLICATE_WINDOW")
@@ -0,0 +1,324 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, List, Optional, Set, Tuple
+import asyncio
+import hashlib
+import json
+import re
+import time
+import unicodedata
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.monitoring import (
+    AI_RESPONSE_CACHE_ENTRIES,
+    AI_RESPONSE_CACHE_REQUESTS,
+    AI_RESPONSE_CACHE_SAVED_SECONDS
+)
+
+logger = get_logger(__name__)
+
+# 归一化时去掉的结尾标点（NFKC 之后全角标点已转为半角）
+_TRAILING_PUNCTUATION = "?!.,;:~。？！，；：、…"
+_WHITESPACE = re.compile(r"\s+")
+# 中文字符两侧的空白不影响语义
+_CJK_SPACING = re.compile(r"\s*([^\x00-\x7f])\s*")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+# 相似问题比较使用的字符 n-gram 长度，中文按字切分时二元组区分度较好
+_SHINGLE_SIZE = 2
+
+# 查询结果
+RESULT_HIT = "hit"
+RESULT_NEAR_HIT = "near_hit"
+RESULT_COALESCED = "coalesced"
+RESULT_MISS = "miss"
+
+
+def normalize_query(text: str) -> str:
+    """归一化问题文本：全角转半角、转小写、合并空白、去掉中文两侧空白和结尾标点"""
+    normalized = unicodedata.normalize("NFKC", text or "").lower()
+    normalized = _WHITESPACE.sub(" ", normalized).strip()
+    normalized = _CJK_SPACING.sub(r"\1", normalized)
+    return normalized.rstrip(_TRAILING_PUNCTUATION + " ")
+
+
+def _shingles(query: str) -> FrozenSet[str]:
+    compact = query.replace(" ", "")
+    if len(compact) <= _SHINGLE_SIZE:
+        return frozenset([compact])
+    return frozenset(compact[i:i + _SHINGLE_SIZE] for i in range(len(compact) - _SHINGLE_SIZE + 1))
+
+
+def _jaccard(left: FrozenSet[str], right: FrozenSet[str]) -> float:
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+
+@dataclass(frozen=True)
+class ResponseCacheKey:
+    """
+    缓存键
+
+    namespace 由后端、模型、模式和对话上下文的摘要组成，只有 namespace 相同的问题才会互相命中；
+    query 为归一化后的问题文本。
+    """
+    namespace: str
+    query: str
+
+
+@dataclass
+class GeneratedResponse:
+    """一次生成的结果，cacheable 为 False 时（如后端返回错误提示）不写入缓存"""
+    text: str
+    model_name: str
+    generation_time: float
+    cacheable: bool = True
+
+
+@dataclass
+class _CacheEntry:
+    response: GeneratedResponse
+    created_at: float
+    shingles: FrozenSet[str]
+    numbers: Tuple[str, ...]
+
+
+@dataclass
+class CachedResult:
+    """缓存查询结果，source 为 hit / near_hit / coalesced / miss"""
+    response: GeneratedResponse
+    source: str = RESULT_MISS
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+
+class ResponseCache:
+    """
+    AI助手响应缓存
+
+    同一班级的学生常在短时间内问同样的问题，缓存按（后端、模型、模式、对话上下文、归一化问题）
+    复用已生成的回答，条目超过 AI_RESPONSE_CACHE_TTL 秒过期，总数超过 AI_RESPONSE_CACHE_MAX_ENTRIES
+    时淘汰最久未使用的。开启 AI_RESPONSE_CACHE_NEAR_DUPLICATE 后，同一 namespace 内字符二元组
+    Jaccard 相似度不低于 AI_RESPONSE_CACHE_SIMILARITY 且数字完全相同的问题也视为命中。
+    相同问题的并发请求只生成一次，其余请求等待进行中的生成结果。
+    """
+
+    def __init__(self):
+        self._entries: "OrderedDict[ResponseCacheKey, _CacheEntry]" = OrderedDict()
+        self._namespaces: Dict[str, Set[ResponseCacheKey]] = {}
+        self._inflight: Dict[ResponseCacheKey, asyncio.Future] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return settings.AI_RESPONSE_CACHE_ENABLED and settings.AI_RESPONSE_CACHE_MAX_ENTRIES > 0
+
+    def build_key(
+        self,
+        backend: str,
+        model_name: str,
+        mode: str,
+        query_text: str,
+        messages: List[Dict[str, Any]],
+        grounding: Optional[str] = None,
+        summary: Optional[str] = None
+    ) -> ResponseCacheKey:
+        """
+        构建缓存键，messages 为实际放入提示的对话历史
+
+        grounding 为提示中的参考数据（如学生本人的量化统计），参考数据不同的问题不会互相命中；
+        summary 为会话较早内容的摘要，最近几轮相同但更早的对话不同的会话不会互相命中。
+        """
+        history = [(msg.get("role"), normalize_query(msg.get("content", ""))) for msg in messages]
+        history_digest = hashlib.sha256(
+            json.dumps([history, grounding or "", summary or ""], ensure_ascii=False).encode("utf-8")
+        ).hexdigest()[:16]
+        return ResponseCacheKey(
+            namespace=f"{backend}:{model_name or ''}:{mode}:{history_digest}",
+            query=normalize_query(query_text)
+        )
+
+    def _remove(self, key: ResponseCacheKey) -> None:
+        self._entries.pop(key, None)
+        keys = self._namespaces.get(key.namespace)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._namespaces[key.namespace]
+
+    def _is_expired(self, entry: _CacheEntry, now: float) -> bool:
+        return now - entry.created_at > settings.AI_RESPONSE_CACHE_TTL
+
+    def _find_near_duplicate(self, key: ResponseCacheKey, now: float) -> Optional[Tuple[ResponseCacheKey, float]]:
+        shingles = _shingles(key.query)
+        numbers = tuple(_NUMBER.findall(key.query))
+        best: Optional[Tuple[ResponseCacheKey, float]] = None
+        for candidate in list(self._namespaces.get(key.namespace, ())):
+            entry = self._entries[candidate]
+            if self._is_expired(entry, now):
+                self._remove(candidate)
+                continue
+            # 数字不同的题目（如不同的方程系数）即使文字相似也不能复用答案
+            if entry.numbers != numbers:
+                continue
+            similarity = _jaccard(shingles, entry.shingles)
+            if similarity >= settings.AI_RESPONSE_CACHE_SIMILARITY and (best is None or similarity > best[1]):
+                best = (candidate, similarity)
+        return best
+
+    def lookup(self, key: ResponseCacheKey) -> Optional[CachedResult]:
+        """查找缓存的回答，未命中返回None"""
+        if not self.enabled:
+            return None
+
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if not self._is_expired(entry, now):
+                self._entries.move_to_end(key)
+                return CachedResult(entry.response, RESULT_HIT)
+            self._remove(key)
+
+        if settings.AI_RESPONSE_CACHE_NEAR_DUPLICATE:
+            match = self._find_near_duplicate(key, now)
+            if match is not None:
+                matched_key, similarity = match
+                self._entries.move_to_end(matched_key)
+                return CachedResult(
+                    self._entries[matched_key].response,
+                    RESULT_NEAR_HIT,
+                    {"similarity": round(similarity, 3)}
+                )
+        return None
+
+    def store(self, key: ResponseCacheKey, response: GeneratedResponse) -> None:
+        """写入可缓存的回答"""
+        if not self.enabled or not response.cacheable or not response.text:
+            return
+        self._remove(key)
+        self._entries[key] = _CacheEntry(
+            response=response,
+            created_at=time.monotonic(),
+            shingles=_shingles(key.query),
+            numbers=tuple(_NUMBER.findall(key.query))
+        )
+        self._namespaces.setdefault(key.namespace, set()).add(key)
+        while len(self._entries) > settings.AI_RESPONSE_CACHE_MAX_ENTRIES:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+        AI_RESPONSE_CACHE_ENTRIES.set(len(self._entries))
+
+    def begin(self, key: ResponseCacheKey) -> Optional[asyncio.Future]:
+        """
+        登记一次生成
+
+        没有相同问题正在生成时返回None，调用方负责生成并调用 finish 或 abandon；
+        否则返回进行中生成的 Future，调用方等待其结果。
+        """
+        future = self._inflight.get(key)
+        if future is not None and not future.done():
+            return future
+        self._inflight[key] = asyncio.get_running_loop().create_future()
+        return None
+
+    def finish(self, key: ResponseCacheKey, response: GeneratedResponse) -> None:
+        """
+        生成完成，写入缓存并唤醒等待的请求
+
+        不可缓存的回答（错误提示、中断的流式输出）不交给等待的请求，等待的请求各自重新生成。
+        """
+        if not response.cacheable:
+            self.abandon(key)
+            return
+        self.store(key, response)
+        future = self._inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(response)
+
+    def abandon(self, key: ResponseCacheKey, error: Optional[BaseException] = None) -> None:
+        """
+        生成未完成
+
+        error 为空（如请求被取消）时等待的请求各自重新生成；否则等待的请求收到同样的异常。
+        """
+        future = self._inflight.pop(key, None)
+        if future is None or future.done():
+            return
+        if error is None:
+            future.cancel()
+        else:
+            future.set_exception(error)
+            # 没有等待者时避免未读取异常的警告
+            future.exception()
+
+    def record(self, backend: str, result: CachedResult) -> None:
+        """记录命中和节省的生成时间"""
+        AI_RESPONSE_CACHE_REQUESTS.labels(backend=backend, result=result.source).inc()
+        AI_RESPONSE_CACHE_SAVED_SECONDS.labels(backend=backend).inc(result.response.generation_time)
+
+    async def acquire(self, key: ResponseCacheKey, backend: str) -> Optional[CachedResult]:
+        """
+        获取缓存的回答或等待进行中的相同生成
+
+        返回None表示未命中且没有进行中的生成，调用方负责生成并调用 finish 或 abandon。
+        进行中的生成被取消时重新查找。
+        """
+        if not self.enabled:
+            return None
+
+        while True:
+            cached = self.lookup(key)
+            if cached is not None:
+                self.record(backend, cached)
+                return cached
+
+            future = self.begin(key)
+            if future is None:
+                AI_RESPONSE_CACHE_REQUESTS.labels(backend=backend, result=RESULT_MISS).inc()
+                return None
+            try:
+                response = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    continue
+                raise
+            result = CachedResult(response, RESULT_COALESCED)
+            self.record(backend, result)
+            return result
+
+    async def get_or_generate(
+        self,
+        key: ResponseCacheKey,
+        backend: str,
+        generate: Callable[[], Awaitable[GeneratedResponse]]
+    ) -> CachedResult:
+        """返回缓存的回答，未命中时调用 generate 生成并写入缓存"""
+        cached = await self.acquire(key, backend)
+        if cached is not None:
+            return cached
+
+        try:
+            response = await generate()
+        except asyncio.CancelledError:
+            self.abandon(key)
+            raise
+        except Exception as e:
+            self.abandon(key, e)
+            raise
+        self.finish(key, response)
+        return CachedResult(response, RESULT_MISS)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._namespaces.clear()
+        AI_RESPONSE_CACHE_ENTRIES.set(0)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "namespaces": len(self._namespaces),
+            "inflight": len(self._inflight)
+        }
+
+
+# 创建全局AI助手响应缓存实例
+response_cache = ResponseCache()
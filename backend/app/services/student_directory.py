@@ -0,0 +1,216 @@
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import time
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.models.student import Student
+
+logger = get_logger(__name__)
+
+try:
+    from pypinyin import Style, lazy_pinyin
+except ImportError:  # pragma: no cover - 未安装时不提供拼音首字母检索
+    lazy_pinyin = None
+    logger.warning("未安装pypinyin，学生目录不支持拼音首字母检索")
+
+
+def pinyin_initials(name: str) -> str:
+    """获取姓名的拼音首字母（小写），非汉字字符原样保留"""
+    if lazy_pinyin is None or not name:
+        return ""
+    return "".join(lazy_pinyin(name, style=Style.FIRST_LETTER, errors="default")).lower()
+
+
+@dataclass
+class DirectoryEntry:
+    """学生目录条目，只保存输入联想需要的字段"""
+    id: int
+    student_id_no: str
+    full_name: str
+    class_id: int
+    is_active: bool
+    initials: str
+
+    @classmethod
+    def from_student(cls, student: Student) -> "DirectoryEntry":
+        return cls(
+            id=student.id,
+            student_id_no=student.student_id_no,
+            full_name=student.full_name,
+            class_id=student.class_id,
+            is_active=bool(student.is_active),
+            initials=pinyin_initials(student.full_name)
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "student_id_no": self.student_id_no,
+            "full_name": self.full_name,
+            "class_id": self.class_id,
+            "is_active": self.is_active
+        }
+
+
+class _ClassIndex:
+    """
+    单个班级的有序索引
+
+    学号、姓名、拼音首字母各维护一个按 (键, 学生ID) 排序的列表，
+    前缀查询通过二分定位起点后顺序扫描，复杂度为 O(log n + k)。
+    """
+
+    def __init__(self, loaded_at: float):
+        self.loaded_at = loaded_at
+        self.entries: Dict[int, DirectoryEntry] = {}
+        self.by_student_id_no: List[Tuple[str, int]] = []
+        self.by_full_name: List[Tuple[str, int]] = []
+        self.by_initials: List[Tuple[str, int]] = []
+
+    def _keys(self, entry: DirectoryEntry):
+        yield self.by_student_id_no, entry.student_id_no.lower()
+        yield self.by_full_name, entry.full_name.lower()
+        if entry.initials:
+            yield self.by_initials, entry.initials
+
+    def add(self, entry: DirectoryEntry) -> None:
+        self.remove(entry.id)
+        self.entries[entry.id] = entry
+        for keys, key in self._keys(entry):
+            insort(keys, (key, entry.id))
+
+    def remove(self, student_id: int) -> None:
+        entry = self.entries.pop(student_id, None)
+        if entry is None:
+            return
+        for keys, key in self._keys(entry):
+            position = bisect_left(keys, (key, entry.id))
+            if position < len(keys) and keys[position] == (key, entry.id):
+                del keys[position]
+
+    @staticmethod
+    def _prefix_ids(keys: List[Tuple[str, int]], prefix: str):
+        position = bisect_left(keys, (prefix, -1))
+        while position < len(keys) and keys[position][0].startswith(prefix):
+            yield keys[position][1]
+            position += 1
+
+    def search(self, prefix: str, limit: int, active_only: bool) -> List[DirectoryEntry]:
+        """按学号、姓名、拼音首字母的顺序返回前缀匹配的学生，去重"""
+        results: List[DirectoryEntry] = []
+        seen = set()
+        for keys in (self.by_student_id_no, self.by_full_name, self.by_initials):
+            for student_id in self._prefix_ids(keys, prefix):
+                if student_id in seen:
+                    continue
+                entry = self.entries[student_id]
+                if active_only and not entry.is_active:
+                    continue
+                seen.add(student_id)
+                results.append(entry)
+                if len(results) >= limit:
+                    return results
+        return results
+
+
+class StudentDirectoryService:
+    """
+    学生目录
+
+    按班级在内存中缓存学生的学号、姓名和拼音首字母索引，为录入表单的输入联想提供前缀查询。
+    班级索引在首次访问时从数据库懒加载，超过 CACHE_TIMEOUT 秒后重新加载，
+    以纠正多进程部署下其他进程的修改；本进程内的新增、修改、删除通过 on_saved / on_deleted 即时更新。
+    """
+
+    def __init__(self):
+        self._classes: Dict[int, _ClassIndex] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+    def _get_fresh(self, class_id: int) -> Optional[_ClassIndex]:
+        index = self._classes.get(class_id)
+        if index is None or time.monotonic() - index.loaded_at > settings.CACHE_TIMEOUT:
+            return None
+        return index
+
+    async def _load(self, db: AsyncSession, class_id: int) -> _ClassIndex:
+        """从数据库加载班级索引，同一班级的并发加载只执行一次"""
+        lock = self._locks.setdefault(class_id, asyncio.Lock())
+        async with lock:
+            index = self._get_fresh(class_id)
+            if index is not None:
+                return index
+
+            result = await db.execute(
+                select(
+                    Student.id,
+                    Student.student_id_no,
+                    Student.full_name,
+                    Student.class_id,
+                    Student.is_active
+                ).where(Student.class_id == class_id)
+            )
+            index = _ClassIndex(time.monotonic())
+            for row in result.all():
+                index.add(DirectoryEntry(
+                    id=row.id,
+                    student_id_no=row.student_id_no,
+                    full_name=row.full_name,
+                    class_id=row.class_id,
+                    is_active=bool(row.is_active),
+                    initials=pinyin_initials(row.full_name)
+                ))
+            self._classes[class_id] = index
+            return index
+
+    async def lookup(
+        self,
+        db: AsyncSession,
+        *,
+        class_id: int,
+        query: str,
+        limit: int = 10,
+        active_only: bool = True
+    ) -> List[DirectoryEntry]:
+        """在班级内按学号、姓名或拼音首字母前缀查找学生"""
+        prefix = query.strip().lower()
+        if not prefix:
+            return []
+
+        index = self._get_fresh(class_id)
+        if index is None:
+            index = await self._load(db, class_id)
+        return index.search(prefix, limit, active_only)
+
+    def on_saved(self, student: Student, previous_class_id: Optional[int] = None) -> None:
+        """学生创建或修改后更新已加载的班级索引，未加载的班级在下次访问时懒加载"""
+        if previous_class_id is not None and previous_class_id != student.class_id:
+            previous_index = self._classes.get(previous_class_id)
+            if previous_index is not None:
+                previous_index.remove(student.id)
+
+        index = self._classes.get(student.class_id)
+        if index is not None:
+            index.add(DirectoryEntry.from_student(student))
+
+    def on_deleted(self, student_id: int, class_id: Optional[int]) -> None:
+        """学生删除后从班级索引中移除"""
+        index = self._classes.get(class_id)
+        if index is not None:
+            index.remove(student_id)
+
+    def invalidate(self, class_id: Optional[int] = None) -> None:
+        """使缓存失效，不指定班级时清空全部缓存"""
+        if class_id is None:
+            self._classes.clear()
+        else:
+            self._classes.pop(class_id, None)
+
+
+# 创建全局学生目录服务实例
+student_directory = StudentDirectoryService()
@@ -0,0 +1,126 @@
+from typing import Dict, Iterable, Optional, Tuple
+import time
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.crud.notification import notification as notification_crud
+
+logger = get_logger(__name__)
+
+
+class UnreadCounterService:
+    """
+    通知未读数计数器
+
+    在内存中按用户缓存未读通知数量，首次访问时从收件箱索引懒加载，
+    缓存超过 CACHE_TIMEOUT 秒后重新加载，以纠正多进程部署下的偏差。
+    发送、已读、全部已读、删除时调整计数，计数变化时通过通知WebSocket推送给在线用户。
+    """
+
+    def __init__(self):
+        # user_id -> (未读数, 加载时间)
+        self._counts: Dict[int, Tuple[int, float]] = {}
+
+    def _get_cached(self, user_id: int) -> Optional[int]:
+        """获取未过期的缓存计数"""
+        cached = self._counts.get(user_id)
+        if cached is None:
+            return None
+        count, loaded_at = cached
+        if time.monotonic() - loaded_at > settings.CACHE_TIMEOUT:
+            return None
+        return count
+
+    def _set(self, user_id: int, count: int, loaded_at: Optional[float] = None) -> None:
+        self._counts[user_id] = (max(count, 0), loaded_at if loaded_at is not None else time.monotonic())
+
+    async def _load(self, db: AsyncSession, user_id: int) -> int:
+        """从数据库加载未读数并写入缓存"""
+        count = await notification_crud.count_unread(db, user_id=user_id)
+        self._set(user_id, count)
+        return count
+
+    async def get(self, db: AsyncSession, user_id: int) -> int:
+        """获取用户未读数，缓存缺失或过期时从数据库加载"""
+        count = self._get_cached(user_id)
+        if count is None:
+            count = await self._load(db, user_id)
+        return count
+
+    async def on_sent(self, db: AsyncSession, user_ids: Iterable[int], sent_at: float) -> None:
+        """
+        通知发送后调整已缓存接收者的计数，未缓存的用户在下次访问时懒加载
+
+        sent_at 为写入通知之前的 time.monotonic()。缓存未过期且在此之前加载时直接加一；
+        缓存已过期，或在写入期间加载（可能已包含这条通知）时从数据库重新统计，避免在过期的值上加一或重复计数。
+        """
+        for user_id in user_ids:
+            cached = self._counts.get(user_id)
+            if cached is None:
+                continue
+            count, loaded_at = cached
+            if self._get_cached(user_id) is not None and loaded_at < sent_at:
+                self._set(user_id, count + 1, loaded_at)
+                await self._push(user_id, count + 1)
+                continue
+            reloaded = await self._load(db, user_id)
+            if reloaded != count:
+                await self._push(user_id, reloaded)
+
+    async def on_read(self, db: AsyncSession, user_id: int) -> int:
+        """单条通知已读后重新统计，仅在计数变化时推送"""
+        previous = self._counts.get(user_id)
+        count = await self._load(db, user_id)
+        if previous is None or previous[0] != count:
+            await self._push(user_id, count)
+        return count
+
+    async def on_read_all(self, user_id: int, updated_count: int) -> None:
+        """全部已读后直接归零"""
+        previous = self._counts.get(user_id)
+        self._set(user_id, 0)
+        if updated_count > 0 or (previous is not None and previous[0] != 0):
+            await self._push(user_id, 0)
+
+    async def on_deleted(self, db: AsyncSession, user_ids: Iterable[int]) -> None:
+        """
+        通知删除后为已缓存的接收者重新统计，仅在计数变化时推送
+
+        user_ids 为删除前尚未阅读这些通知的接收者，未缓存的用户在下次访问时懒加载
+        """
+        for user_id in user_ids:
+            previous = self._counts.get(user_id)
+            if previous is None:
+                continue
+            count = await self._load(db, user_id)
+            if previous[0] != count:
+                await self._push(user_id, count)
+
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        """使缓存失效，不指定用户时清空全部缓存"""
+        if user_id is None:
+            self._counts.clear()
+        else:
+            self._counts.pop(user_id, None)
+
+    async def _push(self, user_id: int, count: int) -> None:
+        """通过通知WebSocket推送未读数"""
+        # 延迟导入，避免与连接管理器循环依赖
+        from app.websockets.connection import notification_manager
+
+        try:
+            await notification_manager.send_personal_message(
+                user_id,
+                {
+                    "type": "unread_count",
+                    "data": {"unread_count": count}
+                }
+            )
+        except Exception as e:
+            logger.error(f"推送未读数失败: user_id={user_id}, error={str(e)}")
+
+
+# 创建全局未读计数服务实例
+unread_counter = UnreadCounterService()
@@ -1,20 +1,148 @@
+import asyncio
+import hashlib
 import os
+import re
+import tempfile
 import uuid
 from datetime import datetime
-from typing import List, Optional, Union
+from typing import BinaryIO, List, NamedTuple, Optional, Tuple, Union
 from pathlib import Path
 
 from fastapi import UploadFile, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
+from app.core.monitoring import UPLOAD_STORAGE_BYTES
 from app.models.uploads import Upload
 from app.schemas.uploads import UploadCreate, Upload as UploadSchema
 from app.crud import uploads as crud_uploads
 
 
+# 去重存储目录，文件保存在 blobs/<随机名前2位>/<随机名><扩展名>
+_BLOB_DIR = "blobs"
+# 上传内容写完、计算出哈希之前的暂存目录，和存储目录在同一文件系统上以便原子移动
+_STAGING_DIR = f"{_BLOB_DIR}/.incoming"
+_SAFE_EXTENSION = re.compile(r"\.[a-z0-9]{1,10}")
+
+
+def _blob_path(filename: Optional[str]) -> str:
+    """
+    新存储文件的路径
+    
+    /uploads 静态目录不做权限检查，非公开文件只靠URL无法猜测来保护，
+    因此文件名使用随机值而不是内容哈希，否则持有相同文件的人可以算出URL并下载。
+    保留扩展名，静态文件服务据此返回Content-Type。
+    """
+    ext = os.path.splitext(filename or "")[1].lower()
+    if not _SAFE_EXTENSION.fullmatch(ext):
+        ext = ""
+    name = uuid.uuid4().hex
+    return f"{_BLOB_DIR}/{name[:2]}/{name}{ext}"
+
+
+def _place_blob(source: Path, target: Path) -> None:
+    target.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(source, target)
+
+
+def _trash(path: Path) -> Optional[Path]:
+    """把待删除的文件改名，数据库提交后再删除，提交失败时可以改回"""
+    trash = path.with_name(f".{path.name}.{uuid.uuid4().hex}.deleted")
+    try:
+        os.replace(path, trash)
+    except FileNotFoundError:
+        return None
+    return trash
+
+
+def _purge(trash: Path, remove_empty_parent: bool) -> None:
+    trash.unlink(missing_ok=True)
+    if remove_empty_parent:
+        # 尝试删除空目录
+        parent_dir = trash.parent
+        if parent_dir.exists() and not any(parent_dir.iterdir()):
+            parent_dir.rmdir()
+
+
+class StoredFile(NamedTuple):
+    """已写入磁盘的上传文件"""
+    path: Path
+    size: int
+    sha256: str
+
+
+def _size_exceeded_error() -> HTTPException:
+    return HTTPException(
+        status_code=400,
+        detail=f"文件大小超过限制 ({settings.MAX_UPLOAD_SIZE / 1024 / 1024}MB)"
+    )
+
+
+def _write_chunk(temp: BinaryIO, digest: "hashlib._Hash", chunk: bytes) -> None:
+    # 大于2KB的数据计算哈希时会释放GIL，和写入一起放在线程中执行
+    digest.update(chunk)
+    temp.write(chunk)
+
+
+def _commit_temp(temp: BinaryIO, temp_path: str, target: Path) -> None:
+    temp.flush()
+    os.fsync(temp.fileno())
+    temp.close()
+    os.replace(temp_path, target)
+
+
+def _discard_temp(temp: BinaryIO, temp_path: str) -> None:
+    temp.close()
+    try:
+        os.unlink(temp_path)
+    except FileNotFoundError:
+        pass
+
+
 class UploadService:
-    """文件上传服务，提供通用的文件上传、获取和删除功能"""
+    """
+    文件上传服务，提供通用的文件上传、获取和删除功能
+    
+    文件按内容的SHA-256去重保存在 UPLOADS_DIR/blobs 下（哈希只记录在数据库中，不出现在路径里），内容相同的上传记录指向同一个存储文件，
+    删除上传记录时减少引用数，最后一个引用删除时才删除文件。
+    去重存储之前上传的文件（blob_id为空）仍保存在原来的路径，其URL已写入AI助手的消息内容，不做迁移。
+    """
+    
+    async def store_stream(self, file: UploadFile, target: Path) -> StoredFile:
+        """
+        分块读取上传文件写入目标路径，返回文件大小和SHA-256
+        
+        上传文件此时已由表单解析写入临时文件，分块读取是为了不把整个文件读入内存。
+        
+        每次读取 UPLOAD_CHUNK_SIZE 字节，写入和计算哈希在线程中执行，不阻塞事件循环，
+        内存中只保留一个分块；累计大小超过 MAX_UPLOAD_SIZE 时立即停止。
+        先写入同一目录下的临时文件，完成后用 os.replace 原子地移动到目标路径，
+        出错时删除临时文件，目标路径不会出现不完整的文件。
+        """
+        # 表单解析时已统计文件的实际大小，超过限制时不必再读取内容；
+        # 请求体在进入接口前就已完整接收，接收过程中的大小限制由 UploadSizeLimitMiddleware 负责
+        if file.size is not None and file.size > settings.MAX_UPLOAD_SIZE:
+            raise _size_exceeded_error()
+        
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=str(target.parent), prefix=".upload-", suffix=".tmp")
+        temp = os.fdopen(fd, "wb")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            while True:
+                chunk = await file.read(settings.UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > settings.MAX_UPLOAD_SIZE:
+                    raise _size_exceeded_error()
+                await asyncio.to_thread(_write_chunk, temp, digest, chunk)
+            await asyncio.to_thread(_commit_temp, temp, temp_path, target)
+        except BaseException:
+            await asyncio.shield(asyncio.to_thread(_discard_temp, temp, temp_path))
+            raise
+        return StoredFile(path=target, size=size, sha256=digest.hexdigest())
     
     async def save_upload(
         self,
@@ -36,59 +164,51 @@ class UploadService:
                 detail=f"不支持的文件类型: {file_type}"
             )
         
-        # 读取文件内容
-        file_content = await file.read()
+        # 分块写入暂存文件，同时验证文件大小并计算内容哈希
+        staged = await self.store_stream(file, Path(settings.UPLOADS_DIR) / _STAGING_DIR / uuid.uuid4().hex)
         
-        # 验证文件大小
-        file_size = len(file_content)
-        if file_size > settings.MAX_UPLOAD_SIZE:
-            raise HTTPException(
-                status_code=400,
-                detail=f"文件大小超过限制 ({file_size / 1024 / 1024:.1f}MB > {settings.MAX_UPLOAD_SIZE / 1024 / 1024}MB)"
+        blob_created = False
+        blob_file: Optional[Path] = None
+        try:
+            # 相同内容已保存时只增加引用数
+            blob, blob_created = await crud_uploads.acquire_blob(
+                db, sha256=staged.sha256, size=staged.size, storage_path=_blob_path(file.filename)
             )
-        
-        # 生成唯一文件名
-        file_ext = os.path.splitext(file.filename)[1]
-        unique_filename = f"{uuid.uuid4().hex}{file_ext}"
-        
-        # 构建保存路径
-        relative_path = f"{module}/{uploader_id}"
-        if entity_type and entity_id:
-            relative_path = f"{relative_path}/{entity_type}_{entity_id}"
+            blob_file = Path(settings.UPLOADS_DIR) / blob.storage_path
+            if blob_created or not await asyncio.to_thread(blob_file.exists):
+                # 新的内容，或已有记录的文件丢失时用本次上传的内容补上
+                await asyncio.to_thread(_place_blob, staged.path, blob_file)
+                UPLOAD_STORAGE_BYTES.labels(result="stored").inc(staged.size)
+            else:
+                UPLOAD_STORAGE_BYTES.labels(result="deduplicated").inc(staged.size)
             
-        # 确保目录存在
-        upload_dir = Path(settings.UPLOADS_DIR) / relative_path
-        upload_dir.mkdir(parents=True, exist_ok=True)
-        
-        # 保存文件
-        file_path = upload_dir / unique_filename
-        with open(file_path, "wb") as f:
-            f.write(file_content)
-        
-        # 生成相对路径和URL
-        relative_file_path = f"{relative_path}/{unique_filename}"
-        file_url = f"/uploads/{relative_file_path}"
-        
-        # 创建数据库记录
-        upload_in = UploadCreate(
-            filename=unique_filename,
-            original_filename=file.filename,
-            file_path=relative_file_path,
-            file_type=file_type,
-            file_size=file_size,
-            module=module,
-            entity_type=entity_type,
-            entity_id=entity_id,
-            uploader_id=uploader_id,
-            is_public=is_public
-        )
-        
-        db_upload = await crud_uploads.create(db, obj_in=upload_in)
+            # 创建数据库记录
+            upload_in = UploadCreate(
+                filename=blob_file.name,
+                original_filename=file.filename,
+                file_path=blob.storage_path,
+                file_type=file_type,
+                file_size=staged.size,
+                module=module,
+                entity_type=entity_type,
+                entity_id=entity_id,
+                uploader_id=uploader_id,
+                is_public=is_public,
+                blob_id=blob.id
+            )
+            db_upload = await crud_uploads.create(db, obj_in=upload_in)
+        except BaseException:
+            # 新建的存储文件没有记录引用时删除
+            if blob_created and blob_file is not None:
+                await asyncio.shield(asyncio.to_thread(blob_file.unlink, missing_ok=True))
+            raise
+        finally:
+            await asyncio.shield(asyncio.to_thread(staged.path.unlink, missing_ok=True))
         
         # 返回包含URL的完整模型
         return UploadSchema(
             **db_upload.__dict__,
-            file_url=file_url
+            file_url=await self.get_file_url(db_upload)
         )
     
     async def save_multiple_uploads(
@@ -130,56 +250,78 @@ class UploadService:
         """获取文件的完整URL"""
         return f"/uploads/{upload.file_path}"
     
-    async def delete_file(self, *, db: AsyncSession, upload_id: int) -> bool:
-        """删除文件及其数据库记录"""
-        upload = await crud_uploads.get(db, upload_id)
-        if not upload:
-            return False
+    async def _release_files(
+        self, db: AsyncSession, uploads: List[Upload]
+    ) -> List[Tuple[Path, Path, bool]]:
+        """
+        释放上传记录占用的文件，把不再被引用的文件改名待删除
         
-        # 删除物理文件
-        file_path = Path(settings.UPLOADS_DIR) / upload.file_path
-        if file_path.exists():
+        返回 (原路径, 待删除路径, 是否为去重存储之前的文件) 的列表
+        """
+        released = []
+        for upload in uploads:
+            legacy = upload.blob_id is None
+            if legacy:
+                file_path = Path(settings.UPLOADS_DIR) / upload.file_path
+            else:
+                blob = await crud_uploads.release_blob(db, upload=upload)
+                if blob is None:
+                    # 还有其他上传记录引用该文件
+                    continue
+                file_path = Path(settings.UPLOADS_DIR) / blob.storage_path
+            trash = await asyncio.to_thread(_trash, file_path)
+            if trash is not None:
+                released.append((file_path, trash, legacy))
+        return released
+    
+    async def _finish_release(self, released: List[Tuple[Path, Path, bool]], committed: bool) -> None:
+        """数据库提交后删除文件，提交失败时恢复文件"""
+        for file_path, trash, legacy in released:
             try:
-                file_path.unlink()  # 删除文件
-                
-                # 尝试删除空目录
-                parent_dir = file_path.parent
-                if parent_dir.exists() and not any(parent_dir.iterdir()):
-                    parent_dir.rmdir()
+                if committed:
+                    await asyncio.to_thread(_purge, trash, legacy)
+                else:
+                    await asyncio.to_thread(os.replace, trash, file_path)
             except Exception as e:
-                # 记录错误但继续删除数据库记录
+                # 记录错误，继续处理其他文件
                 print(f"删除文件时出错: {str(e)}")
+    
+    async def delete_file(self, *, db: AsyncSession, upload_id: int) -> bool:
+        """删除数据库记录，文件不再被其他记录引用时删除文件"""
+        upload = await crud_uploads.get(db, upload_id)
+        if not upload:
+            return False
         
-        # 删除数据库记录
-        await crud_uploads.remove(db, id=upload_id)
+        released = await self._release_files(db, [upload])
+        try:
+            # 删除数据库记录，和引用数的变化一起提交
+            await crud_uploads.remove(db, id=upload_id)
+        except BaseException:
+            await self._finish_release(released, committed=False)
+            raise
+        await self._finish_release(released, committed=True)
         return True
     
     async def delete_entity_files(
         self, *, db: AsyncSession, entity_type: str, entity_id: int
     ) -> int:
-        """删除与实体相关的所有文件及其数据库记录"""
+        """删除与实体相关的所有数据库记录，以及不再被其他记录引用的文件"""
         uploads = await crud_uploads.get_by_entity(
             db, entity_type=entity_type, entity_id=entity_id
         )
         
-        count = 0
-        for upload in uploads:
-            # 删除物理文件
-            file_path = Path(settings.UPLOADS_DIR) / upload.file_path
-            if file_path.exists():
-                try:
-                    file_path.unlink()
-                except Exception:
-                    pass  # 忽略错误，继续处理其他文件
-            
-            count += 1
-        
-        # 批量删除数据库记录
-        await crud_uploads.remove_by_entity(
-            db, entity_type=entity_type, entity_id=entity_id
-        )
+        released = await self._release_files(db, uploads)
+        try:
+            # 批量删除数据库记录
+            await crud_uploads.remove_by_entity(
+                db, entity_type=entity_type, entity_id=entity_id
+            )
+        except BaseException:
+            await self._finish_release(released, committed=False)
+            raise
+        await self._finish_release(released, committed=True)
         
-        return count
+        return len(uploads)
 
 
 # 创建服务实例
@@ -0,0 +1,51 @@
+from datetime import datetime
+from typing import Optional, Tuple
+import base64
+import json
+
+from sqlalchemy import and_, or_
+from sqlalchemy.sql.elements import ColumnElement
+
+# 返回下一页游标的响应头，没有下一页时不返回
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    """把最后一行的 (时间, ID) 编码为不透明的游标"""
+    raw = json.dumps([timestamp.isoformat(), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    解析游标
+
+    异常:
+    - ValueError: 游标格式不正确
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except Exception as e:
+        raise ValueError("无效的分页游标") from e
+
+
+def keyset_condition(
+    time_column,
+    id_column,
+    cursor: Optional[Tuple[datetime, int]],
+    descending: bool
+) -> Optional[ColumnElement]:
+    """
+    游标之后的行的条件，排序为 (time_column, id_column)
+
+    展开为 time < t OR (time = t AND id < i) 而不是行比较，
+    MySQL可以据此在 (..., time) 复合索引上做范围扫描（InnoDB二级索引隐含主键，相当于包含id）。
+    """
+    if cursor is None:
+        return None
+    timestamp, row_id = cursor
+    if descending:
+        return or_(time_column < timestamp, and_(time_column == timestamp, id_column < row_id))
+    return or_(time_column > timestamp, and_(time_column == timestamp, id_column > row_id))
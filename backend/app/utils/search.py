@@ -0,0 +1,56 @@
+from typing import Sequence
+
+from sqlalchemy import or_
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.elements import ColumnElement
+
+from app.core.config import settings
+
+# MySQL布尔模式全文检索中的特殊字符
+_BOOLEAN_MODE_OPERATORS = set('+-<>()~*"@')
+
+
+def supports_fulltext(db: AsyncSession) -> bool:
+    """判断当前数据库是否支持ngram全文索引（MySQL/MariaDB）"""
+    bind = db.bind
+    if bind is None:
+        return False
+    return bind.dialect.name in ("mysql", "mariadb")
+
+
+def build_phrase_query(term: str) -> str:
+    """
+    构建布尔模式的短语查询
+
+    ngram解析器会把短语切分为连续的n-gram并要求相邻出现，
+    对中文姓名、学号等没有空格分词的文本相当于子串匹配。
+    """
+    cleaned = "".join(" " if ch in _BOOLEAN_MODE_OPERATORS else ch for ch in term)
+    return '"' + " ".join(cleaned.split()) + '"'
+
+
+def _is_indexable(term: str) -> bool:
+    """检查词项的每个片段是否都不短于ngram长度，过短的片段无法命中全文索引"""
+    cleaned = "".join(" " if ch in _BOOLEAN_MODE_OPERATORS else ch for ch in term)
+    parts = cleaned.split()
+    return bool(parts) and all(len(part) >= settings.SEARCH_NGRAM_TOKEN_SIZE for part in parts)
+
+
+def text_search_condition(
+    db: AsyncSession,
+    columns: Sequence[ColumnElement],
+    term: str
+) -> ColumnElement:
+    """
+    生成文本搜索条件
+
+    MySQL下使用 MATCH ... AGAINST 命中ngram全文索引，columns 必须与全文索引的列完全一致；
+    其他数据库或词项短于ngram长度（如单个汉字）时回退到 LIKE '%term%'。
+    """
+    term = term.strip()
+    if supports_fulltext(db) and _is_indexable(term):
+        return match(*columns, against=build_phrase_query(term)).in_boolean_mode()
+
+    pattern = f"%{term}%"
+    return or_(*(column.ilike(pattern) for column in columns))
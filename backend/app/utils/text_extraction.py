@@ -0,0 +1,302 @@
+"""
+附件文本提取
+
+本模块的函数在进程池的子进程中执行，只依赖标准库和按需导入的解析库，
+不导入应用配置和数据库，参数和返回值都可以序列化。
+"""
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import struct
+import tempfile
+import zipfile
+from xml.etree import ElementTree
+
+# 提取逻辑变化时修改，使磁盘缓存中的旧结果失效
+EXTRACTOR_VERSION = 1
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+_WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_BLANK_LINES = re.compile(r"\n{3,}")
+_CSV_ENCODINGS = ("utf-8-sig", "gb18030")
+
+# 提取结果的类型
+KIND_TEXT = "text"
+KIND_IMAGE = "image"
+KIND_UNSUPPORTED = "unsupported"
+KIND_ERROR = "error"
+
+
+def file_sha256(path: str) -> str:
+    """分块计算文件的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _TextBuffer:
+    """累计提取的文本，达到字符上限后停止"""
+
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+        self.parts = []
+        self.size = 0
+        self.truncated = False
+
+    @property
+    def full(self) -> bool:
+        return self.size >= self.max_chars
+
+    def add(self, text: str) -> None:
+        if not text or self.full:
+            if text:
+                self.truncated = True
+            return
+        remaining = self.max_chars - self.size
+        if len(text) > remaining:
+            text = text[:remaining]
+            self.truncated = True
+        self.parts.append(text)
+        self.size += len(text)
+
+    def text(self) -> str:
+        return _BLANK_LINES.sub("\n\n", "\n".join(self.parts)).strip()
+
+
+def _extract_pdf(path: str, buffer: _TextBuffer, max_pages: int) -> Dict[str, Any]:
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    pages = len(reader.pages)
+    for index, page in enumerate(reader.pages):
+        if index >= max_pages or buffer.full:
+            buffer.truncated = True
+            break
+        buffer.add(f"[第{index + 1}页]")
+        buffer.add(page.extract_text() or "")
+    return {"pages": pages}
+
+
+def _extract_docx(path: str, buffer: _TextBuffer) -> Dict[str, Any]:
+    """按段落读取 word/document.xml 中的文本，表格的单元格以制表符分隔"""
+    with zipfile.ZipFile(path) as archive:
+        root = ElementTree.fromstring(archive.read("word/document.xml"))
+    body = root.find(f"{_WORD_NS}body")
+    paragraphs = 0
+    for element in (body if body is not None else []):
+        if buffer.full:
+            buffer.truncated = True
+            break
+        if element.tag == f"{_WORD_NS}p":
+            buffer.add("".join(node.text or "" for node in element.iter(f"{_WORD_NS}t")))
+            paragraphs += 1
+        elif element.tag == f"{_WORD_NS}tbl":
+            for row in element.iter(f"{_WORD_NS}tr"):
+                cells = [
+                    "".join(node.text or "" for node in cell.iter(f"{_WORD_NS}t"))
+                    for cell in row.iter(f"{_WORD_NS}tc")
+                ]
+                buffer.add("\t".join(cells))
+    return {"paragraphs": paragraphs}
+
+
+def _extract_xlsx(path: str, buffer: _TextBuffer, max_rows: int) -> Dict[str, Any]:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheets = workbook.sheetnames
+        for sheet in workbook.worksheets:
+            if buffer.full:
+                buffer.truncated = True
+                break
+            buffer.add(f"[工作表: {sheet.title}]")
+            for index, row in enumerate(sheet.iter_rows(values_only=True)):
+                if index >= max_rows:
+                    buffer.truncated = True
+                    break
+                cells = ["" if value is None else str(value) for value in row]
+                while cells and not cells[-1]:
+                    cells.pop()
+                if cells:
+                    buffer.add("\t".join(cells))
+    finally:
+        workbook.close()
+    return {"sheets": sheets}
+
+
+def _decode_text(raw: bytes) -> str:
+    for encoding in _CSV_ENCODINGS:
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return raw.decode("utf-8", errors="replace")
+
+
+def _extract_csv(path: str, buffer: _TextBuffer, max_rows: int) -> Dict[str, Any]:
+    with open(path, "rb") as f:
+        # 行数有上限，只需读取开头部分
+        raw = f.read(buffer.max_chars * 4)
+    rows = 0
+    for row in csv.reader(io.StringIO(_decode_text(raw))):
+        if rows >= max_rows or buffer.full:
+            buffer.truncated = True
+            break
+        if any(cell.strip() for cell in row):
+            buffer.add("\t".join(cell.strip() for cell in row))
+            rows += 1
+    return {"rows": rows}
+
+
+def _extract_plain(path: str, buffer: _TextBuffer) -> Dict[str, Any]:
+    with open(path, "rb") as f:
+        raw = f.read(buffer.max_chars * 4 + 1)
+    buffer.add(_decode_text(raw))
+    return {}
+
+
+def _image_size(header: bytes, f) -> Optional[Tuple[str, int, int]]:
+    """从文件头读取图片格式和尺寸，不解码像素"""
+    if header.startswith(b"\x89PNG\r\n\x1a\n") and header[12:16] == b"IHDR":
+        width, height = struct.unpack(">II", header[16:24])
+        return "PNG", width, height
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        width, height = struct.unpack("<HH", header[6:10])
+        return "GIF", width, height
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        chunk = header[12:16]
+        if chunk == b"VP8X":
+            width = int.from_bytes(header[24:27], "little") + 1
+            height = int.from_bytes(header[27:30], "little") + 1
+            return "WEBP", width, height
+        if chunk == b"VP8 ":
+            width, height = struct.unpack("<HH", header[26:30])
+            return "WEBP", width & 0x3FFF, height & 0x3FFF
+        if chunk == b"VP8L":
+            bits = int.from_bytes(header[21:25], "little")
+            return "WEBP", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if header[:2] == b"\xff\xd8":
+        # 顺序查找JPEG的SOF段
+        f.seek(2)
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            if marker[1] in (0xD8, 0x01) or 0xD0 <= marker[1] <= 0xD7:
+                continue
+            length_bytes = f.read(2)
+            if len(length_bytes) < 2:
+                return None
+            length = struct.unpack(">H", length_bytes)[0]
+            if marker[1] in (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+                height, width = struct.unpack(">xHH", f.read(5))
+                return "JPEG", width, height
+            f.seek(length - 2, os.SEEK_CUR)
+    return None
+
+
+def _extract_image(path: str) -> Dict[str, Any]:
+    with open(path, "rb") as f:
+        header = f.read(32)
+        info = _image_size(header, f)
+    if info is None:
+        return {}
+    image_format, width, height = info
+    return {"format": image_format, "width": width, "height": height}
+
+
+def _detect(file_type: str, filename: str) -> str:
+    suffix = Path(filename).suffix.lower()
+    if file_type == "application/pdf" or suffix == ".pdf":
+        return "pdf"
+    if file_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document" or suffix == ".docx":
+        return "docx"
+    if file_type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" or suffix == ".xlsx":
+        return "xlsx"
+    if file_type == "text/csv" or suffix == ".csv":
+        return "csv"
+    if file_type == "text/plain" or suffix in (".txt", ".md"):
+        return "plain"
+    if file_type.startswith("image/"):
+        return "image"
+    return ""
+
+
+def extract(path: str, file_type: str, max_chars: int, max_pages: int, max_rows: int) -> Dict[str, Any]:
+    """
+    提取单个文件的文本或图片信息
+
+    返回 {"kind", "text", "truncated", "meta"}；不支持的格式（如 .doc/.xls）返回 unsupported，
+    文件损坏等错误返回 error 和错误信息，不抛出异常。
+    """
+    format_name = _detect(file_type, path)
+    buffer = _TextBuffer(max_chars)
+    try:
+        if format_name == "image":
+            return {"kind": KIND_IMAGE, "text": "", "truncated": False, "meta": _extract_image(path)}
+        if format_name == "pdf":
+            meta = _extract_pdf(path, buffer, max_pages)
+        elif format_name == "docx":
+            meta = _extract_docx(path, buffer)
+        elif format_name == "xlsx":
+            meta = _extract_xlsx(path, buffer, max_rows)
+        elif format_name == "csv":
+            meta = _extract_csv(path, buffer, max_rows)
+        elif format_name == "plain":
+            meta = _extract_plain(path, buffer)
+        else:
+            return {"kind": KIND_UNSUPPORTED, "text": "", "truncated": False, "meta": {}}
+    except Exception as e:
+        return {"kind": KIND_ERROR, "text": "", "truncated": False, "meta": {"error": f"{type(e).__name__}: {e}"}}
+    return {"kind": KIND_TEXT, "text": buffer.text(), "truncated": buffer.truncated, "meta": meta}
+
+
+def extract_cached(
+    path: str,
+    file_type: str,
+    cache_dir: str,
+    max_chars: int,
+    max_pages: int,
+    max_rows: int
+) -> Dict[str, Any]:
+    """
+    按文件内容的SHA-256读取或写入磁盘缓存后提取
+
+    缓存文件为 cache_dir/<前2位>/<哈希>.json，内容相同的文件只提取一次；
+    先写入临时文件再替换，多个进程同时写入同一结果时不会读到不完整的文件。
+    返回的结果额外包含 sha256 和 cached（是否命中缓存）。
+    """
+    sha256 = file_sha256(path)
+    cache_path = Path(cache_dir) / sha256[:2] / f"{sha256}.json"
+    key = [EXTRACTOR_VERSION, max_chars, max_pages, max_rows]
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        if entry.get("key") == key:
+            return {**entry["result"], "sha256": sha256, "cached": True}
+    except (OSError, ValueError, KeyError):
+        pass
+
+    result = extract(path, file_type, max_chars, max_pages, max_rows)
+    if result["kind"] != KIND_ERROR:
+        # 出错的结果不缓存，文件修复或解析库升级后可以重新提取
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=str(cache_path.parent), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"key": key, "result": result}, f, ensure_ascii=False)
+            os.replace(temp_path, cache_path)
+        except OSError:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+    return {**result, "sha256": sha256, "cached": False}
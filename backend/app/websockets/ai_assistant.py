@@ -8,10 +8,14 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from jose import jwt, JWTError
 
 from app.core.config import settings
+from app.core.errors import GenerationCancelledError, ServiceOverloadedError
 from app.api.deps import get_db, get_current_user
 from app.models.user import User
+from app.db.session import async_session
 from app.schemas.auth import TokenPayload
+from app.services.ai_jobs import ai_job_queue
 from app.services.ai_service import ai_assistant
+from app.services.generation_registry import CANCEL_DISCONNECT, CANCEL_REQUESTED, generation_registry
 from app.core.logging import get_logger
 
 logger = get_logger(__name__)
@@ -76,6 +80,98 @@ async def get_token_data(token: str) -> TokenPayload:
             detail="Could not validate credentials",
         )
 
+async def _handle_query(websocket: WebSocket, user_id: int, data: dict):
+    """处理一次AI查询，使用独立的数据库会话，生成可被取消"""
+    query_text = data.get("query_text")
+    context_data = data.get("context_data")
+    if not query_text:
+        return
+    conversation_id = (context_data or {}).get("conversation_id")
+    
+    session = async_session()
+    try:
+        if data.get("stream"):
+            # 流式处理查询：逐段推送token，最后推送完整响应
+            events = generation_registry.iterate(
+                ai_assistant.process_query_stream(
+                    session,
+                    user_id=user_id,
+                    query_text=query_text,
+                    context_data=context_data
+                ),
+                user_id=user_id,
+                conversation_id=conversation_id,
+                source="websocket",
+                owner=websocket
+            )
+            try:
+                async for event in events:
+                    await ai_connection_manager.send_response(user_id, event)
+                    # 发送失败时连接已被移除，停止生成
+                    if user_id not in ai_connection_manager.active_connections:
+                        break
+            finally:
+                await events.aclose()
+        
+        else:
+            # 需要排队时推送排队位置
+            def push_queue_position(position: int):
+                asyncio.ensure_future(ai_connection_manager.send_response(
+                    user_id,
+                    {"type": "queue", "data": {"position": position}}
+                ))
+            
+            # 处理查询
+            try:
+                result = await generation_registry.run(
+                    ai_assistant.process_query(
+                        session,
+                        user_id=user_id,
+                        query_text=query_text,
+                        context_data=context_data,
+                        on_queue_position=push_queue_position
+                    ),
+                    user_id=user_id,
+                    conversation_id=conversation_id,
+                    source="websocket",
+                    owner=websocket
+                )
+            except ServiceOverloadedError as e:
+                result = {
+                    "error": e.error_message,
+                    "code": e.code,
+                    "response": e.error_message,
+                    "query_id": "",
+                    "details": e.details or {}
+                }
+            
+            # 发送响应
+            await ai_connection_manager.send_response(
+                user_id,
+                {
+                    "type": "response",
+                    "data": result
+                }
+            )
+    except GenerationCancelledError as e:
+        # 连接已断开时无需通知
+        if e.reason != CANCEL_DISCONNECT:
+            await ai_connection_manager.send_response(
+                user_id,
+                {
+                    "type": "cancelled",
+                    "data": {
+                        "conversation_id": conversation_id,
+                        "reason": e.reason,
+                        "message": e.error_message
+                    }
+                }
+            )
+    except Exception as e:
+        logger.error(f"处理AI查询出错: user={user_id}, {str(e)}")
+    finally:
+        await session.close()
+
 @router.websocket("/ws/ai-assistant/{user_id}")
 async def websocket_ai_assistant(
     websocket: WebSocket,
@@ -110,33 +206,36 @@ async def websocket_ai_assistant(
         await ai_connection_manager.connect(websocket, user_id)
         logger.info(f"AI助手WebSocket连接建立成功: user_id={user_id}")
         
+        query_tasks: Set[asyncio.Task] = set()
         try:
             while True:
                 # 接收用户消息
                 data = await websocket.receive_json()
                 
                 if data.get("type") == "query":
-                    # 处理AI查询
-                    query_text = data.get("data", {}).get("query_text")
-                    context_data = data.get("data", {}).get("context_data")
-                    
-                    if query_text:
-                        # 处理查询
-                        result = await ai_assistant.process_query(
-                            db,
-                            user_id=user_id,
-                            query_text=query_text,
-                            context_data=context_data
+                    # 查询在独立任务中处理，生成期间仍能接收取消消息和检测断开
+                    task = asyncio.create_task(_handle_query(websocket, user_id, data.get("data", {})))
+                    query_tasks.add(task)
+                    task.add_done_callback(query_tasks.discard)
+                
+                elif data.get("type") == "cancel":
+                    # 取消指定会话（未指定时为全部）进行中的生成和尚未执行的后台任务
+                    conversation_id = data.get("data", {}).get("conversation_id")
+                    cancelled = generation_registry.cancel(user_id, conversation_id, reason=CANCEL_REQUESTED)
+                    async with async_session() as session:
+                        cancelled += await ai_job_queue.cancel_pending(
+                            session, user_id=user_id, conversation_id=conversation_id
                         )
-                        
-                        # 发送响应
-                        await ai_connection_manager.send_response(
-                            user_id,
-                            {
-                                "type": "response",
-                                "data": result
+                    await ai_connection_manager.send_response(
+                        user_id,
+                        {
+                            "type": "cancel_ack",
+                            "data": {
+                                "conversation_id": conversation_id,
+                                "cancelled": cancelled
                             }
-                        )
+                        }
+                    )
                 
                 elif data.get("type") == "suggest":
                     # 处理建议请求
@@ -161,6 +260,9 @@ async def websocket_ai_assistant(
         except Exception as e:
             logger.error(f"WebSocket error for user {user_id}: {str(e)}")
             ai_connection_manager.disconnect(user_id)
+        finally:
+            # 连接断开时停止该连接发起的生成
+            generation_registry.cancel_owner(websocket, reason=CANCEL_DISCONNECT)
             
     except Exception as e:
         logger.error(f"Error in AI assistant WebSocket connection: {str(e)}")
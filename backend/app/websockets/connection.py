@@ -2,11 +2,13 @@ from typing import Dict, List, Optional, Set
 from datetime import datetime
 import json
 import asyncio
+import time
 from fastapi import WebSocket
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.user import User
 from app.crud.notification import notification as notification_crud
 from app.schemas.notification import NotificationCreate, Notification
+from app.services.unread_counter import unread_counter
 from app.core.logging import get_logger
 
 logger = get_logger(__name__)
@@ -91,8 +93,12 @@ class ConnectionManager:
     ):
         """发送通知并保存到数据库"""
         try:
-            # 创建通知记录
-            db_notification = await notification_crud.create(db, obj_in=notification)
+            # 写入前的时间，此后加载的未读计数可能已包含这条通知
+            sent_at = time.monotonic()
+            # 创建通知记录，并批量写入接收者收件箱
+            db_notification, recipient_ids = await notification_crud.create_with_recipients(
+                db, obj_in=notification
+            )
             
             # 构造WebSocket消息
             message = {
@@ -106,6 +112,9 @@ class ConnectionManager:
                 }
             }
             
+            # 调整接收者的未读计数，变化会推送给在线用户
+            await unread_counter.on_sent(db, recipient_ids, sent_at)
+            
             # 发送通知
             try:
                 if notification.recipient_user_id:
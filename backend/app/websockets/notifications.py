@@ -10,6 +10,7 @@ from app.models.user import User
 from app.schemas.auth import TokenPayload
 from app.websockets.connection import notification_manager
 from app.crud.notification import notification as notification_crud
+from app.services.unread_counter import unread_counter
 from app.core.logging import get_logger
 
 logger = get_logger(__name__)
@@ -64,6 +65,15 @@ async def websocket_notifications(
         await notification_manager.connect(websocket, user_id, user_roles)
         logger.info(f"WebSocket通知连接建立成功: user_id={user_id}, roles={user_roles}")
         
+        # 连接建立后推送当前未读数，之后仅在计数变化时推送
+        await notification_manager.send_personal_message(
+            user_id,
+            {
+                "type": "unread_count",
+                "data": {"unread_count": await unread_counter.get(db, user_id)}
+            }
+        )
+        
         try:
             while True:
                 # 接收客户端消息
@@ -71,11 +81,13 @@ async def websocket_notifications(
                 
                 # 处理消息确认
                 if data.get("type") == "ack" and "notification_id" in data:
-                    await notification_crud.mark_as_read(
+                    entry = await notification_crud.mark_as_read(
                         db,
                         notification_id=data["notification_id"],
                         user_id=user_id
                     )
+                    if entry:
+                        await unread_counter.on_read(db, user_id)
         except WebSocketDisconnect:
             notification_manager.disconnect(websocket, user_id)
         except Exception as e:
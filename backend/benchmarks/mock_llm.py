@@ -0,0 +1,379 @@
+"""
+模拟LLM服务
+
+实现 AIAssistantService 使用的 Ollama /api/generate 与 Open-WebUI /api/chat 接口（流式和非流式），
+以及健康检查使用的 /api/tags、/api/models，用于在不占用GPU服务器的情况下压测AI助手。
+预填充耗时、输出速度、回答长度、并发生成数和错误率可配置，GET /mock/stats 返回服务端统计。
+指定 --reject-unknown-models 时，请求的模型不是 --model 则与真实服务一样返回404。
+只依赖aiohttp，不读取后端的配置和数据库，可以部署在单独的机器上。
+
+用法（在 backend 目录下执行）:
+    python -m benchmarks.mock_llm --port 11500 --profile gpu
+然后将后端的 OLLAMA_BASE_URL / OPEN_WEBUI_BASE_URL 指向 http://127.0.0.1:11500
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass, fields, replace
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+_NANOSECONDS = 1_000_000_000
+
+# 生成回答用的词表，每个词计为一个token
+_WORDS = [
+    "同学", "你好", "这道题", "可以", "先", "分析", "题目", "条件", "然后", "列出",
+    "方程", "求解", "注意", "单位", "换算", "最后", "检查", "结果", "是否", "合理",
+    "，", "。", "建议", "复习", "课本", "例题", "加油",
+]
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中文等宽字符每字一个token，其他字符每4个一个token"""
+    if not text:
+        return 0
+    wide = sum(1 for char in text if ord(char) > 0x2E7F)
+    return wide + (len(text) - wide + 3) // 4
+
+
+@dataclass
+class LatencyProfile:
+    """模拟模型的耗时参数"""
+    load_time: float  # 首次请求加载模型的耗时（秒）
+    prefill_base: float  # 每次请求固定的预填充耗时（秒）
+    prefill_tokens_per_second: float  # 预填充速度（token/秒）
+    tokens_per_second: float  # 输出速度（token/秒）
+    response_tokens: int  # 回答的token数
+    jitter: float  # 耗时和回答长度的随机浮动比例
+    max_concurrency: int  # 同时生成的请求数，超出的请求排队，0表示不限
+    error_rate: float  # 返回500错误的概率
+
+
+PROFILES: Dict[str, LatencyProfile] = {
+    # 几乎无耗时，用于测量后端自身的开销
+    "instant": LatencyProfile(0.0, 0.0, 1_000_000.0, 1_000_000.0, 20, 0.0, 0, 0.0),
+    # 单卡部署的中等模型
+    "gpu": LatencyProfile(5.0, 0.05, 2000.0, 30.0, 200, 0.2, 2, 0.0),
+    # 负载较高或较大的模型
+    "slow": LatencyProfile(15.0, 0.2, 500.0, 8.0, 300, 0.3, 1, 0.02),
+}
+
+
+class MockLLMServer:
+    """模拟的Ollama / Open-WebUI服务"""
+
+    def __init__(
+        self,
+        profile: LatencyProfile,
+        model_name: str,
+        seed: Optional[int] = None,
+        reject_unknown_models: bool = False
+    ):
+        self.profile = profile
+        self.model_name = model_name
+        self.reject_unknown_models = reject_unknown_models
+        self._rng = random.Random(seed)
+        self._slots = asyncio.Semaphore(profile.max_concurrency) if profile.max_concurrency > 0 else None
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+        self.stats: Dict[str, Any] = {
+            "requests": 0,
+            "streams": 0,
+            "warmups": 0,
+            "errors": 0,
+            "unknown_models": 0,
+            "disconnects": 0,
+            "active": 0,
+            "max_active": 0,
+            "waiting": 0,
+            "max_waiting": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "context_reused": 0,
+        }
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/api/generate", self.ollama_generate)
+        app.router.add_post("/api/chat", self.open_webui_chat)
+        app.router.add_get("/api/tags", self.ollama_tags)
+        app.router.add_get("/api/models", self.open_webui_models)
+        app.router.add_get("/mock/stats", self.get_stats)
+        return app
+
+    def _vary(self, value: float) -> float:
+        if not self.profile.jitter:
+            return value
+        return max(value * (1 + self._rng.uniform(-self.profile.jitter, self.profile.jitter)), 0.0)
+
+    def _response_tokens(self) -> List[str]:
+        count = max(int(round(self._vary(self.profile.response_tokens))), 1)
+        return [self._rng.choice(_WORDS) for _ in range(count)]
+
+    def _prefill_time(self, prompt_tokens: int) -> float:
+        return self._vary(self.profile.prefill_base + prompt_tokens / self.profile.prefill_tokens_per_second)
+
+    def _token_interval(self) -> float:
+        return self._vary(1 / self.profile.tokens_per_second)
+
+    async def _ensure_loaded(self) -> float:
+        """模拟首次加载模型，返回本次请求等待加载的耗时"""
+        if self._loaded:
+            return 0.0
+        begin = time.perf_counter()
+        async with self._load_lock:
+            if not self._loaded:
+                await asyncio.sleep(self.profile.load_time)
+                self._loaded = True
+        return time.perf_counter() - begin
+
+    async def _acquire(self) -> None:
+        """占用一个生成槽位，与Ollama一样在服务端排队"""
+        self.stats["waiting"] += 1
+        self.stats["max_waiting"] = max(self.stats["max_waiting"], self.stats["waiting"])
+        try:
+            if self._slots is not None:
+                await self._slots.acquire()
+        finally:
+            self.stats["waiting"] -= 1
+        self.stats["active"] += 1
+        self.stats["max_active"] = max(self.stats["max_active"], self.stats["active"])
+
+    def _release(self) -> None:
+        self.stats["active"] -= 1
+        if self._slots is not None:
+            self._slots.release()
+
+    def _should_fail(self) -> bool:
+        if self.profile.error_rate and self._rng.random() < self.profile.error_rate:
+            self.stats["errors"] += 1
+            return True
+        return False
+
+    def _is_unknown_model(self, model: str) -> bool:
+        if self.reject_unknown_models and model not in (self.model_name, f"{self.model_name}:latest"):
+            self.stats["unknown_models"] += 1
+            return True
+        return False
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+    async def ollama_generate(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        model = payload.get("model") or self.model_name
+        if self._is_unknown_model(model):
+            return web.json_response({"error": f"model '{model}' not found"}, status=404)
+        if not payload.get("prompt"):
+            # 不带提示的请求只加载模型（预热）
+            self.stats["warmups"] += 1
+            load_time = await self._ensure_loaded()
+            return web.json_response({
+                "model": model,
+                "created_at": self._now(),
+                "response": "",
+                "done": True,
+                "done_reason": "load",
+                "load_duration": int(load_time * _NANOSECONDS)
+            })
+
+        self.stats["requests"] += 1
+        if self._should_fail():
+            return web.json_response({"error": "mock backend error"}, status=500)
+
+        # 带上一轮context时只需预填充新的提示
+        context = payload.get("context") or []
+        if context:
+            self.stats["context_reused"] += 1
+        prompt_tokens = estimate_tokens(payload["prompt"]) + (0 if context else estimate_tokens(payload.get("system", "")))
+        tokens = self._response_tokens()
+        started_at = time.perf_counter()
+
+        await self._acquire()
+        response: Optional[web.StreamResponse] = None
+        try:
+            load_time = await self._ensure_loaded()
+            prefill_time = self._prefill_time(prompt_tokens)
+            await asyncio.sleep(prefill_time)
+
+            if payload.get("stream"):
+                self.stats["streams"] += 1
+                response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+                await response.prepare(request)
+
+            eval_begin = time.perf_counter()
+            for token in tokens:
+                await asyncio.sleep(self._token_interval())
+                if response is not None:
+                    await response.write((json.dumps({
+                        "model": model,
+                        "created_at": self._now(),
+                        "response": token,
+                        "done": False
+                    }, ensure_ascii=False) + "\n").encode("utf-8"))
+            eval_time = time.perf_counter() - eval_begin
+        except (ConnectionResetError, asyncio.CancelledError):
+            self.stats["disconnects"] += 1
+            raise
+        finally:
+            self._release()
+
+        self.stats["prompt_tokens"] += prompt_tokens
+        self.stats["completion_tokens"] += len(tokens)
+        final = {
+            "model": model,
+            "created_at": self._now(),
+            "response": "" if response is not None else "".join(tokens),
+            "done": True,
+            "done_reason": "stop",
+            "context": context + [self._rng.randrange(1, 32000) for _ in range(prompt_tokens + len(tokens))],
+            "total_duration": int((time.perf_counter() - started_at) * _NANOSECONDS),
+            "load_duration": int(load_time * _NANOSECONDS),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(prefill_time * _NANOSECONDS),
+            "eval_count": len(tokens),
+            "eval_duration": int(eval_time * _NANOSECONDS)
+        }
+        if response is None:
+            return web.json_response(final)
+        await response.write((json.dumps(final) + "\n").encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    async def open_webui_chat(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        model = payload.get("model") or self.model_name
+        if self._is_unknown_model(model):
+            return web.json_response({"detail": "Model not found"}, status=404)
+        self.stats["requests"] += 1
+        if self._should_fail():
+            return web.json_response({"detail": "mock backend error"}, status=500)
+
+        messages = payload.get("messages") or []
+        prompt_tokens = sum(estimate_tokens(message.get("content", "")) for message in messages)
+        tokens = self._response_tokens()
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> Dict[str, Any]:
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+
+        await self._acquire()
+        response: Optional[web.StreamResponse] = None
+        try:
+            await self._ensure_loaded()
+            await asyncio.sleep(self._prefill_time(prompt_tokens))
+
+            if payload.get("stream"):
+                self.stats["streams"] += 1
+                response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+                await response.prepare(request)
+
+            for token in tokens:
+                await asyncio.sleep(self._token_interval())
+                if response is not None:
+                    data = json.dumps(chunk({"content": token}), ensure_ascii=False)
+                    await response.write(f"data: {data}\n\n".encode("utf-8"))
+        except (ConnectionResetError, asyncio.CancelledError):
+            self.stats["disconnects"] += 1
+            raise
+        finally:
+            self._release()
+
+        self.stats["prompt_tokens"] += prompt_tokens
+        self.stats["completion_tokens"] += len(tokens)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens)
+        }
+        if response is None:
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop"
+                }],
+                "usage": usage
+            })
+        final = chunk({}, finish_reason="stop") | {"usage": usage}
+        await response.write(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def ollama_tags(self, request: web.Request) -> web.Response:
+        return web.json_response({"models": [{"name": self.model_name, "model": self.model_name}]})
+
+    async def open_webui_models(self, request: web.Request) -> web.Response:
+        return web.json_response({"data": [{"id": self.model_name, "object": "model"}]})
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+
+def build_profile(name: str, overrides: Dict[str, Any]) -> LatencyProfile:
+    """以预设为基础，覆盖命令行中指定的参数"""
+    profile = PROFILES[name]
+    known = {field.name for field in fields(LatencyProfile)}
+    return replace(profile, **{key: value for key, value in overrides.items() if key in known and value is not None})
+
+
+async def serve(host: str, port: int, server: MockLLMServer) -> None:
+    runner = web.AppRunner(server.create_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"模拟LLM服务已启动: http://{host}:{port}, 模型: {server.model_name}, 参数: {server.profile}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="模拟LLM服务（Ollama / Open-WebUI）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--model", default="gemma3:27b", help="健康检查返回的模型名")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="gpu", help="耗时预设")
+    parser.add_argument("--load-time", dest="load_time", type=float, help="首次加载模型的耗时（秒）")
+    parser.add_argument("--prefill-base", dest="prefill_base", type=float, help="固定的预填充耗时（秒）")
+    parser.add_argument("--prefill-tokens-per-second", dest="prefill_tokens_per_second", type=float, help="预填充速度")
+    parser.add_argument("--tokens-per-second", dest="tokens_per_second", type=float, help="输出速度")
+    parser.add_argument("--response-tokens", dest="response_tokens", type=int, help="回答的token数")
+    parser.add_argument("--jitter", type=float, help="随机浮动比例，如0.2表示±20%%")
+    parser.add_argument("--max-concurrency", dest="max_concurrency", type=int, help="同时生成的请求数，0表示不限")
+    parser.add_argument("--error-rate", dest="error_rate", type=float, help="返回500错误的概率")
+    parser.add_argument("--seed", type=int, default=None, help="随机数种子")
+    parser.add_argument(
+        "--reject-unknown-models", dest="reject_unknown_models", action="store_true",
+        help="请求的模型不是 --model 时返回404"
+    )
+    args = parser.parse_args()
+
+    profile = build_profile(args.profile, vars(args))
+    server = MockLLMServer(profile, args.model, seed=args.seed, reject_unknown_models=args.reject_unknown_models)
+    try:
+        asyncio.run(serve(args.host, args.port, server))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
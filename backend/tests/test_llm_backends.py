@@ -0,0 +1,123 @@
+"""
+LLM节点池的熔断与切换
+
+使用 benchmarks/mock_llm.py 启动本地模拟服务：模型不存在返回404，error_rate=1 时返回500。
+"""
+from dataclasses import replace
+from typing import AsyncIterator, Callable, List
+
+import pytest
+from aiohttp import web
+
+from app.core.config import settings
+from app.services.ai_service import ai_assistant
+from app.services.llm_backends import (
+    CIRCUIT_CLOSED,
+    CIRCUIT_OPEN,
+    LLMBackendError,
+    LLMRequestError,
+    llm_backend_pool
+)
+from app.services.llm_client import llm_client_pool
+from benchmarks.mock_llm import PROFILES, MockLLMServer
+
+MODEL = "mock-model"
+
+
+async def _start(server: MockLLMServer) -> web.AppRunner:
+    runner = web.AppRunner(server.create_app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    return runner
+
+
+@pytest.fixture
+async def start_backends(monkeypatch) -> AsyncIterator[Callable]:
+    """启动若干模拟Ollama节点并配置为节点池，参数为各节点的错误率"""
+    runners: List[web.AppRunner] = []
+
+    async def start(*error_rates: float) -> List[MockLLMServer]:
+        servers = [
+            MockLLMServer(replace(PROFILES["instant"], error_rate=rate), MODEL, seed=0, reject_unknown_models=True)
+            for rate in error_rates
+        ]
+        urls = []
+        for server in servers:
+            runner = await _start(server)
+            runners.append(runner)
+            host, port = runner.addresses[0][:2]
+            urls.append(f"http://{host}:{port}")
+        # settings 是代理对象，修改其内部的配置实例
+        monkeypatch.setattr(settings._settings, "OLLAMA_BASE_URLS", ",".join(urls))
+        monkeypatch.setattr(settings._settings, "OLLAMA_FALLBACK_MODEL_NAME", MODEL)
+        monkeypatch.setattr(settings._settings, "OLLAMA_USE_THINK_MODE", False)
+        monkeypatch.setattr(settings._settings, "LLM_CIRCUIT_FAILURE_THRESHOLD", 2)
+        monkeypatch.setattr(llm_backend_pool, "_endpoints", {})
+        return servers
+
+    yield start
+    await llm_client_pool.close()
+    for runner in runners:
+        await runner.cleanup()
+
+
+async def test_missing_model_does_not_trip_or_fail_over(start_backends):
+    first, second = await start_backends(0.0, 0.0)
+
+    for _ in range(settings.LLM_CIRCUIT_FAILURE_THRESHOLD + 1):
+        with pytest.raises(LLMRequestError):
+            await ai_assistant.generate("ollama", "你好", "missing-model")
+
+    # 404只发给评分最优的一个节点，不切换到其他节点或备用模型
+    assert first.stats["unknown_models"] + second.stats["unknown_models"] == settings.LLM_CIRCUIT_FAILURE_THRESHOLD + 1
+    assert first.stats["requests"] + second.stats["requests"] == 0
+    for endpoint in llm_backend_pool.endpoints("ollama"):
+        assert endpoint.state == CIRCUIT_CLOSED
+        assert endpoint.failures == 0
+    assert llm_backend_pool.available_count("ollama") == 2
+
+    assert await ai_assistant.generate("ollama", "你好", MODEL)
+
+
+async def test_missing_model_stream_does_not_trip(start_backends):
+    await start_backends(0.0)
+
+    route_info = {}
+    with pytest.raises(LLMRequestError):
+        async for _ in ai_assistant.generate_stream("ollama", "你好", "missing-model", route_info):
+            pass
+
+    endpoint = llm_backend_pool.endpoints("ollama")[0]
+    assert endpoint.state == CIRCUIT_CLOSED
+    assert endpoint.failures == 0
+    assert "endpoint" not in route_info
+
+
+async def test_server_error_fails_over_and_trips(start_backends):
+    failing, healthy = await start_backends(1.0, 0.0)
+    failing_endpoint, healthy_endpoint = llm_backend_pool.endpoints("ollama")
+    # 让失败的节点评分最优，先被尝试
+    healthy_endpoint.latency = 10.0
+
+    for _ in range(settings.LLM_CIRCUIT_FAILURE_THRESHOLD):
+        route_info = {}
+        assert await ai_assistant.generate("ollama", "你好", MODEL, route_info)
+        assert route_info["endpoint"] == healthy_endpoint.name
+
+    assert failing.stats["errors"] == settings.LLM_CIRCUIT_FAILURE_THRESHOLD
+    assert failing_endpoint.state == CIRCUIT_OPEN
+    assert healthy_endpoint.state == CIRCUIT_CLOSED
+
+    # 熔断后不再向失败的节点发送请求
+    await ai_assistant.generate("ollama", "你好", MODEL)
+    assert failing.stats["requests"] == settings.LLM_CIRCUIT_FAILURE_THRESHOLD
+    assert healthy.stats["requests"] == settings.LLM_CIRCUIT_FAILURE_THRESHOLD + 1
+
+
+async def test_server_error_on_all_endpoints(start_backends):
+    await start_backends(1.0)
+
+    with pytest.raises(LLMBackendError) as exc_info:
+        await ai_assistant.generate("ollama", "你好", MODEL)
+    assert not isinstance(exc_info.value, LLMRequestError)
+    assert llm_backend_pool.endpoints("ollama")[0].failures == 1
@@ -0,0 +1,84 @@
+"""
+上传文件的去重存储
+
+使用内存SQLite数据库，上传目录指向临时目录。
+"""
+import hashlib
+import io
+from pathlib import Path
+from typing import AsyncIterator
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from starlette.datastructures import Headers, UploadFile
+
+import app.models  # noqa: F401
+from app.core.config import settings
+from app.db.base import Base
+from app.models.uploads import Upload, UploadBlob
+from app.services.upload_service import upload_service
+
+CONTENT = "第一单元测验答案\n".encode("utf-8") * 100
+
+
+def _upload_file(filename: str, content: bytes) -> UploadFile:
+    return UploadFile(
+        file=io.BytesIO(content),
+        size=len(content),
+        filename=filename,
+        headers=Headers({"content-type": "text/plain"})
+    )
+
+
+@pytest.fixture
+async def db(tmp_path, monkeypatch) -> AsyncIterator[AsyncSession]:
+    # settings 是代理对象，修改其内部的配置实例
+    monkeypatch.setattr(settings._settings, "UPLOADS_DIR", str(tmp_path))
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)() as session:
+        yield session
+    await engine.dispose()
+
+
+async def _save(db: AsyncSession, filename: str, content: bytes = CONTENT):
+    return await upload_service.save_upload(
+        db=db, file=_upload_file(filename, content), module="test", uploader_id=1
+    )
+
+
+async def test_identical_uploads_share_one_blob(db):
+    first = await _save(db, "answers.txt")
+    second = await _save(db, "answers-copy.txt")
+
+    blobs = (await db.execute(select(UploadBlob))).scalars().all()
+    assert len(blobs) == 1
+    assert blobs[0].ref_count == 2
+    assert blobs[0].sha256 == hashlib.sha256(CONTENT).hexdigest()
+    assert first.file_path == second.file_path == blobs[0].storage_path
+    assert (Path(settings.UPLOADS_DIR) / blobs[0].storage_path).read_bytes() == CONTENT
+
+
+async def test_storage_path_does_not_reveal_hash(db):
+    upload = await _save(db, "answers.txt")
+
+    sha256 = hashlib.sha256(CONTENT).hexdigest()
+    # 公开的URL不能由文件内容推算出来
+    assert sha256 not in upload.file_path
+    assert sha256[:16] not in upload.file_url
+    assert upload.file_path.endswith(".txt")
+
+
+async def test_blob_removed_with_last_reference(db):
+    first = await _save(db, "answers.txt")
+    second = await _save(db, "answers-copy.txt")
+    path = Path(settings.UPLOADS_DIR) / first.file_path
+
+    assert await upload_service.delete_file(db=db, upload_id=first.id)
+    assert path.exists()
+    assert await upload_service.delete_file(db=db, upload_id=second.id)
+    assert not path.exists()
+    assert (await db.execute(select(func.count(UploadBlob.id)))).scalar_one() == 0
+    assert (await db.execute(select(func.count(Upload.id)))).scalar_one() == 0